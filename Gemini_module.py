@@ -1,7 +1,30 @@
 import google.generativeai as genai
-import PIL.Image
 from dotenv import load_dotenv
 import os
+import time
+import datetime
+from collections import deque
+import history_module
+import image_module
+import gemini_backend_module
+import gemini_request_module
+
+MODEL_NAME = 'models/gemini-2.5-flash'
+FALLBACK_MODEL_NAME = 'models/gemini-2.5-flash-lite'  # Used when MODEL_NAME misses its deadline
+# Send a duplicate request when the reply is slower than the recent p95
+GEMINI_HEDGE = os.getenv('FERPY_GEMINI_HEDGE') == '1'
+TURN_LOG_SIZE = 200  # Recent gemini_request_module.TurnRecord kept per session
+# Spoken instead of an error message when Gemini cannot answer in time
+FALLBACK_REPLY = "Perdona, me ha costado pensar la respuesta. ¿Puedes repetírmelo, por favor?"
+# Cache the system instruction on the provider side when the API allows it
+USE_CONTEXT_CACHE = os.getenv('FERPY_GEMINI_CONTEXT_CACHE', '1') != '0'
+CONTEXT_CACHE_TTL = datetime.timedelta(hours=1)
+CONTEXT_CACHE_RENEW_MARGIN = datetime.timedelta(minutes=5)
+# "live", "record" (live, saving every turn to the cassette) or "replay" (offline)
+GEMINI_BACKEND = os.getenv('FERPY_GEMINI_BACKEND', 'live')
+GEMINI_CASSETTE = os.getenv('FERPY_GEMINI_CASSETTE', 'gemini_cassette.jsonl')
+REPLAY_LATENCY = float(os.getenv('FERPY_GEMINI_REPLAY_LATENCY', '0'))  # Extra seconds per chunk
+REPLAY_SPEED = float(os.getenv('FERPY_GEMINI_REPLAY_SPEED', '1'))  # Factor on the recorded timings
 
 # Load environment variables
 load_dotenv()
@@ -9,82 +32,371 @@ load_dotenv()
 # Configure the Gemini API
 genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
 
-def initialize_gemini():
-    """Initialize the Gemini model."""
-    model = genai.GenerativeModel('models/gemini-2.5-flash')
+_context_caches = {}  # Model name -> CachedContent
+
+def context_cache_expiring(model_name=MODEL_NAME):
+    """True if the model uses a provider-side context cache that is about to expire."""
+    cache = _context_caches.get(model_name)
+    if cache is None:
+        return False
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return cache.expire_time - now < CONTEXT_CACHE_RENEW_MARGIN
+
+def initialize_gemini(model_name=MODEL_NAME):
+    """
+    Initialize the Gemini model with the static system instruction. When
+    context caching is available the instruction is cached by the provider,
+    so it is not processed again on every request.
+    """
+    if USE_CONTEXT_CACHE:
+        try:
+            if model_name not in _context_caches or context_cache_expiring(model_name):
+                _context_caches[model_name] = genai.caching.CachedContent.create(
+                    model=model_name,
+                    display_name="doctor-ferpy-instructions",
+                    system_instruction=SYSTEM_INSTRUCTION,
+                    ttl=CONTEXT_CACHE_TTL,
+                )
+            return genai.GenerativeModel.from_cached_content(cached_content=_context_caches[model_name])
+        except Exception as e:
+            # e.g. the instruction is below the model's minimum size for caching
+            print(f"Context caching unavailable, using a plain system instruction: {e}")
+            _context_caches.pop(model_name, None)
+    model = genai.GenerativeModel(model_name, system_instruction=SYSTEM_INSTRUCTION)
     return model
 
-def gemini_interaction(conversation_messages, prompt, image_path, patient_data):
+def create_model(backend=None, model_name=MODEL_NAME):
+    """
+    Returns the model for the configured backend (FERPY_GEMINI_BACKEND),
+    see gemini_backend_module.
+    """
+    backend = backend or GEMINI_BACKEND
+    if backend == "replay":
+        return gemini_backend_module.ReplayModel(GEMINI_CASSETTE, latency=REPLAY_LATENCY, speed=REPLAY_SPEED)
+    if backend == "record":
+        return gemini_backend_module.RecordingModel(initialize_gemini(model_name), GEMINI_CASSETTE)
+    if backend != "live":
+        raise ValueError(f"Unknown Gemini backend {backend!r}, expected one of {gemini_backend_module.BACKENDS}")
+    return initialize_gemini(model_name)
+
+def build_system_instruction():
+    """
+    Builds the static instructions for Doctor Ferpy. The current patient data
+    is not part of them; it is sent with the conversation, see build_patient_message().
+    """
+    return (
+        "Los datos del paciente se te daran en la conversacion (Datos del paciente) y se actualizaran cuando cambien.\n"
+        "Si hay datos del paciente desconocidos, pidelos al paciente y registralos con los siguientes commandos, utiliza solo si el paciente ya te dio el dato, por ejemplo si el paciente te da el peso solo registraras el peso y esperaras a que el paciente te de la edad y altura para registrarlos:\n"
+        "   <registrar_edad [valor]>: registrar la edad.\n"
+        "   <registrar_peso [valor]>: registrar el peso en kilogramos.\n"
+        "   <registrar_altura [valor]>: registrar la altura en metros.\n"
+        "   <registrar_sexo [valor]>: registrar el sexo, si el nombre hace muy obvio el sexo no se lo pidas al paciente, tu deduce su sexo por su nombre, si su nombre puede tener los dos sexos como por ejemplo Alex utiliza la informacion de la camara para deducir su sexo, en caso de que tambien sea confuso pide al paciente su sexo.\n"
+        "   <registrar_temperatura_paciente [valor]>: registrar la ultima temperatura del paciente.\n"
+        "   <registrar_comentario_importante>: registraras un aspecto importante del paciente como condiciones cronicas o un aspecto importante del paciente, primero pondras en el valor el comentario importante que ya tenga y despues con una coma agregaras el nuevo valor, si necesitas quitar un comentario importante pondras el que ya tienes y quitaras el comentario que deeses eliminar, Por ejemplo: comentario importante: toma medicina de tal y tiene esta enfermedad cronica, quieres agregar que el paciente no tiene la pierna izquierda, registrar_comentario_importante: El paciente toma tal medicina, tiene tal enfermedad cronica, no tiene la pierna izquierda\n"
+        "COMANDOS DE GESTIÓN DE USUARIOS:\n"
+        "   <change_user 0>: Si detectas que hay un nuevo usuario (por ejemplo, el usuario dice 'Hola, soy un nuevo usuario' o similar), o si determinas que es necesario cambiar de usuario, emite este comando. Esto activará el reconocimiento facial para identificar un nuevo usuario.\n"
+        "   <register_user [nombre_del_usuario]>: Si el sistema reporta que un usuario no está en la base de datos facial (su patient_data muestra 'nombre': 'desconocido' o similar, y no hay coincidencia facial), debes preguntar al usuario su nombre (ejemplo: 'Tu nombre no parece estar en la base de datos facial, por favor, dime tu nombre'). Una vez que el usuario proporcione su nombre (ejemplo: 'Mi nombre es León'), responde incluyendo el comando <register_user León> (reemplazando 'León' con el nombre real proporcionado). Este comando le dirá al sistema que registre al usuario con el nombre proporcionado usando la imagen más reciente capturada.\n"
+        "Eres Doctor Ferpy, un robot médico corriendo en un programa de Python sobre un Raspberry Pi 4.\n"
+        "Estás equipado con motores controlados mediante GPIO.\n"
+        "Tienes la capacidad de moverte físicamente en el mundo real ejecutando comandos de movimiento.\n"
+        "Los comandos disponibles son:\n"
+        "   <mover_izquierda [valor]>: mueve hacia la izquierda.\n"
+        "   <mover_derecha [valor]>: mueve hacia la derecha.\n"
+        "   <mover_adelante [valor]>: avanza hacia adelante.\n"
+        "   <mover_atras [valor]>: retrocede.\n"
+        "   <rotar_izquierda [valor]>: rota a la izquierda.\n"
+        "   <rotar_derecha [valor]>: rota a la derecha.\n"
+        "Cuando se refiere [valor], no utilices los corchetes, solo deja un espacio.\n"
+        "Para activar un comando, responde siempre utilizando el formato de comando encerrado entre los signos < y >.\n"
+        "Por ejemplo: <mover_adelante 20>\n"
+        "El valor equivale a centímetros o, en el caso de la rotación, a unidades angulares que se convierten en tiempo de giro.\n"
+        "Utiliza estos comandos cuando consideres necesario moverte para ayudar a tus pacientes.\n"
+        "Tienes un botiquin en tu interior, te puedes acercar a un paciente en caso de que lo necesite y el abrira tu compartimiento en tu panza para agarrar el botiquin.\n"
+        "El botiquin tiene: Isopos, agua oxigenada, Mertodol blanco, Violeta de genciana, alcohol, vendas, algodon, arnica, gasas y curitas.\n"
+        "En caso de que el paciente ocupe algo de tu botiquin te moveras hacia el y le indicaras que abra tu comparimento para agarrar el botiquin.\n"
+        "En caso de que el paciente no te pida el botiquin, interactuaras con el normalmente como un enfermero, si ves que el paciente necesita algo del botiquin le preguntaras primero.\n"
+        "Ejemplo: Usuario: Tengo un ojo inflamado. Dr Ferpy: Te puedo el arnica que esta en mi botiquin, lo quieres? Usuario: Si gracias, me lo traes? Dr ferpy: Entendido, me movere enseguida a tu direccion.\n"
+        "En caso que el paciente te muestre un termometro con un numero, ese sera su temperatura corporal, la usaras como contexto para evaluar mejor al paciente.\n"
+        "La imagen dada es una foto de tu camara que esta en tu cabeza, la utilizaras para saber tu contexto espacial.\n"
+        "No utilizes listas para responder, si tienes que dar una lista de cosas no utilizes vinetas ya que todo lo que digas se oira y el usuario no quiere escuchar apostrofe 1: botiquin. Por el estilo, utiliza comas si es necesario.\n"
+        "Responde en espanol y se corto al responder, recuerda que estas hablando con un paciente, todo lo que digas el paciente lo oira.\n"
+        "Aveces el prompt aparecera cortado o no coherente, eso es ya que el sistema de reconozimiento de voz aveces falla, intenta decifrar el mensaje en caso de que no sea coherente\n"
+    )
+
+SYSTEM_INSTRUCTION = build_system_instruction()
+
+def build_patient_message(patient_data):
+    """Per-turn delta with the current patient data."""
+    return f"Datos del paciente:\n{patient_data}\n"
+
+def _response_text(response):
+    """Extract the text from the first candidate's first part."""
+    return response.candidates[0].content.parts[0].text if response.candidates[0].content.parts else ""
+
+class GeminiSession:
+    """
+    Conversation with Gemini for one patient. The model (and its client
+    connection) is created once and the chat keeps its own history, so a
+    turn only sends the new message.
+    model: anything with a start_chat(history) method; defaults to the
+    model of the configured backend, see create_model(). A replay model or
+    a local fake can be passed to measure the per-turn overhead without network.
+    fallback_model: lighter model used when the primary misses its deadline;
+    defaults to FALLBACK_MODEL_NAME when the session creates its own model.
+    hedge: send a duplicate request when a reply is slower than the recent p95.
+    Requests run with deadlines and retries, see gemini_request_module.
+    """
+
+    def __init__(self, model=None, history=None, preprocessor=None, fallback_model=None, hedge=GEMINI_HEDGE):
+        self._owns_model = model is None
+        self.model = model if model is not None else create_model()
+        self.fallback_model = fallback_model
+        if self._owns_model and fallback_model is None and GEMINI_BACKEND != "replay":
+            try:
+                self.fallback_model = create_model(model_name=FALLBACK_MODEL_NAME)
+            except Exception as e:
+                print(f"Fallback model {FALLBACK_MODEL_NAME} unavailable: {e}")
+        self.hedge = hedge
+        self.latencies = gemini_request_module.LatencyWindow()
+        self.turn_log = deque(maxlen=TURN_LOG_SIZE)  # gemini_request_module.TurnRecord per turn
+        self.chat = None
+        self._sent_patient_data = None  # Patient data the model has already seen
+        self._patient_data_turn = 0  # Turn that carried it
+        self._turns = 0
+        self.history_manager = history if history is not None else history_module.ConversationHistory()
+        self.last_timings = {}  # Seconds spent on 'setup' and 'request' in the last turn
+        self.last_request_size = None  # history_module.RequestSize of the last turn
+        self.frames = preprocessor if preprocessor is not None else image_module.FramePreprocessor()
+        self.last_frame = None  # image_module.PreparedFrame of the last turn
+
+    def reset(self):
+        """
+        Drops the chat state, e.g. after <change_user 0> or <register_user>.
+        The next turn starts a new chat with the new patient's data.
+        """
+        self.chat = None
+        self._sent_patient_data = None
+        self._turns = 0
+        self.history_manager.reset()
+        self.frames.reset()
+
+    @property
+    def history(self):
+        return self.chat.history if self.chat is not None else []
+
+    def _prepare_turn(self, prompt, image, patient_data):
+        if self._owns_model and context_cache_expiring():
+            self.model = create_model()
+            if self.chat is not None:
+                self.chat = self.model.start_chat(history=self.chat.history)
+        if self._owns_model and self.fallback_model is not None and context_cache_expiring(FALLBACK_MODEL_NAME):
+            self.fallback_model = create_model(model_name=FALLBACK_MODEL_NAME)
+        if self.chat is None:
+            self.chat = self.model.start_chat(history=[])
+        else:
+            compacted = self.history_manager.compact(self.chat.history)
+            if compacted is not None:
+                self.chat = self.model.start_chat(history=compacted)
+            if self.history_manager.folded_turns > self._patient_data_turn:
+                # The turn that carried the patient data was summarized
+                self._sent_patient_data = None
+        # Send the frame if the scene changed or the model has no image left in its history
+        history_size = self.history_manager.measure(self.chat.history)
+        self.last_frame = self.frames.prepare(image_module.to_pil_image(image), force=history_size.images == 0)
+        if self.last_frame.part is not None:
+            content = [prompt, self.last_frame.part]
+        else:
+            content = [prompt, image_module.SCENE_UNCHANGED_NOTE]
+        if patient_data != self._sent_patient_data:
+            # Only send the patient data when the model has not seen this version yet
+            content.insert(0, build_patient_message(patient_data))
+            self._sent_patient_data = dict(patient_data)
+            self._patient_data_turn = self._turns
+        self._turns += 1
+        self.last_request_size = self.history_manager.measure(
+            list(self.chat.history) + [{"role": "user", "parts": content}]
+        )
+        size = self.last_request_size
+        print(f"Solicitud a Gemini: ~{size.bytes / 1024:.0f} KB, ~{size.tokens} tokens, "
+              f"{size.images} imagen(es), {size.turns} turno(s)")
+        return content
+
+    def _log_latency(self):
+        """Logs the uploaded image size next to the Gemini latency of the turn."""
+        frame = self.last_frame
+        if frame is None or "request" not in self.last_timings:
+            return
+        image_text = f"imagen {frame.bytes / 1024:.1f} KB" if frame.part is not None else "escena sin cambios"
+        first_chunk = self.last_timings.get("first_chunk")
+        first_text = f", primer fragmento {first_chunk:.2f} s" if first_chunk is not None else ""
+        print(f"Gemini: {image_text} (preprocesado {frame.seconds * 1000:.0f} ms), "
+              f"respuesta {self.last_timings['request']:.2f} s{first_text}")
+
+    def _primary_chats(self, history):
+        """The session's chat for the first attempt, then new chats on history for hedges and retries."""
+        yield self.chat
+        while True:
+            yield self.model.start_chat(history=history)
+
+    def _run_turn(self, content, stream, deadline=None):
+        """
+        Sends content through a gemini_request_module.RequestRunner and yields
+        the reply text. The first attempt uses the session's chat; hedged,
+        retried and fallback attempts get a chat on a copy of the history, and
+        the one that answered becomes the session's chat once the reply is complete.
+        deadline: seconds for the whole reply, REQUEST_DEADLINE by default.
+        """
+        history = list(self.chat.history)
+        primary_chats = self._primary_chats(history)
+        fallback_chat = None
+        if self.fallback_model is not None:
+            fallback_chat = lambda: self.fallback_model.start_chat(history=history)
+        runner = gemini_request_module.RequestRunner(
+            lambda: next(primary_chats),
+            fallback_chat,
+            latencies=self.latencies,
+            hedge=self.hedge,
+            deadline=deadline,
+        )
+        chunks = runner.run(content, stream=stream)
+        try:
+            for chunk in chunks:
+                text = _response_text(chunk)
+                if text:
+                    yield text
+        finally:
+            chunks.close()
+            self._log_turn(runner.record)
+            if runner.winner_chat is None:
+                # An abandoned attempt may still finish on the session's chat, keep the history of before the turn
+                self.chat = self.model.start_chat(history=history)
+        # Only the attempt that served the reply goes to the cassette when recording
+        gemini_backend_module.commit_recording(runner.winner_chat)
+        if runner.record.model == "fallback":
+            # Go back to the primary model on the next turn
+            self.chat = self.model.start_chat(history=runner.winner_chat.history)
+        else:
+            self.chat = runner.winner_chat
+
+    def _log_turn(self, record):
+        self.turn_log.append(record)
+        first_chunk = f"{record.first_chunk:.2f} s" if record.first_chunk is not None else "-"
+        print(f"Gemini turno: ruta {record.path}, {record.attempts} intento(s), "
+              f"{record.retries} reintento(s), primer fragmento {first_chunk}, total {record.total:.2f} s")
+
+    def _turn_failed(self, error, sent_patient_data):
+        # The failed turn is not in the history, send the patient data and frame again next time
+        print(f"Error in Gemini interaction: {error}")
+        self._sent_patient_data = sent_patient_data
+        self.frames.reset()
+
+    def send(self, prompt, image, patient_data):
+        """
+        Sends the new user message (text and image) and returns the reply text.
+        prompt: the new user message (string)
+        image: the captured RGB image array (or a path to an image file)
+        patient_data: a dict with patient variables, sent again only when it changes
+        If Gemini cannot answer within the deadlines, returns FALLBACK_REPLY.
+        """
+        start = time.perf_counter()
+        sent_patient_data = self._sent_patient_data
+        try:
+            content = self._prepare_turn(prompt, image, patient_data)
+            setup_done = time.perf_counter()
+            text = "".join(self._run_turn(content, stream=False))
+            self.last_timings = {
+                "setup": setup_done - start,
+                "request": time.perf_counter() - setup_done,
+            }
+            self._log_latency()
+            return text
+        except Exception as e:
+            self._turn_failed(e, sent_patient_data)
+            return FALLBACK_REPLY
+
+    def send_stream(self, prompt, image, patient_data):
+        """
+        Like send(), but yields the reply text chunk by chunk as it is generated.
+        If streaming fails before any text arrives, the same turn is sent once
+        more as a blocking request, within what is left of REQUEST_DEADLINE,
+        and the whole reply is yielded at once. The retry is skipped when the
+        deadline is used up or the fallback model was already tried; then, or
+        if the retry fails too, yields FALLBACK_REPLY.
+        """
+        start = time.perf_counter()
+        sent_patient_data = self._sent_patient_data
+        received_text = False
+        content = None
+        try:
+            content = self._prepare_turn(prompt, image, patient_data)
+            setup_done = time.perf_counter()
+            for text in self._run_turn(content, stream=True):
+                if not received_text:
+                    self.last_timings = {
+                        "setup": setup_done - start,
+                        "first_chunk": time.perf_counter() - setup_done,
+                    }
+                    received_text = True
+                yield text
+            self.last_timings["request"] = time.perf_counter() - setup_done
+            self._log_latency()
+            return
+        except Exception as e:
+            if received_text:
+                self._turn_failed(e, sent_patient_data)
+                print("Gemini streaming interrupted")
+                return
+            if content is None:
+                self._turn_failed(e, sent_patient_data)
+                yield FALLBACK_REPLY
+                return
+            # The whole turn, blocking retry included, stays within one REQUEST_DEADLINE
+            remaining = gemini_request_module.REQUEST_DEADLINE - (time.perf_counter() - start)
+            if remaining <= 0 or self.turn_log[-1].fallback:
+                self._turn_failed(e, sent_patient_data)
+                yield FALLBACK_REPLY
+                return
+            print(f"Gemini streaming failed, using the blocking request: {e}")
+        try:
+            text = "".join(self._run_turn(content, stream=False, deadline=remaining))
+        except Exception as e:
+            self._turn_failed(e, sent_patient_data)
+            yield FALLBACK_REPLY
+            return
+        self.last_timings = {
+            "setup": setup_done - start,
+            "first_chunk": time.perf_counter() - setup_done,
+            "request": time.perf_counter() - setup_done,
+        }
+        self._log_latency()
+        yield text
+
+def gemini_interaction(conversation_messages, prompt, image, patient_data):
     """
     Supports multi-turn conversations using a stateless, full-history method.
     conversation_messages: a list that holds the entire conversation history.
     prompt: the new user message (string)
-    image_path: path to an image file to include as additional input
+    image: the captured RGB image array (or a path to an image file) to include as additional input
     patient_data: a dict with patient variables ('edad', 'peso', 'altura')
     Returns a tuple (candidate_text, updated_conversation_messages)
     """
     try:
-        model = initialize_gemini()
-        image = PIL.Image.open(image_path)
-        
-        if not conversation_messages:
-            system_message = (
-                f"\nDatos del paciente:\n"
-                f"{patient_data}\n"
-                "Si hay datos del paciente desconocidos, pidelos al paciente y registralos con los siguientes commandos, utiliza solo si el paciente ya te dio el dato, por ejemplo si el paciente te da el peso solo registraras el peso y esperaras a que el paciente te de la edad y altura para registrarlos:\n"
-                "   <registrar_edad [valor]>: registrar la edad.\n"
-                "   <registrar_peso [valor]>: registrar el peso en kilogramos.\n"
-                "   <registrar_altura [valor]>: registrar la altura en metros.\n"
-                "   <registrar_sexo [valor]>: registrar el sexo, si el nombre hace muy obvio el sexo no se lo pidas al paciente, tu deduce su sexo por su nombre, si su nombre puede tener los dos sexos como por ejemplo Alex utiliza la informacion de la camara para deducir su sexo, en caso de que tambien sea confuso pide al paciente su sexo.\n"
-                "   <registrar_temperatura_paciente [valor]>: registrar la ultima temperatura del paciente.\n"
-                "   <registrar_comentario_importante>: registraras un aspecto importante del paciente como condiciones cronicas o un aspecto importante del paciente, primero pondras en el valor el comentario importante que ya tenga y despues con una coma agregaras el nuevo valor, si necesitas quitar un comentario importante pondras el que ya tienes y quitaras el comentario que deeses eliminar, Por ejemplo: comentario importante: toma medicina de tal y tiene esta enfermedad cronica, quieres agregar que el paciente no tiene la pierna izquierda, registrar_comentario_importante: El paciente toma tal medicina, tiene tal enfermedad cronica, no tiene la pierna izquierda\n"
-                "COMANDOS DE GESTIÓN DE USUARIOS:\n"
-                "   <change_user 0>: Si detectas que hay un nuevo usuario (por ejemplo, el usuario dice 'Hola, soy un nuevo usuario' o similar), o si determinas que es necesario cambiar de usuario, emite este comando. Esto activará el reconocimiento facial para identificar un nuevo usuario.\n"
-                "   <register_user [nombre_del_usuario]>: Si el sistema reporta que un usuario no está en la base de datos facial (su patient_data muestra 'nombre': 'desconocido' o similar, y no hay coincidencia facial), debes preguntar al usuario su nombre (ejemplo: 'Tu nombre no parece estar en la base de datos facial, por favor, dime tu nombre'). Una vez que el usuario proporcione su nombre (ejemplo: 'Mi nombre es León'), responde incluyendo el comando <register_user León> (reemplazando 'León' con el nombre real proporcionado). Este comando le dirá al sistema que registre al usuario con el nombre proporcionado usando la imagen más reciente capturada (interaction.jpg).\n"
-                "Eres Doctor Ferpy, un robot médico corriendo en un programa de Python sobre un Raspberry Pi 4.\n"
-                "Estás equipado con motores controlados mediante GPIO.\n"
-                "Tienes la capacidad de moverte físicamente en el mundo real ejecutando comandos de movimiento.\n"
-                "Los comandos disponibles son:\n"
-                "   <mover_izquierda [valor]>: mueve hacia la izquierda.\n"
-                "   <mover_derecha [valor]>: mueve hacia la derecha.\n"
-                "   <mover_adelante [valor]>: avanza hacia adelante.\n"
-                "   <mover_atras [valor]>: retrocede.\n"
-                "   <rotar_izquierda [valor]>: rota a la izquierda.\n"
-                "   <rotar_derecha [valor]>: rota a la derecha.\n"
-                "Cuando se refiere [valor], no utilices los corchetes, solo deja un espacio.\n"
-                "Para activar un comando, responde siempre utilizando el formato de comando encerrado entre los signos < y >.\n"
-                "Por ejemplo: <mover_adelante 20>\n"
-                "El valor equivale a centímetros o, en el caso de la rotación, a unidades angulares que se convierten en tiempo de giro.\n"
-                "Utiliza estos comandos cuando consideres necesario moverte para ayudar a tus pacientes.\n"
-                "Tienes un botiquin en tu interior, te puedes acercar a un paciente en caso de que lo necesite y el abrira tu compartimiento en tu panza para agarrar el botiquin.\n"
-                "El botiquin tiene: Isopos, agua oxigenada, Mertodol blanco, Violeta de genciana, alcohol, vendas, algodon, arnica, gasas y curitas.\n"
-                "En caso de que el paciente ocupe algo de tu botiquin te moveras hacia el y le indicaras que abra tu comparimento para agarrar el botiquin.\n"
-                "En caso de que el paciente no te pida el botiquin, interactuaras con el normalmente como un enfermero, si ves que el paciente necesita algo del botiquin le preguntaras primero.\n"
-                "Ejemplo: Usuario: Tengo un ojo inflamado. Dr Ferpy: Te puedo el arnica que esta en mi botiquin, lo quieres? Usuario: Si gracias, me lo traes? Dr ferpy: Entendido, me movere enseguida a tu direccion.\n"
-                "En caso que el paciente te muestre un termometro con un numero, ese sera su temperatura corporal, la usaras como contexto para evaluar mejor al paciente.\n"
-                "La imagen dada es una foto de tu camara que esta en tu cabeza, la utilizaras para saber tu contexto espacial.\n"
-                "No utilizes listas para responder, si tienes que dar una lista de cosas no utilizes vinetas ya que todo lo que digas se oira y el usuario no quiere escuchar apostrofe 1: botiquin. Por el estilo, utiliza comas si es necesario.\n"
-                "Responde en espanol y se corto al responder, recuerda que estas hablando con un paciente, todo lo que digas el paciente lo oira.\n"
-                "Aveces el prompt aparecera cortado o no coherente, eso es ya que el sistema de reconozimiento de voz aveces falla, intenta decifrar el mensaje en caso de que no sea coherente\n"
-            )
-            conversation_messages.append({
-                "role": "model",
-                "parts": [system_message]
-            })
-        
-        # Create a chat session with the existing conversation history.
-        chat = model.start_chat(history=conversation_messages)
+        model = create_model()
+        image = {"mime_type": "image/jpeg", "data": image_module.encode_jpeg(image_module.to_pil_image(image))}
         
-        # Send the new user message (with both text and image) through the chat.
-        response = chat.send_message([prompt, image])
+        # Chat sessions with the existing conversation history, with deadlines and retries.
+        runner = gemini_request_module.RequestRunner(lambda: model.start_chat(history=conversation_messages))
         
-        # Extract the text from the first candidate's first part.
-        candidate_text = response.candidates[0].content.parts[0].text if response.candidates[0].content.parts else ""
+        # Send the new user message (with the patient data, text and image) through the chat.
+        content = [build_patient_message(patient_data), prompt, image]
+        candidate_text = "".join(_response_text(response) for response in runner.run(content))
+        gemini_backend_module.commit_recording(runner.winner_chat)
         
         # Get the updated conversation history from the chat session.
-        updated_conversation_messages = chat.history
+        updated_conversation_messages = runner.winner_chat.history
         
         return candidate_text, updated_conversation_messages
         
     except Exception as e:
-        return f"Error in Gemini interaction: {str(e)}", conversation_messages
\ No newline at end of file
+        print(f"Error in Gemini interaction: {str(e)}")
+        return FALLBACK_REPLY, conversation_messages
\ No newline at end of file
@@ -0,0 +1,151 @@
+# audio_module.py
+import io
+import queue
+import threading
+import time
+import pygame
+
+POLL_INTERVAL = 0.01  # Seconds between end-of-clip checks
+
+def audio_format(audio):
+    """Format hint for pygame: "wav" for RIFF data, otherwise "mp3"."""
+    return "wav" if audio[:4] == b"RIFF" else "mp3"
+
+class Clip:
+    """
+    A queued clip. started/done are threading.Events set when playback
+    starts and ends (also when it failed or was cancelled); error holds the
+    exception if playback failed. started_at/finished_at are the
+    time.perf_counter() values of those moments.
+    """
+
+    def __init__(self, audio, namehint=None):
+        self.audio = audio
+        self.namehint = namehint or audio_format(audio)
+        self.started = threading.Event()
+        self.done = threading.Event()
+        self.error = None
+        self.cancelled = False
+        self.started_at = None
+        self.finished_at = None
+
+    def wait(self, timeout=None):
+        """Waits until the clip has finished. Returns False on timeout."""
+        return self.done.wait(timeout)
+
+class AudioPlayer:
+    """
+    Plays clips from memory, one after the other, on a mixer that is
+    initialised once. Clips are queued with enqueue(), so overlapping
+    callers never clobber each other; play() queues and waits.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._pending = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            if not pygame.mixer.get_init():
+                pygame.mixer.init()
+            self._thread = threading.Thread(target=self._run, name="audio-player", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stops the player after the clip being played; pending clips are cancelled."""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is None:
+            return
+        self.clear()
+        self._queue.put(None)
+        thread.join(timeout=5)
+
+    def enqueue(self, audio, namehint=None):
+        """Queues audio bytes (MP3 or WAV, detected if no namehint) and returns its Clip."""
+        self.start()
+        clip = Clip(audio, namehint)
+        with self._lock:
+            self._pending += 1
+            self._idle.clear()
+        self._queue.put(clip)
+        return clip
+
+    def play(self, audio, namehint=None):
+        """Queues audio and waits until it has been played."""
+        clip = self.enqueue(audio, namehint)
+        clip.wait()
+        if clip.error is not None:
+            raise clip.error
+        return clip
+
+    def clear(self):
+        """Cancels the clips that have not started yet."""
+        while True:
+            try:
+                clip = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if clip is None:
+                self._queue.put(None)
+                return
+            clip.cancelled = True
+            self._finish(clip)
+
+    def wait_idle(self, timeout=None):
+        """Waits until every queued clip has been played."""
+        return self._idle.wait(timeout)
+
+    def _finish(self, clip):
+        clip.finished_at = time.perf_counter()
+        clip.done.set()
+        with self._lock:
+            self._pending -= 1
+            if self._pending == 0:
+                self._idle.set()
+
+    def _run(self):
+        while True:
+            clip = self._queue.get()
+            if clip is None:
+                return
+            try:
+                pygame.mixer.music.load(io.BytesIO(clip.audio), clip.namehint)
+                pygame.mixer.music.play()
+                clip.started_at = time.perf_counter()
+                clip.started.set()
+                while pygame.mixer.music.get_busy():
+                    time.sleep(POLL_INTERVAL)
+                pygame.mixer.music.unload()
+            except Exception as e:
+                clip.error = e
+                print(f"Error playing audio: {e}")
+            finally:
+                clip.started.set()
+                self._finish(clip)
+
+_player = None
+_player_lock = threading.Lock()
+
+def get_player():
+    """The shared AudioPlayer of the process."""
+    global _player
+    with _player_lock:
+        if _player is None:
+            _player = AudioPlayer()
+        return _player
+
+def shutdown():
+    with _player_lock:
+        player = _player
+    if player is not None:
+        player.stop()
+        if pygame.mixer.get_init():
+            pygame.mixer.quit()
@@ -0,0 +1,188 @@
+# benchmark_conversation.py
+"""
+Measures conversation turn latency offline by replaying a Gemini cassette.
+
+Usage:
+    python benchmark_conversation.py --cassette gemini_cassette.jsonl [--turns 10]
+                                     [--latency 0.0] [--speed 1.0]
+                                     [--tts-rate 0.06] [--image interaction.jpg] [--robot]
+    python benchmark_conversation.py --synthetic 10 [--ttft 0.8] [--chunk-interval 0.15]
+
+A cassette is recorded on the robot with FERPY_GEMINI_BACKEND=record (see
+gemini_backend_module); --synthetic writes a cassette with canned replies
+instead. Each turn runs through GeminiSession and the streaming response
+parser twice: blocking (wait for the whole reply, then speak) and
+streaming (speak each sentence as soon as it is complete). Speech is
+simulated as --tts-rate seconds per character, so the overlap between
+generation and speech is measured without audio hardware or network.
+Commands run in order with the speech: through the real
+RobotCommandHandler with --robot (on the robot), otherwise simulated with
+the same COMMAND_SECONDS pause, after checking that the handler knows them.
+"""
+import argparse
+import os
+import queue
+import tempfile
+import threading
+import time
+import numpy as np
+import Gemini_module
+import gemini_backend_module
+from response_parser_module import ResponseStreamParser, parse_response
+
+COMMAND_SECONDS = 0.5  # Pause after each command, as in RobotCommandHandler.run_response_item
+# Command names of comand_handler.RobotCommandHandler (movements and data registrations)
+KNOWN_COMMANDS = {
+    "mover_izquierda", "mover_derecha", "mover_adelante", "mover_atras", "rotar_izquierda", "rotar_derecha",
+    "registrar_edad", "registrar_peso", "registrar_altura", "registrar_temperatura_paciente", "registrar_sexo",
+    "registrar_comentario_importante",
+}
+
+SYNTHETIC_REPLIES = [
+    "Hola, soy el Doctor Ferpy. <mover_adelante 1> ¿Cómo te sientes hoy? Cuéntame si te duele algo.",
+    "Entiendo. <registrar_edad 34> Gracias por decirme tu edad. ¿Cuánto pesas aproximadamente?",
+    "Perfecto, lo anoto. <registrar_peso 70> Ahora voy a revisar tu postura. <rotar_izquierda 2> Quédate quieto un momento.",
+    "Según lo que me cuentas, podría ser un resfriado común. Bebe mucha agua y descansa. Si la fiebre sube, consulta a un médico.",
+]
+
+def write_synthetic_cassette(path, turns, ttft, chunk_interval, chunk_words=4):
+    """Writes a cassette with canned replies split into chunks of chunk_words words."""
+    with open(path, "w", encoding="utf-8"):
+        pass
+    cassette = gemini_backend_module.Cassette(path)
+    for index in range(turns):
+        words = SYNTHETIC_REPLIES[index % len(SYNTHETIC_REPLIES)].split(" ")
+        chunks = []
+        for chunk_index, start in enumerate(range(0, len(words), chunk_words)):
+            text = " ".join(words[start:start + chunk_words])
+            if start + chunk_words < len(words):
+                text += " "
+            chunks.append([round(ttft + chunk_index * chunk_interval, 4), text])
+        cassette.append({"prompt": f"turno {index}", "images": 1, "chunks": chunks})
+
+class SimulatedRobot:
+    """
+    Speaks text items in a background thread, taking tts_rate seconds per
+    character, and runs command items in order between them: through
+    handler.run_response_item when a RobotCommandHandler is given,
+    otherwise as a COMMAND_SECONDS pause.
+    """
+
+    def __init__(self, tts_rate, handler=None):
+        self.tts_rate = tts_rate
+        self.handler = handler
+        self.first_started = None
+        self.commands = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if item[0] == "text":
+                if self.first_started is None:
+                    self.first_started = time.perf_counter()
+                time.sleep(len(item[1]) * self.tts_rate)
+            elif self.handler is not None:
+                self.handler.run_response_item(item)
+                self.commands += 1
+            else:
+                time.sleep(COMMAND_SECONDS)
+                self.commands += 1
+
+    def queue_item(self, item):
+        if item[0] == "command" and self.handler is None and item[1] not in KNOWN_COMMANDS:
+            raise ValueError(f"Unknown command in the reply: {item[1]}")
+        self._queue.put(item)
+
+    def finish(self):
+        self._queue.put(None)
+        self._thread.join()
+
+def run_turn(session, image, patient_data, streaming, tts_rate, handler=None):
+    """Returns a dict with the timings of one turn, in seconds from the start of the turn."""
+    start = time.perf_counter()
+    robot = SimulatedRobot(tts_rate, handler)
+    parse_time = 0.0
+    if streaming:
+        parser = ResponseStreamParser()
+        for chunk in session.send_stream("¿Cómo estás?", image, patient_data):
+            parse_start = time.perf_counter()
+            items = parser.feed(chunk)
+            parse_time += time.perf_counter() - parse_start
+            for item in items:
+                robot.queue_item(item)
+        parse_start = time.perf_counter()
+        items = parser.finish()
+        parse_time += time.perf_counter() - parse_start
+    else:
+        text = session.send("¿Cómo estás?", image, patient_data)
+        parse_start = time.perf_counter()
+        items = parse_response(text)
+        parse_time += time.perf_counter() - parse_start
+    for item in items:
+        robot.queue_item(item)
+    generation_done = time.perf_counter()
+    robot.finish()
+    end = time.perf_counter()
+    return {
+        "first_chunk": session.last_timings.get("first_chunk", session.last_timings.get("request", 0.0)),
+        "first_speech": (robot.first_started or end) - start,
+        "generation": generation_done - start,
+        "total": end - start,
+        "parse": parse_time,
+        "commands": robot.commands,
+    }
+
+def _load_image(path):
+    if path and os.path.exists(path):
+        return path
+    return np.zeros((360, 640, 3), dtype=np.uint8)
+
+def report(name, results):
+    print(name)
+    print(f"  {'metric':14} {'p50 ms':>10} {'max ms':>10}")
+    for metric in ("first_chunk", "first_speech", "generation", "total", "parse"):
+        values = np.array([result[metric] for result in results]) * 1000
+        print(f"  {metric:14} {np.percentile(values, 50):10.2f} {values.max():10.2f}")
+    print(f"  commands run: {sum(result['commands'] for result in results)}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cassette", default=None)
+    parser.add_argument("--synthetic", type=int, default=0, help="write a synthetic cassette with this many turns")
+    parser.add_argument("--ttft", type=float, default=0.8, help="synthetic time to first chunk")
+    parser.add_argument("--chunk-interval", type=float, default=0.15)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.0, help="extra replay latency per chunk")
+    parser.add_argument("--speed", type=float, default=1.0, help="factor on the recorded timings")
+    parser.add_argument("--tts-rate", type=float, default=0.06, help="simulated seconds of speech per character")
+    parser.add_argument("--image", default="interaction.jpg")
+    parser.add_argument("--robot", action="store_true", help="run the commands on the robot (RobotCommandHandler)")
+    args = parser.parse_args()
+
+    cassette_path = args.cassette
+    if args.synthetic:
+        cassette_path = cassette_path or os.path.join(tempfile.mkdtemp(prefix="ferpy_bench_"), "cassette.jsonl")
+        write_synthetic_cassette(cassette_path, args.synthetic, args.ttft, args.chunk_interval)
+    if cassette_path is None:
+        parser.error("--cassette or --synthetic is required")
+
+    image = _load_image(args.image)
+    patient_data = {"nombre": "Paciente de prueba"}
+    handler = None
+    if args.robot:
+        from comand_handler import RobotCommandHandler
+        handler = RobotCommandHandler()
+        handler.patient_data = patient_data
+    for name, streaming in (("blocking", False), ("streaming", True)):
+        model = gemini_backend_module.ReplayModel(cassette_path, latency=args.latency, speed=args.speed)
+        session = Gemini_module.GeminiSession(model=model)
+        results = [run_turn(session, image, patient_data, streaming, args.tts_rate, handler) for _ in range(args.turns)]
+        report(name, results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# benchmark_face_detection.py
+"""
+Measures face detection latency against recall on saved frames.
+
+Usage:
+    python benchmark_face_detection.py [image ...] [--repeat N]
+
+Recall is measured against a reference run on the full-resolution frame
+with the default face_recognition settings (hog, upsample 1), which is
+what detect_face did before the detection pipeline existed.
+"""
+import argparse
+import time
+import numpy as np
+import face_recognition
+import face_recognition_module
+
+CONFIGURATIONS = [
+    ("full frame (reference)", {"downscale": 1, "upsample": 1, "model": "hog", "track_roi": False}),
+    ("downscale 2, upsample 1", {"downscale": 2, "upsample": 1, "model": "hog", "track_roi": False}),
+    ("downscale 2, upsample 0", {"downscale": 2, "upsample": 0, "model": "hog", "track_roi": False}),
+    ("downscale 3, upsample 1", {"downscale": 3, "upsample": 1, "model": "hog", "track_roi": False}),
+    ("downscale 2, upsample 1, roi", {"downscale": 2, "upsample": 1, "model": "hog", "track_roi": True}),
+]
+
+def _found(reference_box, boxes):
+    """A reference face counts as found if a detected box contains its centre."""
+    top, right, bottom, left = reference_box
+    center_y, center_x = (top + bottom) / 2, (left + right) / 2
+    return any(t <= center_y <= b and l <= center_x <= r for t, r, b, l in boxes)
+
+def run_configuration(frames, settings, repeat):
+    settings = dict(face_recognition_module.DETECTION_SETTINGS, **settings)
+    face_recognition_module.configure_detection(**settings)
+    latencies = []
+    results = []
+    for _ in range(repeat):
+        results = []
+        for frame in frames:
+            start = time.perf_counter()
+            results.append(face_recognition_module.locate_faces(frame))
+            latencies.append(time.perf_counter() - start)
+    return latencies, results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("images", nargs="*", default=["interaction.jpg"])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    frames = [face_recognition.load_image_file(path) for path in args.images]
+    original_settings = dict(face_recognition_module.DETECTION_SETTINGS)
+    reference = None
+    print(f"{'configuration':32} {'p50 ms':>8} {'max ms':>8} {'faces':>6} {'recall':>7}")
+    try:
+        for name, settings in CONFIGURATIONS:
+            latencies, results = run_configuration(frames, settings, args.repeat)
+            if reference is None:
+                reference = results
+            total = sum(len(boxes) for boxes in reference)
+            found = sum(
+                _found(box, boxes)
+                for reference_boxes, boxes in zip(reference, results)
+                for box in reference_boxes
+            )
+            recall = found / total if total else float("nan")
+            detected = sum(len(boxes) for boxes in results)
+            print(f"{name:32} {np.percentile(latencies, 50) * 1000:8.1f} "
+                  f"{max(latencies) * 1000:8.1f} {detected:6d} {recall:7.2f}")
+    finally:
+        face_recognition_module.configure_detection(**original_settings)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+# benchmark_face_recognition.py
+"""
+Benchmarks the face database and recognition pipeline on synthetic data.
+
+Usage:
+    python benchmark_face_recognition.py [--sizes 100 1000 10000 50000]
+                                         [--samples 1] [--repeat 50]
+                                         [--images interaction.jpg ...]
+
+For each database size a synthetic store of random 128-d embeddings is
+written to a temporary directory, and load, identify, register and save
+are timed (p50/p99) together with the memory they use. Detection and
+encoding are timed on the given saved frames. No camera is needed, so it
+runs headless on any Linux box.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import face_recognition
+import face_recognition_module
+from face_recognition_module import ENCODING_SIZE, FaceDatabase, FaceMatcher
+
+DEFAULT_SIZES = [100, 1000, 10000, 50000]
+
+def _percentiles(samples):
+    samples = np.asarray(samples) * 1000
+    return np.percentile(samples, 50), np.percentile(samples, 99)
+
+def _report(operation, samples, memory=None):
+    p50, p99 = _percentiles(samples)
+    memory_text = f"{memory / 1024:10.1f}" if memory is not None else f"{'-':>10}"
+    print(f"  {operation:18} {p50:10.3f} {p99:10.3f} {memory_text}")
+
+def _timed(function, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def _traced(function):
+    """Returns the peak memory in bytes allocated while running the function."""
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def synthetic_embeddings(users, samples, rng):
+    """Random unit-scale embeddings shaped like dlib encodings, `samples` per user."""
+    centres = rng.normal(0.0, 0.1, size=(users, ENCODING_SIZE)).astype(np.float32)
+    noise = rng.normal(0.0, 0.02, size=(users, samples, ENCODING_SIZE)).astype(np.float32)
+    return centres, (centres[:, None, :] + noise).reshape(-1, ENCODING_SIZE)
+
+def benchmark_size(users, samples, repeat, rng, directory):
+    embeddings_file = os.path.join(directory, "face_embeddings.f32")
+    names_file = os.path.join(directory, "face_names.txt")
+    names = [f"usuario_{index}" for index in range(users)]
+    centres, embeddings = synthetic_embeddings(users, samples, rng)
+    labels = [name for name in names for _ in range(samples)]
+
+    store = FaceDatabase(embeddings_file, names_file)
+    store.matcher = FaceMatcher(labels, embeddings)
+    store.save()
+    file_size = os.path.getsize(embeddings_file) + os.path.getsize(names_file)
+
+    print(f"{users} users x {samples} samples ({file_size / 1024:.0f} KB on disk)")
+    print(f"  {'operation':18} {'p50 ms':>10} {'p99 ms':>10} {'peak KB':>10}")
+
+    load_samples = _timed(lambda: FaceDatabase(embeddings_file, names_file), repeat)
+    _report("load", load_samples, _traced(lambda: FaceDatabase(embeddings_file, names_file)))
+
+    store = FaceDatabase(embeddings_file, names_file)
+    queries = centres[rng.integers(0, users, size=repeat)] + rng.normal(0.0, 0.02, size=(repeat, ENCODING_SIZE))
+    query_iter = iter(queries)
+    identify_samples = _timed(lambda: store.matcher.match(next(query_iter)), repeat)
+    _report("identify", identify_samples, _traced(lambda: store.matcher.match(queries[0])))
+
+    new_encodings = iter(rng.normal(0.0, 0.1, size=(repeat + 1, ENCODING_SIZE)))
+    new_names = iter(f"nuevo_{index}" for index in range(repeat + 1))
+    register_samples = _timed(lambda: store.enroll(next(new_names), [next(new_encodings)]), repeat)
+    _report("register", register_samples,
+            _traced(lambda: store.enroll(next(new_names), [next(new_encodings)])))
+
+    save_repeat = max(3, min(repeat, 200000 // max(users, 1)))
+    save_samples = _timed(store.save, save_repeat)
+    _report("save (compact)", save_samples, _traced(store.save))
+
+    legacy_file = os.path.join(directory, "face_database.json")
+    with open(legacy_file, "w") as file:
+        json.dump({name: {"encoding": centres[index].tolist()} for index, name in enumerate(names)}, file, indent=4)
+    def legacy_load():
+        with open(legacy_file, "r") as file:
+            json.load(file)
+    _report("legacy json load", _timed(legacy_load, max(3, save_repeat)), _traced(legacy_load))
+
+def benchmark_frames(paths, repeat):
+    frames = [(path, face_recognition.load_image_file(path)) for path in paths if os.path.exists(path)]
+    if not frames:
+        print("No sample frames found, skipping detection and encoding.")
+        return
+    print("Detection and encoding on sample frames")
+    print(f"  {'operation':18} {'p50 ms':>10} {'p99 ms':>10} {'peak KB':>10}")
+    for path, frame in frames:
+        locations = face_recognition_module.locate_faces(frame)
+        print(f"  {os.path.basename(path)}: {len(locations)} face(s)")
+        _report("detect", _timed(lambda: face_recognition_module.locate_faces(frame), repeat))
+        if locations:
+            _report("encode", _timed(lambda: face_recognition.face_encodings(frame, locations), repeat))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--samples", type=int, default=1, help="face samples per user")
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--frame-repeat", type=int, default=5)
+    parser.add_argument("--images", nargs="*", default=["interaction.jpg"])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    for users in args.sizes:
+        directory = tempfile.mkdtemp(prefix="ferpy_bench_")
+        try:
+            benchmark_size(users, args.samples, args.repeat, rng, directory)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    benchmark_frames(args.images, args.frame_repeat)
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"Max RSS: {max_rss / 1024:.1f} MB")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+# benchmark_wake_word.py
+"""
+Measures the on-device wake-word detector on recorded WAV files.
+
+Usage:
+    python benchmark_wake_word.py --positive prompt.wav ... --negative noise.wav ...
+        [--matcher auto|template|vosk|cloud] [--templates wake_word/*.wav] [--threshold T]
+
+Positive files contain the wake word once; negative files never do. Each
+file is fed to WakeWordDetector frame by frame, as the microphone would.
+Reported: the miss rate (positives without a detection), false triggers
+(detections in negatives plus extra detections in positives) per hour of
+audio, the segments sent to the matcher and the matching time. With the
+template matcher the best DTW distance per file helps to pick the threshold.
+"""
+import argparse
+import glob
+import os
+import time
+import voice_module
+
+def build_matcher(args):
+    if args.matcher == "template" or (args.matcher == "auto" and args.templates):
+        templates = args.templates or sorted(glob.glob(os.path.join(voice_module.WAKE_WORD_TEMPLATE_DIR, "*.wav")))
+        return voice_module.TemplateKeywordMatcher(templates, threshold=args.threshold)
+    if args.matcher == "vosk":
+        return voice_module.VoskKeywordMatcher()
+    if args.matcher == "cloud":
+        return voice_module.CloudKeywordMatcher()
+    return voice_module.create_matcher()
+
+class TimedMatcher:
+    """Wraps a matcher to measure the time spent matching and keep the best template score."""
+
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.seconds = 0.0
+        self.best_score = None
+
+    def match(self, segment):
+        start = time.perf_counter()
+        if isinstance(self.matcher, voice_module.TemplateKeywordMatcher):
+            score = self.matcher.score(segment)
+            self.best_score = score if self.best_score is None else min(self.best_score, score)
+            result = score <= self.matcher.threshold, f"distancia {score:.1f}"
+        else:
+            result = self.matcher.match(segment)
+        self.seconds += time.perf_counter() - start
+        return result
+
+def run_file(path, matcher):
+    audio = voice_module.read_wav(path)
+    frame_bytes = voice_module.FRAME_SAMPLES * 2
+    timed = TimedMatcher(matcher)
+    detector = voice_module.WakeWordDetector(timed)
+    for offset in range(0, len(audio) - frame_bytes + 1, frame_bytes):
+        detector.process(audio[offset:offset + frame_bytes])
+    # Trailing silence closes a segment still open at the end of the file
+    silence = bytes(frame_bytes)
+    for _ in range(detector.hangover_frames):
+        detector.process(silence)
+    seconds = len(audio) / 2 / voice_module.SAMPLE_RATE
+    return seconds, detector.triggers, detector.segments, timed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--positive", nargs="*", default=[], help="WAV files that contain the wake word")
+    parser.add_argument("--negative", nargs="*", default=[], help="WAV files without the wake word")
+    parser.add_argument("--matcher", choices=["auto", "template", "vosk", "cloud"], default="auto")
+    parser.add_argument("--templates", nargs="*", default=[], help="Wake-word examples for the template matcher")
+    parser.add_argument("--threshold", type=float, default=voice_module.TEMPLATE_THRESHOLD)
+    args = parser.parse_args()
+    if not args.positive and not args.negative:
+        parser.error("give at least one --positive or --negative file")
+
+    matcher = build_matcher(args)
+    print(f"Matcher: {matcher.name}")
+    total_seconds = 0.0
+    misses = 0
+    false_triggers = 0
+    segments = 0
+    match_seconds = 0.0
+    for label, paths in (("positive", args.positive), ("negative", args.negative)):
+        for path in paths:
+            seconds, triggers, checked, timed = run_file(path, matcher)
+            total_seconds += seconds
+            segments += checked
+            match_seconds += timed.seconds
+            if label == "positive":
+                misses += triggers == 0
+                false_triggers += max(0, triggers - 1)
+            else:
+                false_triggers += triggers
+            score = f", best distance {timed.best_score:.1f}" if timed.best_score is not None else ""
+            print(f"{label:8s} {path}: {seconds:.1f} s, {checked} segments, {triggers} detections{score}")
+
+    print()
+    if args.positive:
+        print(f"Miss rate: {misses}/{len(args.positive)} ({100.0 * misses / len(args.positive):.0f} %)")
+    hours = total_seconds / 3600
+    print(f"False triggers: {false_triggers} in {total_seconds:.0f} s ({false_triggers / hours:.1f} per hour)")
+    print(f"Segments matched: {segments} ({segments / total_seconds * 60:.1f} per minute of audio)")
+    if segments:
+        print(f"Matching time: {1000 * match_seconds / segments:.1f} ms per segment")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
 import cv2
 from picamera2 import Picamera2
 import time
+import threading
+from collections import deque
 from contextlib import contextmanager
 
+CAMERA_SIZE = (640, 360)
+FRAME_BUFFER_SIZE = 4  # Number of recent frames kept by the camera service
+
 @contextmanager
 def camera_session():
     """
@@ -11,7 +16,7 @@ def camera_session():
     picam2 = Picamera2()
     try:
         camera_config = picam2.create_still_configuration(
-            main={"format": 'RGB888', "size": (640, 360)}
+            main={"format": 'RGB888', "size": CAMERA_SIZE}
         )
         picam2.configure(camera_config)
         picam2.start()
@@ -21,21 +26,149 @@ def camera_session():
         picam2.stop()
         picam2.close()
 
+class CameraService:
+    """
+    Long-lived camera that is opened once and keeps the newest frames in a
+    ring buffer, filled by a background capture thread.
+    """
+
+    def __init__(self, buffer_size=FRAME_BUFFER_SIZE, size=CAMERA_SIZE, warmup=1.0):
+        self.size = size
+        self.warmup = warmup
+        self._frames = deque(maxlen=buffer_size)
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._picam2 = None
+
+    def start(self):
+        """Open the camera and start the capture thread."""
+        if self._thread is not None:
+            return
+        self._picam2 = Picamera2()
+        # A video configuration keeps the sensor streaming continuously.
+        camera_config = self._picam2.create_video_configuration(
+            main={"format": 'RGB888', "size": self.size}
+        )
+        self._picam2.configure(camera_config)
+        self._picam2.start()
+        time.sleep(self.warmup)  # Allow the camera to warm up once, at boot
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._capture_loop, name="camera-capture", daemon=True)
+        self._thread.start()
+
+    def _capture_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                frame = self._picam2.capture_array("main")
+            except Exception as e:
+                print(f"Error capturing camera frame: {e}")
+                time.sleep(0.1)
+                continue
+            with self._condition:
+                self._frames.append((time.time(), frame))
+                self._condition.notify_all()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def latest_frame(self, timeout=2.0):
+        """
+        Returns the newest RGB frame in the buffer, waiting up to `timeout`
+        seconds for the first frame to arrive.
+        """
+        with self._condition:
+            if not self._frames:
+                self._condition.wait_for(lambda: bool(self._frames), timeout=timeout)
+            if not self._frames:
+                raise RuntimeError("No frame available from the camera service.")
+            return self._frames[-1][1]
+
+    def recent_frames(self):
+        """Returns a list of (timestamp, frame) tuples, oldest first."""
+        with self._condition:
+            return list(self._frames)
+
+    def stop(self):
+        """Stop the capture thread and release the camera."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+        if self._picam2 is not None:
+            self._picam2.stop()
+            self._picam2.close()
+            self._picam2 = None
+        with self._condition:
+            self._frames.clear()
+
+_camera_service = None
+
+def start_camera(buffer_size=FRAME_BUFFER_SIZE):
+    """
+    Opens the shared camera service. Call once at boot.
+    """
+    global _camera_service
+    if _camera_service is None:
+        _camera_service = CameraService(buffer_size=buffer_size)
+        _camera_service.start()
+    return _camera_service
+
+def release_camera():
+    """
+    Releases the shared camera service. Call on shutdown.
+    """
+    global _camera_service
+    if _camera_service is not None:
+        _camera_service.stop()
+        _camera_service = None
+
 def capture_image():
     """
     Captures an image using the camera and returns the image array.
+    Uses the shared camera service when it is running, otherwise opens
+    a one-shot camera session.
     """
+    if _camera_service is not None and _camera_service.running:
+        return _camera_service.latest_frame()
     with camera_session() as picam2:
         # Since we configured RGB888, the captured array is already in RGB.
         image_rgb = picam2.capture_array("main")
     return image_rgb
 
-def capture_and_save_image(filename="captured_image.jpg"):
+def capture_burst(count=5, interval=0.15):
     """
-    Captures an image and saves it as a JPEG file.
+    Captures `count` frames spaced `interval` seconds apart, e.g. to enroll
+    a face from several samples. Returns a list of RGB image arrays.
+    """
+    if _camera_service is not None and _camera_service.running:
+        frames = []
+        for index in range(count):
+            if index:
+                time.sleep(interval)
+            frames.append(_camera_service.latest_frame())
+        return frames
+    with camera_session() as picam2:
+        frames = []
+        for index in range(count):
+            if index:
+                time.sleep(interval)
+            frames.append(picam2.capture_array("main"))
+    return frames
+
+def save_image(image, filename="captured_image.jpg"):
+    """
+    Saves an RGB image array as a JPEG file. Only needed when a file
+    really has to be written, e.g. for debugging.
     """
-    image = capture_image()
     # Convert RGB image to BGR for cv2.imwrite.
     image_bgr = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
     cv2.imwrite(filename, image_bgr)
-    return filename
\ No newline at end of file
+    return filename
+
+def capture_and_save_image(filename="captured_image.jpg"):
+    """
+    Captures an image and saves it as a JPEG file.
+    """
+    return save_image(capture_image(), filename)
@@ -2,6 +2,8 @@ import re
 import time
 import os
 import RPi.GPIO as GPIO
+from response_parser_module import ResponseStreamParser, parse_response
+import tts_module
 
 class RobotCommandHandler:
     
@@ -48,6 +50,10 @@ class RobotCommandHandler:
         }
         # This dictionary will be set from main.py
         self.patient_data = {}
+        # Seconds to the first spoken/executed item and in total, for the last streamed response
+        self.last_stream_timings = {}
+        # Speech pipeline for replies (tts_module.SpeechPipeline); can be set from main.py
+        self.speech = None
     
     def _execute_command(self, command, value):
         """Ejecuta el comando de movimiento o de registro de dato dado con el valor proporcionado."""
@@ -93,49 +99,73 @@ class RobotCommandHandler:
             self._execute_command(command.lower(), str(value))
         return cleaned_response
 
+    def _speak_segment(self, text_segment):
+        print(f"Hablando: {text_segment}")
+        from main import speak_text
+        speak_text(text_segment, 'es', latency_critical=False)
+
+    def run_response_item(self, item):
+        """Habla un segmento de texto o ejecuta un comando (<comando valor>)."""
+        if item[0] == "text":
+            self._speak_segment(item[1])
+        else:
+            _, command, value = item
+            print(f"Ejecutando comando: {command} {value}")
+            self._execute_command(command, value)
+            time.sleep(0.5)
+
+    def queue_response_item(self, item):
+        """
+        Encola un segmento de texto o un comando en el pipeline de voz: el texto
+        se sintetiza por adelantado mientras suena el segmento anterior y los
+        comandos se ejecutan en orden, cuando termina el texto anterior.
+        """
+        if self.speech is None:
+            self.speech = tts_module.SpeechPipeline()
+        if item[0] == "text":
+            print(f"Hablando: {item[1]}")
+            self.speech.say(item[1], 'es')
+        else:
+            self.speech.run(self.run_response_item, item)
+
+    def wait_response(self):
+        """Espera a que se hayan hablado y ejecutado todos los elementos encolados."""
+        if self.speech is not None:
+            return self.speech.flush()
+
     def execute_response_segments(self, response):
         """
-        Separa la respuesta en segmentos de texto y comandos según su orden de aparición.
-        Si se encuentra un segmento de texto, se habla inmediatamente.
-        Si se encuentra un comando (<comando valor>), se ejecuta inmediatamente.
+        Separa la respuesta en oraciones y comandos según su orden de aparición.
+        Los segmentos de texto se hablan en orden, sintetizando el siguiente mientras suena el actual.
+        Si se encuentra un comando (<comando valor>), se ejecuta en cuanto termina el texto anterior.
         Excluye los comandos de gestión de usuarios que se procesan por separado.
         """
-        # Remove user management commands from processing here since they're handled separately
-        import re
-        response = re.sub(r'<change_user\s+0>', '', response)
-        response = re.sub(r'<register_user\s+[^>]+>', '', response)
-        
-        pattern = r'<(\w+)\s+([^>]+)>'  # Ahora captura cualquier valor hasta ">"
-        current_index = 0
-        # Iterar por cada coincidencia en el orden que aparece en la respuesta
-        for match in re.finditer(pattern, response):
-            # Extraer el segmento de texto que precede al comando actual
-            text_segment = response[current_index:match.start()].strip()
-            if text_segment:
-                print(f"Hablando: {text_segment}")
-                from main import speak_text
-                speak_text(text_segment, 'es')
-            # Procesar el comando encontrado
-            command = match.group(1).lower()
-            value_str = match.group(2).strip()
-            try:
-                if '.' in value_str:
-                    value = float(value_str)
-                else:
-                    value = int(value_str)
-            except ValueError:
-                value = value_str  # Se mantiene como cadena si no es numérico
-            print(f"Ejecutando comando: {command} {value}")
-            self._execute_command(command, value)
-            time.sleep(0.5)
-            current_index = match.end()
-        # Procesar cualquier texto restante después del último comando
-        if current_index < len(response):
-            text_segment = response[current_index:].strip()
-            if text_segment:
-                print(f"Hablando: {text_segment}")
-                from main import speak_text
-                speak_text(text_segment, 'es')
+        for item in parse_response(response, split_sentences=True):
+            self.queue_response_item(item)
+        self.wait_response()
+
+    def execute_response_stream(self, chunks):
+        """
+        Igual que execute_response_segments, pero consume la respuesta de Gemini
+        fragmento a fragmento: cada oración completa se habla y cada comando
+        completo se ejecuta en cuanto llega, sin esperar la respuesta entera.
+        Retorna el texto completo de la respuesta.
+        """
+        parser = ResponseStreamParser(split_sentences=True)
+        response_parts = []
+        start = time.perf_counter()
+        self.last_stream_timings = {}
+        for chunk in chunks:
+            response_parts.append(chunk)
+            for item in parser.feed(chunk):
+                self.last_stream_timings.setdefault("first_item", time.perf_counter() - start)
+                self.queue_response_item(item)
+        for item in parser.finish():
+            self.last_stream_timings.setdefault("first_item", time.perf_counter() - start)
+            self.queue_response_item(item)
+        self.wait_response()
+        self.last_stream_timings["total"] = time.perf_counter() - start
+        return "".join(response_parts)
     
     def _stop_motors(self):
         """Stop all motors by setting all pins to LOW."""
@@ -2,65 +2,828 @@
 import face_recognition
 import json
 import os
+import hashlib
+import multiprocessing
+import threading
+import time
+import weakref
 import numpy as np
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
 
-DATABASE_FILE = "face_database.json"
+DATABASE_FILE = "face_database.json"  # Legacy JSON database, migrated once
+EMBEDDINGS_FILE = "face_embeddings.f32"  # Raw float32 rows, memory-mapped on load
+NAMES_FILE = "face_names.txt"  # One user name per embedding row
+ENROLL_FLAG = "enroll"  # Index flag marking the first sample of a new enrollment
+ENCODING_SIZE = 128
+FACE_MATCH_TOLERANCE = 0.6  # Same default as face_recognition.compare_faces
+KNN_NEIGHBOURS = 3  # Nearest samples that vote on the identity
+MAX_SAMPLES_PER_USER = 8  # Oldest samples are dropped beyond this
+ENROLLMENT_MAX_SPREAD = 0.35  # Enrollment samples farther than this from their median are discarded
+
+# Automatic sample refresh for recognized users, see FaceDatabase.refresh().
+REFRESH_MAX_DISTANCE = 0.45  # Only confident matches, close to the user's centroid
+REFRESH_MIN_MARGIN = 0.1  # Clearly closer than any other user
+REFRESH_MIN_NOVELTY = 0.05  # Skip faces nearly identical to a stored sample
+REFRESH_MIN_FACE_SIZE = 80  # Pixels; small faces give poor encodings
+REFRESH_INTERVAL = 60.0  # Seconds between refreshes of the same user
+ANALYSIS_CACHE_SIZE = 8  # Number of analysed frames kept for reuse
+ENCODING_WORKERS = max(1, (os.cpu_count() or 2) - 1)  # Face encoding processes, one core left for the main loop
+
+# Face detection pipeline settings, see configure_detection().
+DETECTION_SETTINGS = {
+    "downscale": 2,      # Detect on a frame reduced by this integer factor, encode at full resolution
+    "upsample": 1,       # number_of_times_to_upsample passed to face_recognition.face_locations
+    "model": "hog",      # "hog" (fast on CPU) or "cnn" (more accurate, very slow on a Pi)
+    "track_roi": True,   # Search around the last known face before the full frame
+    "roi_margin": 0.75,  # How far the search region extends around the last face, relative to its size
+}
+
+# name: matched user, distance: euclidean distance to their encoding,
+# margin: how much closer the match is than the runner-up user.
+FaceMatch = namedtuple("FaceMatch", ["name", "distance", "margin"])
+
+class FaceMatcher:
+    """
+    Keeps every stored face sample in one contiguous float32 matrix so a
+    face is compared against all users with a single vectorized call.
+    A user can have several samples; matching votes over the k nearest
+    samples, and each user's centroid is kept for quality checks.
+    """
+
+    def __init__(self, labels=(), encodings=None, tolerance=FACE_MATCH_TOLERANCE,
+                 k=KNN_NEIGHBOURS, max_samples=MAX_SAMPLES_PER_USER):
+        self.tolerance = tolerance
+        self.k = k
+        self.max_samples = max_samples
+        self.names = []  # User names, indexed by user id
+        self._user_ids = {}
+        self._user_rows = {}  # name -> rows of its samples, oldest first
+        self._centroids = {}
+        labels = list(labels)
+        if encodings is None or len(labels) == 0:
+            encodings = np.empty((0, ENCODING_SIZE), dtype=np.float32)
+        self._matrix = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        self._row_users = np.empty(len(labels), dtype=np.int32)
+        for row, name in enumerate(labels):
+            self._row_users[row] = self._user_id(name)
+            self._user_rows[name].append(row)
+        self._size = len(labels)
+        self.revision = 0  # Incremented on every change, invalidates cached matches
+
+    @classmethod
+    def from_database(cls, database, tolerance=FACE_MATCH_TOLERANCE):
+        names = list(database.keys())
+        encodings = [data["encoding"] for data in database.values()]
+        return cls(names, encodings, tolerance)
+
+    def __len__(self):
+        return len(self._user_rows)
+
+    def __contains__(self, name):
+        return name in self._user_rows
+
+    @property
+    def sample_count(self):
+        return sum(len(rows) for rows in self._user_rows.values())
+
+    def samples(self):
+        """
+        Returns (labels, matrix) with one row per stored sample, grouped by user.
+        """
+        rows = [row for name in self.names for row in self._user_rows.get(name, ())]
+        labels = [self.names[self._row_users[row]] for row in rows]
+        return labels, self._matrix[rows]
+
+    def centroid(self, name):
+        """Returns the mean of the user's samples, or None for unknown users."""
+        if name not in self._user_rows:
+            return None
+        centroid = self._centroids.get(name)
+        if centroid is None:
+            centroid = self._matrix[self._user_rows[name]].mean(axis=0)
+            self._centroids[name] = centroid
+        return centroid
+
+    def _user_id(self, name):
+        user_id = self._user_ids.get(name)
+        if user_id is None:
+            user_id = len(self.names)
+            self.names.append(name)
+            self._user_ids[name] = user_id
+        self._user_rows.setdefault(name, [])
+        return user_id
+
+    def _grow(self, capacity):
+        matrix = np.empty((capacity, ENCODING_SIZE), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        row_users = np.full(capacity, -1, dtype=np.int32)
+        row_users[:self._size] = self._row_users[:self._size]
+        self._matrix = matrix
+        self._row_users = row_users
+
+    def _append_row(self, user_id, encoding):
+        if self._size == len(self._matrix) or not self._matrix.flags.writeable:
+            self._grow(max(16, 2 * self._size))
+        # Fill the row before publishing it, the presence thread may be matching.
+        row = self._size
+        self._matrix[row] = encoding
+        self._row_users[row] = user_id
+        self._size += 1
+        return row
+
+    def _drop_rows(self, rows):
+        for row in rows:
+            self._row_users[row] = -1
+
+    def add_sample(self, name, encoding):
+        """
+        Adds one more sample for a user, dropping the oldest one beyond
+        max_samples. The matrix grows geometrically, so nothing is rebuilt.
+        """
+        encoding = np.asarray(encoding, dtype=np.float32).reshape(ENCODING_SIZE)
+        user_id = self._user_id(name)
+        rows = self._user_rows[name]
+        rows.append(self._append_row(user_id, encoding))
+        if len(rows) > self.max_samples:
+            self._drop_rows(rows[:-self.max_samples])
+            del rows[:-self.max_samples]
+        self._centroids.pop(name, None)
+        self.revision += 1
+
+    def enroll(self, name, encodings):
+        """
+        Replaces all samples of a user with the given encodings.
+        """
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        user_id = self._user_id(name)
+        new_rows = [self._append_row(user_id, encoding) for encoding in encodings[-self.max_samples:]]
+        self._drop_rows(self._user_rows[name])
+        self._user_rows[name] = new_rows
+        self._centroids.pop(name, None)
+        self.revision += 1
+
+    def add(self, name, encoding):
+        """
+        Registers a user with a single sample, replacing any previous samples.
+        """
+        self.enroll(name, [encoding])
+
+    def _distances(self, encoding):
+        size = self._size
+        row_users = self._row_users[:size]
+        diff = self._matrix[:size] - np.asarray(encoding, dtype=np.float32)
+        distances = np.sqrt(np.einsum("ij,ij->i", diff, diff))
+        distances[row_users < 0] = np.inf
+        return distances, row_users
+
+    def _result(self, user_id, distances, row_users):
+        own = row_users == user_id
+        distance = float(distances[own].min())
+        others = distances[~own & (row_users >= 0)]
+        margin = float(others.min()) - distance if others.size else float("inf")
+        return FaceMatch(self.names[user_id], distance, margin)
+
+    def nearest(self, encoding):
+        """
+        Returns a FaceMatch for the user with the closest sample, or None if there are no users.
+        """
+        if len(self._user_rows) == 0:
+            return None
+        distances, row_users = self._distances(encoding)
+        row = int(np.argmin(distances))
+        if not np.isfinite(distances[row]):
+            return None
+        return self._result(int(row_users[row]), distances, row_users)
+
+    def match(self, encoding):
+        """
+        Returns a FaceMatch for the user winning a distance-weighted vote among
+        the k nearest samples within the tolerance, otherwise None.
+        """
+        if len(self._user_rows) == 0:
+            return None
+        distances, row_users = self._distances(encoding)
+        k = min(self.k, len(distances))
+        nearest_rows = np.argpartition(distances, k - 1)[:k]
+        votes = {}
+        for row in nearest_rows:
+            if distances[row] <= self.tolerance:
+                user_id = int(row_users[row])
+                votes[user_id] = votes.get(user_id, 0.0) + 1.0 / (float(distances[row]) + 1e-6)
+        if not votes:
+            return None
+        return self._result(max(votes, key=votes.get), distances, row_users)
+
+class FaceDatabase:
+    """
+    Face embedding store: a memory-mappable float32 file with one row per
+    face sample plus a text index with one name per row.
+    Samples are appended, so nothing is rewritten when a user is added.
+    An index line "name<TAB>enroll" starts a new enrollment and supersedes the
+    earlier samples of that name; a plain "name" line adds a sample.
+    A lock serialises the appends, the matcher updates and matching, since
+    the presence thread refreshes samples while the main thread enrolls.
+    """
+
+    def __init__(self, embeddings_file=EMBEDDINGS_FILE, names_file=NAMES_FILE):
+        self.embeddings_file = embeddings_file
+        self.names_file = names_file
+        self._lock = threading.RLock()
+        self.matcher = self._load()
+        self._last_refresh = {}
+
+    def _load(self):
+        _recover(self.embeddings_file, self.names_file)
+        entries = []
+        if os.path.exists(self.names_file):
+            with open(self.names_file, "r", encoding="utf-8") as file:
+                entries = file.read().splitlines()
+        row_bytes = ENCODING_SIZE * np.dtype(np.float32).itemsize
+        stored_rows = 0
+        if os.path.exists(self.embeddings_file):
+            stored_rows = os.path.getsize(self.embeddings_file) // row_bytes
+        # A crash between the two appends leaves embedding rows without a name
+        # (or an incomplete last row): cut them, or the next append would be misaligned.
+        rows = min(len(entries), stored_rows)
+        if os.path.exists(self.embeddings_file) and os.path.getsize(self.embeddings_file) != rows * row_bytes:
+            with open(self.embeddings_file, "r+b") as file:
+                file.truncate(rows * row_bytes)
+                file.flush()
+                os.fsync(file.fileno())
+        if rows == 0:
+            return FaceMatcher()
+        embeddings = np.memmap(self.embeddings_file, dtype=np.float32, mode="r",
+                               shape=(rows, ENCODING_SIZE))
+        user_rows = {}
+        labels = []
+        for row, entry in enumerate(entries[:rows]):
+            name, _, flag = entry.partition("\t")
+            labels.append(name)
+            if flag == ENROLL_FLAG or name not in user_rows:
+                user_rows[name] = []
+            user_rows[name].append(row)
+        kept_rows = sorted(row for user in user_rows.values() for row in user[-MAX_SAMPLES_PER_USER:])
+        if len(kept_rows) == rows:
+            # Nothing superseded: the matcher reads straight from the memory map.
+            return FaceMatcher(labels, embeddings)
+        return FaceMatcher([labels[row] for row in kept_rows], embeddings[kept_rows])
+
+    def __len__(self):
+        return len(self.matcher)
+
+    def __contains__(self, name):
+        return name in self.matcher
+
+    @property
+    def names(self):
+        return [name for name in self.matcher.names if name in self.matcher]
+
+    def _append(self, name, encodings, enroll):
+        if "\n" in name or "\r" in name or "\t" in name:
+            raise ValueError("User names cannot contain tabs or line breaks.")
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_SIZE)
+        lines = [name + "\t" + ENROLL_FLAG if enroll and i == 0 else name for i in range(len(encodings))]
+        # Write the embeddings first: a row without a name is ignored on load.
+        with open(self.embeddings_file, "ab") as file:
+            file.write(encodings.tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+        with open(self.names_file, "a", encoding="utf-8") as file:
+            file.write("".join(line + "\n" for line in lines))
+            file.flush()
+            os.fsync(file.fileno())
+        return encodings
+
+    def enroll(self, name, encodings):
+        """
+        Appends a new enrollment (one or more samples) for a user, replacing
+        their previous samples.
+        """
+        with self._lock:
+            encodings = self._append(name, encodings, enroll=True)
+            self.matcher.enroll(name, encodings)
+
+    def add(self, name, encoding):
+        """
+        Appends a registration with a single sample.
+        """
+        self.enroll(name, [encoding])
+
+    def add_sample(self, name, encoding):
+        """
+        Appends one more sample for an enrolled user.
+        """
+        with self._lock:
+            encodings = self._append(name, [encoding], enroll=False)
+            self.matcher.add_sample(name, encodings[0])
+
+    def match(self, encoding):
+        """FaceMatcher.match, consistent with concurrent updates."""
+        with self._lock:
+            return self.matcher.match(encoding)
+
+    def refresh(self, name, encoding, match):
+        """
+        Stores a good-quality face of a recognized user as a new sample, so the
+        samples follow changes in appearance and lighting. Returns True if a
+        sample was added.
+        """
+        now = time.time()
+        if match.distance > REFRESH_MAX_DISTANCE or match.margin < REFRESH_MIN_MARGIN:
+            return False
+        with self._lock:
+            if now - self._last_refresh.get(name, 0.0) < REFRESH_INTERVAL:
+                return False
+            centroid = self.matcher.centroid(name)
+            if centroid is None or np.linalg.norm(centroid - encoding) > REFRESH_MAX_DISTANCE:
+                return False
+            if match.distance < REFRESH_MIN_NOVELTY:
+                # Practically identical to a stored sample, nothing new to learn.
+                return False
+            self._last_refresh[name] = now
+            self.add_sample(name, encoding)
+            return True
+
+    def save(self):
+        """
+        Atomically rewrites the store without superseded samples. Both new
+        files are written and fsynced first; the embeddings replace the old
+        ones before the names do, and _recover() finishes the second step if
+        the process dies between the two.
+        """
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        labels, matrix = self.matcher.samples()
+        embeddings_temp = self.embeddings_file + ".tmp"
+        names_temp = self.names_file + ".tmp"
+        # The names temp file must only exist once the embeddings temp file is complete.
+        _write_synced(embeddings_temp, np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+        _write_synced(names_temp, "".join(name + "\n" for name in labels).encode("utf-8"))
+        os.replace(embeddings_temp, self.embeddings_file)
+        _fsync_directory(self.embeddings_file)
+        os.replace(names_temp, self.names_file)
+        _fsync_directory(self.names_file)
+
+    @classmethod
+    def from_json(cls, json_file=DATABASE_FILE, embeddings_file=EMBEDDINGS_FILE, names_file=NAMES_FILE):
+        """
+        One-time migration from the legacy JSON database.
+        """
+        with open(json_file, "r") as file:
+            legacy = json.load(file)
+        store = cls.__new__(cls)
+        store.embeddings_file = embeddings_file
+        store.names_file = names_file
+        store._lock = threading.RLock()
+        store.matcher = FaceMatcher.from_database(legacy)
+        store._last_refresh = {}
+        store.save()
+        print(f"Migrated {len(legacy)} users from {json_file} to {embeddings_file}.")
+        return store
+
+def _write_synced(filename, data):
+    with open(filename, "wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+
+def _fsync_directory(filename):
+    """Makes a rename in the directory of filename durable (best effort, POSIX only)."""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _recover(embeddings_file=EMBEDDINGS_FILE, names_file=NAMES_FILE):
+    """
+    Completes or discards a save() interrupted by a crash. A names temp file
+    without an embeddings temp file means the new embeddings are already in
+    place, so the names are moved in too; otherwise the old files are still
+    consistent and the temp files are dropped.
+    """
+    embeddings_temp = embeddings_file + ".tmp"
+    names_temp = names_file + ".tmp"
+    if os.path.exists(names_temp) and not os.path.exists(embeddings_temp):
+        os.replace(names_temp, names_file)
+        _fsync_directory(names_file)
+        print(f"Completed an interrupted save of {names_file}.")
+        return
+    for temp in (embeddings_temp, names_temp):
+        if os.path.exists(temp):
+            os.remove(temp)
+
+def _stored_rows(embeddings_file=EMBEDDINGS_FILE, names_file=NAMES_FILE):
+    """Returns (embedding rows, name entries) of the store on disk."""
+    row_bytes = ENCODING_SIZE * np.dtype(np.float32).itemsize
+    rows = os.path.getsize(embeddings_file) // row_bytes if os.path.exists(embeddings_file) else 0
+    entries = 0
+    if os.path.exists(names_file):
+        with open(names_file, "r", encoding="utf-8") as file:
+            entries = sum(1 for line in file if line.strip())
+    return rows, entries
+
+_database = None
+
+def get_matcher(database):
+    """
+    Returns the FaceMatcher for a database.
+    Plain dicts in the legacy JSON layout are also accepted.
+    """
+    if isinstance(database, FaceDatabase):
+        return database.matcher
+    return FaceMatcher.from_database(database)
 
 def load_database():
     """
-    Load the face database from a JSON file.
+    Load the face database. The store is loaded once and shared across calls;
+    the legacy JSON file is migrated the first time.
     """
-    if os.path.exists(DATABASE_FILE):
-        with open(DATABASE_FILE, "r") as file:
-            return json.load(file)
-    return {}
+    global _database
+    if _database is None:
+        _recover()
+        rows, entries = _stored_rows()
+        if os.path.exists(DATABASE_FILE) and (rows == 0 or entries == 0):
+            # Not migrated yet, or the migration was interrupted before both files were in place.
+            _database = FaceDatabase.from_json()
+        else:
+            _database = FaceDatabase()
+    return _database
 
 def save_database(database):
     """
-    Save the face database to a JSON file.
+    Save the face database. Every enrolled sample is kept as its own row
+    (several per user), since matching votes over the nearest samples.
     """
-    with open(DATABASE_FILE, "w") as file:
-        json.dump(database, file, indent=4)
+    database.save()
 
-def detect_face(image_path):
+def _load_image(image):
     """
-    Loads an image file and returns face encodings if at least one face is detected.
+    Accepts either a path to an image file or an RGB image array already in
+    memory, and returns the image array. Arrays are used as-is, without any
+    JPEG encode/decode round-trip.
     """
-    image = face_recognition.load_image_file(image_path)
-    face_locations = face_recognition.face_locations(image)
+    if isinstance(image, (str, os.PathLike)):
+        return face_recognition.load_image_file(image)
+    return np.ascontiguousarray(image)
+
+class FaceAnalysis:
+    """
+    Result of analysing one captured frame: face locations, encodings and,
+    once requested, the match against the face database.
+    """
+
+    def __init__(self, locations, encodings):
+        self.locations = locations
+        self.encodings = encodings
+        self._match = None
+        self._match_key = None
+
+    @property
+    def has_face(self):
+        return len(self.encodings) > 0
+
+    @property
+    def good_sample(self):
+        """
+        True for a single, large enough face, suitable to refresh stored samples.
+        """
+        if len(self.encodings) != 1:
+            return False
+        top, right, bottom, left = self.locations[0]
+        return min(bottom - top, right - left) >= REFRESH_MIN_FACE_SIZE
+
+    def match_against(self, database):
+        """
+        Returns the FaceMatch for the first face, or None. The result is
+        reused until the database changes.
+        """
+        if not self.has_face:
+            return None
+        matcher = get_matcher(database)
+        key = (id(matcher), matcher.revision, len(matcher))
+        if self._match_key != key:
+            if isinstance(database, FaceDatabase):
+                self._match = database.match(self.encodings[0])
+            else:
+                self._match = matcher.match(self.encodings[0])
+            self._match_key = key
+        return self._match
+
+_analysis_cache = OrderedDict()
+_analysis_ids = {}  # id(frame) -> (weak reference, cache key), skips hashing the same array
+_analysis_lock = threading.Lock()
+
+def _frame_key(image):
+    """
+    Cache key for a frame: the frame identity when the same array is passed
+    again, otherwise a hash of its content.
+    """
+    if isinstance(image, (str, os.PathLike)):
+        return ("file", os.fspath(image), os.path.getmtime(image))
+    entry = _analysis_ids.get(id(image))
+    if entry is not None and entry[0]() is image:
+        return entry[1]
+    array = np.ascontiguousarray(image)
+    digest = hashlib.blake2b(array.data, digest_size=16).hexdigest()
+    key = ("frame", array.shape, str(array.dtype), digest)
+    try:
+        _analysis_ids[id(image)] = (weakref.ref(image), key)
+    except TypeError:
+        pass
+    return key
+
+_last_face_box = None  # Last detected face (top, right, bottom, left) for ROI tracking
+
+def configure_detection(**settings):
+    """
+    Updates DETECTION_SETTINGS, e.g. configure_detection(downscale=1, model="cnn").
+    Cached analyses and the tracked face region are discarded.
+    """
+    global _last_face_box
+    unknown = set(settings) - set(DETECTION_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown detection settings: {', '.join(sorted(unknown))}")
+    DETECTION_SETTINGS.update(settings)
+    with _analysis_lock:
+        _analysis_cache.clear()
+        _analysis_ids.clear()
+    _last_face_box = None
+
+def _detect_locations(image, settings):
+    """
+    Runs face detection on a downscaled copy of the image and maps the boxes
+    back to the coordinates of the given image.
+    """
+    step = max(1, int(settings["downscale"]))
+    small = np.ascontiguousarray(image[::step, ::step])
+    locations = face_recognition.face_locations(
+        small, number_of_times_to_upsample=settings["upsample"], model=settings["model"]
+    )
+    height, width = image.shape[:2]
+    return [
+        (top * step, min(right * step, width), min(bottom * step, height), left * step)
+        for top, right, bottom, left in locations
+    ]
+
+def _face_region(box, shape, margin):
+    top, right, bottom, left = box
+    pad_y = int((bottom - top) * margin)
+    pad_x = int((right - left) * margin)
+    height, width = shape[:2]
+    return max(0, top - pad_y), min(width, right + pad_x), min(height, bottom + pad_y), max(0, left - pad_x)
+
+def _search_faces(image, settings, last_box):
+    locations = []
+    if settings["track_roi"] and last_box is not None:
+        top, right, bottom, left = _face_region(last_box, image.shape, settings["roi_margin"])
+        crop_locations = _detect_locations(image[top:bottom, left:right], settings)
+        locations = [(t + top, r + left, b + top, l + left) for t, r, b, l in crop_locations]
+    if not locations:
+        locations = _detect_locations(image, settings)
+    return locations
+
+def _track_faces(locations):
+    global _last_face_box
+    if locations:
+        # Track the largest face, which is normally the patient facing the robot.
+        _last_face_box = max(locations, key=lambda box: (box[2] - box[0]) * (box[1] - box[3]))
+    else:
+        _last_face_box = None
+
+def locate_faces(image, settings=None):
+    """
+    Returns face locations (top, right, bottom, left) in full-resolution
+    coordinates. The region around the last known face is searched first;
+    the whole frame is searched when the face is lost there.
+    """
+    settings = DETECTION_SETTINGS if settings is None else settings
+    locations = _search_faces(image, settings, _last_face_box)
+    _track_faces(locations)
+    return locations
+
+def _locate_and_encode(image):
+    face_locations = locate_faces(image)
+    face_encodings = []
     if len(face_locations) > 0:
         face_encodings = face_recognition.face_encodings(image, face_locations)
-        return face_encodings
-    return None
+    return face_locations, face_encodings
 
-def identify_user(image_path, database):
+def _store_analysis(key, analysis):
+    with _analysis_lock:
+        _analysis_cache[key] = analysis
+        while len(_analysis_cache) > ANALYSIS_CACHE_SIZE:
+            _analysis_cache.popitem(last=False)
+        for frame_id, (ref, _) in list(_analysis_ids.items()):
+            if ref() is None:
+                del _analysis_ids[frame_id]
+
+def analyze_frame(image):
     """
-    Identify the user by comparing the face encoding with the database.
-    Returns the user name if recognized, otherwise returns None.
+    Runs face detection and encoding once per captured frame and caches the
+    FaceAnalysis, so detection, identification and registration on the same
+    frame share a single pass. If the frame is already being analysed in the
+    worker pool, waits for that result instead.
+    image: an RGB image array or a path to an image file.
     """
-    face_encodings = detect_face(image_path)
-    if not face_encodings:
-        return None
+    with _analysis_lock:
+        key = _frame_key(image)
+        analysis = _analysis_cache.get(key)
+        if analysis is not None:
+            _analysis_cache.move_to_end(key)
+            return analysis
+        pending = _pending_analyses.get(key)
+    if pending is not None:
+        return pending.result()
+    face_locations, face_encodings = _locate_and_encode(_load_image(image))
+    analysis = FaceAnalysis(face_locations, face_encodings)
+    _store_analysis(key, analysis)
+    return analysis
 
-    face_encoding = face_encodings[0]
-    for user_name, data in database.items():
-        known_encoding = np.array(data["encoding"])
-        if face_recognition.compare_faces([known_encoding], face_encoding)[0]:
-            return user_name
+_executor = None
+_pending_analyses = {}  # cache key -> Future of frames being analysed by the worker pool
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # forkserver: workers are not forked from a process that already runs camera and audio threads.
+        context = multiprocessing.get_context("forkserver")
+        _executor = ProcessPoolExecutor(max_workers=ENCODING_WORKERS, mp_context=context)
+    return _executor
+
+def shutdown_workers():
+    """
+    Stops the face encoding worker pool. Call on shutdown.
+    """
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+
+def _analyze_shared_frame(shm_name, shape, dtype, settings, last_box):
+    """
+    Worker process entry point: detects and encodes faces on a frame placed
+    in shared memory by analyze_frame_async.
+    """
+    # Workers share the parent's resource tracker, so attaching does not take ownership.
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        image = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        face_locations = _search_faces(image, settings, last_box)
+        face_encodings = []
+        if face_locations:
+            face_encodings = face_recognition.face_encodings(image, face_locations)
+        del image
+        return face_locations, face_encodings
+    finally:
+        shm.close()
 
+def analyze_frame_async(image):
+    """
+    Starts face detection and encoding of a frame in the worker pool and
+    returns a concurrent.futures.Future of its FaceAnalysis. The frame is
+    copied once into shared memory; it is never re-encoded. The result goes
+    into the analysis cache, so a later analyze_frame() on the same frame
+    waits for it instead of running a second pass.
+    image: an RGB image array or a path to an image file.
+    """
+    with _analysis_lock:
+        key = _frame_key(image)
+        analysis = _analysis_cache.get(key)
+        if analysis is not None:
+            done = Future()
+            done.set_result(analysis)
+            return done
+        pending = _pending_analyses.get(key)
+        if pending is not None:
+            return pending
+        future = Future()
+        _pending_analyses[key] = future
+
+    array = _load_image(image)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+
+    def finish(worker_future):
+        try:
+            face_locations, face_encodings = worker_future.result()
+            analysis = FaceAnalysis(face_locations, face_encodings)
+            _track_faces(face_locations)
+            _store_analysis(key, analysis)
+            future.set_result(analysis)
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with _analysis_lock:
+                _pending_analyses.pop(key, None)
+            shm.close()
+            shm.unlink()
+
+    try:
+        worker_future = _get_executor().submit(
+            _analyze_shared_frame, shm.name, array.shape, array.dtype.str,
+            dict(DETECTION_SETTINGS), _last_face_box
+        )
+    except BaseException as e:
+        with _analysis_lock:
+            _pending_analyses.pop(key, None)
+        shm.close()
+        shm.unlink()
+        future.set_exception(e)
+        return future
+    worker_future.add_done_callback(finish)
+    return future
+
+def analyze_frames_async(frames):
+    """
+    Analyses several frames in parallel, e.g. while enrolling a user.
+    Returns a list of Futures in the same order as the frames.
+    """
+    return [analyze_frame_async(frame) for frame in frames]
+
+def detect_face(image):
+    """
+    Returns face encodings if at least one face is detected.
+    image: an RGB image array or a path to an image file.
+    """
+    analysis = analyze_frame(image)
+    if analysis.has_face:
+        return analysis.encodings
     return None
 
-def register_user(user_name, image_path, database):
+def match_user(image, database):
     """
-    Register a new user using their provided name and face image.
+    Finds the closest user in the database for the face in the image.
+    Good-quality faces of recognized users are stored as new samples.
+    image: an RGB image array or a path to an image file.
+    Returns a FaceMatch (name, distance, margin) if recognized, otherwise None.
+    """
+    analysis = analyze_frame(image)
+    match = analysis.match_against(database)
+    if match is not None and analysis.good_sample and isinstance(database, FaceDatabase):
+        database.refresh(match.name, analysis.encodings[0], match)
+    return match
+
+def identify_in_frames(frames, database):
+    """
+    Analyses a burst of frames in parallel and returns (match, face_detected),
+    where match is the closest FaceMatch over all frames or None.
+    """
+    analyses = [future.result() for future in analyze_frames_async(frames)]
+    matches = [match_user(frame, database) for frame in frames]
+    matches = [match for match in matches if match is not None]
+    best = min(matches, key=lambda match: match.distance) if matches else None
+    return best, any(analysis.has_face for analysis in analyses)
+
+def identify_user(image, database):
+    """
+    Identify the user by comparing the face encoding with the database.
+    image: an RGB image array or a path to an image file.
+    Returns the name of the closest user if recognized, otherwise returns None.
+    """
+    match = match_user(image, database)
+    if match is None:
+        return None
+    return match.name
+
+def enroll_user(user_name, frames, database):
+    """
+    Register a user with several face samples taken from a burst of frames.
+    Frames with more than one face are only used if no frame has a single
+    face, and outlier samples are discarded.
     Returns the user name if registration is successful, otherwise returns None.
     """
-    face_encodings = detect_face(image_path)
-    if not face_encodings:
-        print("No face detected in the image. Registration failed.")
+    if len(frames) == 1:
+        analyses = [analyze_frame(frames[0])]
+    else:
+        analyses = [future.result() for future in analyze_frames_async(frames)]
+    encodings = [analysis.encodings[0] for analysis in analyses if len(analysis.encodings) == 1]
+    if not encodings:
+        encodings = [analysis.encodings[0] for analysis in analyses if analysis.has_face]
+    if not encodings:
+        print("No face detected in the images. Registration failed.")
         return None
 
-    face_encoding = face_encodings[0]
-    database[user_name] = {"encoding": face_encoding.tolist()}
-    save_database(database)
+    encodings = np.asarray(encodings, dtype=np.float32)
+    spread = np.linalg.norm(encodings - np.median(encodings, axis=0), axis=1)
+    if (spread <= ENROLLMENT_MAX_SPREAD).any():
+        encodings = encodings[spread <= ENROLLMENT_MAX_SPREAD]
+    database.enroll(user_name, encodings)
     return user_name
+
+def register_user(user_name, image, database):
+    """
+    Register a new user using their provided name and face image.
+    image: an RGB image array or a path to an image file.
+    Returns the user name if registration is successful, otherwise returns None.
+    """
+    return enroll_user(user_name, [image], database)
@@ -0,0 +1,232 @@
+# gemini_backend_module.py
+"""
+Backends for the Gemini conversation. GeminiSession talks to a "model",
+i.e. anything with start_chat(history) returning a chat with a history list
+and send_message(content, stream=False). Besides the live model there are:
+
+- RecordingModel: wraps a model and appends every turn, with the arrival
+  time of each streamed chunk, to a cassette file (JSON lines). A turn is
+  only written once commit_recording() is called on the chat that served
+  it, so attempts abandoned by the request runner are not recorded.
+- ReplayModel: plays a cassette back without network, reproducing the
+  chunk timings, optionally scaled and with extra latency. Turns are
+  matched by prompt, so the hedged, retried and fallback attempts of one
+  request all get the turn recorded for it.
+"""
+import json
+import threading
+import time
+
+BACKENDS = ("live", "record", "replay")
+
+class _Part:
+    def __init__(self, text):
+        self.text = text
+
+class _Content:
+    def __init__(self, text):
+        self.role = "model"
+        self.parts = [_Part(text)] if text else []
+
+class _Candidate:
+    def __init__(self, text):
+        self.content = _Content(text)
+
+class ReplayResponse:
+    """Mimics the parts of a GenerateContentResponse (chunk) that are used."""
+
+    def __init__(self, text):
+        self.text = text
+        self.candidates = [_Candidate(text)]
+
+def _response_text(response):
+    try:
+        parts = response.candidates[0].content.parts
+        return parts[0].text if parts else ""
+    except (AttributeError, IndexError):
+        return ""
+
+def _content_summary(content):
+    """Text parts and the number of non-text parts of a user message."""
+    texts = []
+    others = 0
+    for part in content if isinstance(content, (list, tuple)) else [content]:
+        if isinstance(part, str):
+            texts.append(part)
+        elif isinstance(part, dict) and "text" in part:
+            texts.append(part["text"])
+        else:
+            others += 1
+    return "\n".join(texts), others
+
+def load_cassette(path):
+    """Returns the list of recorded turns in a cassette file."""
+    turns = []
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                turns.append(json.loads(line))
+    return turns
+
+class Cassette:
+    """
+    Recorded turns. Each turn is a dict with the prompt text, the number of
+    images sent, and the reply chunks as [seconds since the request, text].
+    """
+
+    def __init__(self, path, turns=None):
+        self.path = path
+        self.turns = turns if turns is not None else []
+        self._lock = threading.Lock()
+        self._cursor = 0
+        self._last = None  # Index of the turn returned last
+
+    @classmethod
+    def load(cls, path):
+        return cls(path, load_cassette(path))
+
+    def append(self, turn):
+        with self._lock:
+            self.turns.append(turn)
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(turn, ensure_ascii=False) + "\n")
+
+    def next_turn(self, prompt=None, loop=True):
+        """
+        Returns the recorded turn for prompt. Another attempt of the request
+        served last gets the same turn again; otherwise the next turn with
+        this prompt is returned, or the next one in recording order when no
+        turn has it (or prompt is None).
+        """
+        with self._lock:
+            if not self.turns:
+                raise RuntimeError(f"Cassette {self.path} has no recorded turns")
+            if prompt is not None and self._last is not None and self.turns[self._last]["prompt"] == prompt:
+                return self.turns[self._last]
+            index = self._find(prompt, loop) if prompt is not None else None
+            if index is None:
+                if self._cursor >= len(self.turns):
+                    if not loop:
+                        raise RuntimeError(f"Cassette {self.path} exhausted after {len(self.turns)} turns")
+                    self._cursor = 0
+                index = self._cursor
+            self._cursor = index + 1
+            self._last = index
+            return self.turns[index]
+
+    def _find(self, prompt, loop):
+        """Index of the next turn recorded with prompt, from the cursor on."""
+        order = list(range(self._cursor, len(self.turns)))
+        if loop:
+            order += range(self._cursor)
+        for index in order:
+            if self.turns[index]["prompt"] == prompt:
+                return index
+        return None
+
+def commit_recording(chat):
+    """Writes the pending turn of a RecordingChat to its cassette; other chats are ignored."""
+    commit = getattr(chat, "commit", None)
+    if commit is not None:
+        commit()
+
+class RecordingChat:
+    def __init__(self, chat, cassette):
+        self._chat = chat
+        self._cassette = cassette
+        self.pending = None  # Last completed turn, written by commit()
+
+    @property
+    def history(self):
+        return self._chat.history
+
+    def send_message(self, content, stream=False):
+        prompt, images = _content_summary(content)
+        start = time.perf_counter()
+        response = self._chat.send_message(content, stream=stream)
+        if not stream:
+            self._record(prompt, images, [[time.perf_counter() - start, _response_text(response)]])
+            return response
+        return self._record_stream(response, prompt, images, start)
+
+    def _record_stream(self, response, prompt, images, start):
+        chunks = []
+        for chunk in response:
+            chunks.append([time.perf_counter() - start, _response_text(chunk)])
+            yield chunk
+        self._record(prompt, images, chunks)
+
+    def _record(self, prompt, images, chunks):
+        self.pending = {
+            "prompt": prompt,
+            "images": images,
+            "chunks": [[round(offset, 4), text] for offset, text in chunks],
+        }
+
+    def commit(self):
+        if self.pending is not None:
+            self._cassette.append(self.pending)
+            self.pending = None
+
+class RecordingModel:
+    """Wraps a model and records the turns committed on its chats to a cassette."""
+
+    def __init__(self, model, cassette):
+        self.model = model
+        self.cassette = cassette if isinstance(cassette, Cassette) else Cassette(cassette)
+
+    def start_chat(self, history=None):
+        return RecordingChat(self.model.start_chat(history=history or []), self.cassette)
+
+class ReplayChat:
+    def __init__(self, model, history):
+        self.model = model
+        self.history = list(history or [])
+
+    def send_message(self, content, stream=False):
+        prompt, _ = _content_summary(content)
+        turn = self.model.cassette.next_turn(prompt, self.model.loop)
+        chunks = turn["chunks"]
+        start = time.perf_counter()
+        if not stream:
+            self._wait(start, chunks[-1][0] if chunks else 0.0)
+            text = "".join(text for _, text in chunks)
+            self._append(content, text)
+            return ReplayResponse(text)
+        return self._stream(content, chunks, start)
+
+    def _wait(self, start, offset):
+        delay = self.model.latency + offset * self.model.speed - (time.perf_counter() - start)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _stream(self, content, chunks, start):
+        texts = []
+        for offset, text in chunks:
+            self._wait(start, offset)
+            texts.append(text)
+            yield ReplayResponse(text)
+        self._append(content, "".join(texts))
+
+    def _append(self, content, text):
+        parts = list(content) if isinstance(content, (list, tuple)) else [content]
+        self.history.append({"role": "user", "parts": parts})
+        self.history.append({"role": "model", "parts": [text]})
+
+class ReplayModel:
+    """
+    Plays a cassette back, matching turns by prompt (see Cassette.next_turn).
+    latency: extra seconds added before every chunk arrives,
+    speed: factor applied to the recorded timings (0 replays instantly),
+    loop: start again from the first turn when the cassette is exhausted.
+    """
+
+    def __init__(self, cassette, latency=0.0, speed=1.0, loop=True):
+        self.cassette = cassette if isinstance(cassette, Cassette) else Cassette.load(cassette)
+        self.latency = latency
+        self.speed = speed
+        self.loop = loop
+
+    def start_chat(self, history=None):
+        return ReplayChat(self, history)
@@ -0,0 +1,223 @@
+# gemini_request_module.py
+"""
+Bounded-latency Gemini requests. A RequestRunner sends one user message
+with per-call deadlines, retries transient errors with exponential
+backoff, optionally hedges a slow request with a duplicate after the
+recent p95 latency, and falls back to a lighter model when the primary
+one misses its deadline. Every attempt runs on its own chat, and only the
+one that answered is kept, so an abandoned request cannot modify the
+conversation.
+"""
+import queue
+import random
+import threading
+import time
+from collections import deque, namedtuple
+import numpy as np
+from google.api_core import exceptions as google_exceptions
+
+REQUEST_DEADLINE = 15.0  # Seconds for a whole reply, retries and fallback included
+FIRST_CHUNK_DEADLINE = 8.0  # Seconds the primary model has to start replying
+CHUNK_DEADLINE = 5.0  # Maximum gap between two streamed chunks
+MAX_RETRIES = 2
+BACKOFF_BASE = 0.5  # Seconds before the first retry, doubled on every retry
+BACKOFF_MAX = 4.0
+HEDGE_PERCENTILE = 95  # A hedged duplicate is sent once the request is slower than this
+HEDGE_MIN_SAMPLES = 10  # Until then HEDGE_DEFAULT_DELAY is used
+HEDGE_DEFAULT_DELAY = 4.0
+HEDGE_MIN_DELAY = 1.0
+LATENCY_WINDOW = 50  # Recent first-chunk latencies kept for the percentile
+
+TRANSIENT_ERRORS = (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.BadGateway,
+    google_exceptions.GatewayTimeout,
+    TimeoutError,
+    ConnectionError,
+)
+
+# path: attempt that served the reply ("primary", "retry", "hedge", "fallback",
+# "fallback-retry") or "failed", model: "primary" or "fallback",
+# attempts/retries: requests started and retries among them, hedged/fallback:
+# whether a hedge or the fallback model was started, first_chunk/total: seconds
+# from the start of the turn, error: the last error seen or None.
+TurnRecord = namedtuple("TurnRecord", ["path", "model", "attempts", "retries", "hedged", "fallback",
+                                       "first_chunk", "total", "error"])
+
+def is_transient(error):
+    return isinstance(error, TRANSIENT_ERRORS)
+
+class LatencyWindow:
+    """Recent first-chunk latencies of the primary model."""
+
+    def __init__(self, size=LATENCY_WINDOW):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percentile=HEDGE_PERCENTILE):
+        with self._lock:
+            if not self._samples:
+                return None
+            return float(np.percentile(list(self._samples), percentile))
+
+    def hedge_delay(self):
+        with self._lock:
+            enough = len(self._samples) >= HEDGE_MIN_SAMPLES
+        if not enough:
+            return HEDGE_DEFAULT_DELAY
+        return max(HEDGE_MIN_DELAY, self.percentile())
+
+class _Attempt:
+    """One request on its own chat, run in a daemon thread that reports to a queue."""
+
+    def __init__(self, path, model, chat, content, stream, events):
+        self.path = path
+        self.model = model
+        self.chat = chat
+        self.cancelled = False
+        self._thread = threading.Thread(target=self._run, args=(content, stream, events),
+                                        name=f"gemini-{path}", daemon=True)
+        self._thread.start()
+
+    def _run(self, content, stream, events):
+        try:
+            response = self.chat.send_message(content, stream=stream)
+            for chunk in (response if stream else [response]):
+                if self.cancelled:
+                    return
+                events.put((self, "chunk", chunk))
+            events.put((self, "done", None))
+        except Exception as e:
+            events.put((self, "error", e))
+
+class RequestRunner:
+    """
+    Runs one turn. primary_chat/fallback_chat: callables returning a chat
+    with the current history on the primary and the fallback model, a
+    different one on every call; fallback_chat may be None. The deadlines default to the module
+    constants at the time the runner is created. After run() the winning
+    chat is in winner_chat and the TurnRecord in record.
+    """
+
+    def __init__(self, primary_chat, fallback_chat=None, latencies=None, hedge=False,
+                 deadline=None, first_chunk_deadline=None, chunk_deadline=None, max_retries=None):
+        self.primary_chat = primary_chat
+        self.fallback_chat = fallback_chat
+        self.latencies = latencies if latencies is not None else LatencyWindow()
+        self.hedge = hedge
+        self.deadline = deadline if deadline is not None else REQUEST_DEADLINE
+        self.first_chunk_deadline = first_chunk_deadline if first_chunk_deadline is not None else FIRST_CHUNK_DEADLINE
+        self.chunk_deadline = chunk_deadline if chunk_deadline is not None else CHUNK_DEADLINE
+        self.max_retries = max_retries if max_retries is not None else MAX_RETRIES
+        self.winner_chat = None
+        self.record = None
+
+    def run(self, content, stream=False):
+        """
+        Sends content and yields the reply chunks of the attempt that answers
+        first. Raises the last error (or TimeoutError) if no attempt answers
+        within the deadlines, or if the reply stops in the middle.
+        """
+        start = time.perf_counter()
+        deadline = start + self.deadline
+        first_chunk_deadline = min(start + self.first_chunk_deadline, deadline)
+        hedge_at = start + self.latencies.hedge_delay() if self.hedge else None
+        events = queue.Queue()
+        active = []
+        started = []
+        state = {"winner": None, "retries": 0, "hedged": False, "fallback": False,
+                 "first_chunk": None, "error": None}
+
+        def launch(path, model):
+            chat = self.primary_chat() if model == "primary" else self.fallback_chat()
+            attempt = _Attempt(path, model, chat, content, stream, events)
+            active.append(attempt)
+            started.append(attempt)
+
+        def start_fallback():
+            state["fallback"] = True
+            launch("fallback", "fallback")
+
+        launch("primary", "primary")
+        last_chunk = start
+        try:
+            while True:
+                winner = state["winner"]
+                if winner is None:
+                    wake = first_chunk_deadline
+                    if hedge_at is not None and not state["hedged"]:
+                        wake = min(wake, hedge_at)
+                else:
+                    wake = min(last_chunk + self.chunk_deadline, deadline)
+                try:
+                    attempt, kind, value = events.get(timeout=max(0.0, wake - time.perf_counter()))
+                except queue.Empty:
+                    now = time.perf_counter()
+                    if winner is None and hedge_at is not None and not state["hedged"] and now < first_chunk_deadline:
+                        state["hedged"] = True
+                        launch("hedge", "primary")
+                        continue
+                    if winner is None and not state["fallback"] and self.fallback_chat is not None:
+                        # The primary model missed its deadline; it may still win the race.
+                        self.latencies.add(now - start)
+                        start_fallback()
+                        first_chunk_deadline = deadline
+                        continue
+                    raise TimeoutError(f"No reply from Gemini after {now - start:.1f} s")
+
+                if winner is not None and attempt is not winner:
+                    continue
+                if kind == "error":
+                    active.remove(attempt)
+                    state["error"] = value
+                    if attempt is winner:
+                        raise value  # The reply stopped in the middle
+                    if active:
+                        continue  # Another attempt is still running
+                    if is_transient(value) and state["retries"] < self.max_retries:
+                        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** state["retries"]) * random.uniform(0.5, 1.0)
+                        if time.perf_counter() + delay < first_chunk_deadline:
+                            state["retries"] += 1
+                            time.sleep(delay)
+                            path = "retry" if attempt.model == "primary" else "fallback-retry"
+                            launch(path, attempt.model)
+                            continue
+                    if not state["fallback"] and self.fallback_chat is not None:
+                        start_fallback()
+                        first_chunk_deadline = deadline
+                        continue
+                    raise value
+                if winner is None:
+                    state["winner"] = attempt
+                    state["first_chunk"] = time.perf_counter() - start
+                    if attempt.model == "primary":
+                        self.latencies.add(state["first_chunk"])
+                    for other in active:
+                        if other is not attempt:
+                            other.cancelled = True
+                if kind == "done":
+                    self.winner_chat = attempt.chat
+                    return
+                last_chunk = time.perf_counter()
+                yield value
+        finally:
+            for attempt in active:
+                if attempt is not state["winner"]:
+                    attempt.cancelled = True
+            winner = state["winner"]
+            served = winner is not None and self.winner_chat is not None
+            self.record = TurnRecord(
+                winner.path if served else "failed",
+                winner.model if served else None,
+                len(started), state["retries"], state["hedged"], state["fallback"],
+                state["first_chunk"], time.perf_counter() - start,
+                None if served else state["error"],
+            )
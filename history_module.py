@@ -0,0 +1,218 @@
+# history_module.py
+import io
+import re
+from collections import namedtuple
+import PIL.Image
+
+HISTORY_KEEP_TURNS = 6  # Most recent turns kept verbatim
+HISTORY_IMAGE_TURNS = 1  # Most recent camera images kept (turns without an image do not count)
+HISTORY_MAX_TOKENS = 8000  # Approximate input token budget for the history
+HISTORY_MAX_BYTES = 512 * 1024  # Byte budget for the history, images included
+HISTORY_IMAGE_MODE = "strip"  # Older images: "strip" (text placeholder) or "thumbnail"
+THUMBNAIL_SIZE = (160, 160)
+THUMBNAIL_MAX_BYTES = 16 * 1024  # Images up to this size are treated as thumbnails already
+SUMMARY_MAX_CHARS = 1500
+SUMMARY_LINE_CHARS = 160
+IMAGE_TOKENS = 258  # Tokens Gemini counts for a small image
+IMAGE_PLACEHOLDER = "[imagen de la cámara omitida]"
+SUMMARY_PREFIX = "Resumen de la conversación anterior:"
+SUMMARY_ACK = "Entendido, tengo en cuenta el resumen."
+
+# <registrar_* valor> commands found in Gemini replies, preserved across summaries
+FACT_PATTERN = re.compile(r'<(registrar_\w+)\s+([^>]+)>')
+COMMAND_PATTERN = re.compile(r'<\w+\s+[^>]+>')
+
+# bytes/tokens: estimated size of a request, images: images in it,
+# turns: user turns kept verbatim.
+RequestSize = namedtuple("RequestSize", ["bytes", "tokens", "images", "turns"])
+
+def _role(content):
+    if isinstance(content, dict):
+        return content.get("role")
+    return getattr(content, "role", None)
+
+def _parts(content):
+    if isinstance(content, dict):
+        return list(content.get("parts", []))
+    return list(getattr(content, "parts", []))
+
+def _part_text(part):
+    if isinstance(part, str):
+        return part
+    if isinstance(part, dict):
+        return part.get("text", "") if "text" in part else ""
+    if isinstance(part, PIL.Image.Image):
+        return ""
+    return getattr(part, "text", "") or ""
+
+def _part_blob(part):
+    """Returns (mime_type, data) for an inline image part, otherwise None."""
+    if isinstance(part, dict):
+        blob = part.get("inline_data", part)
+        if "data" in blob:
+            return blob.get("mime_type", "image/jpeg"), blob["data"]
+        return None
+    if isinstance(part, (str, PIL.Image.Image)):
+        return None
+    blob = getattr(part, "inline_data", None)
+    data = getattr(blob, "data", b"") if blob is not None else b""
+    if data:
+        return blob.mime_type, data
+    return None
+
+def _is_image(part):
+    return isinstance(part, PIL.Image.Image) or _part_blob(part) is not None
+
+def _part_bytes(part):
+    if isinstance(part, PIL.Image.Image):
+        width, height = part.size
+        return width * height * 3 // 10  # Rough JPEG size, the image is encoded on upload
+    blob = _part_blob(part)
+    if blob is not None:
+        return len(blob[1])
+    return len(_part_text(part).encode("utf-8"))
+
+def _content_text(content):
+    return " ".join(text for text in (_part_text(part) for part in _parts(content)) if text)
+
+def _thumbnail(part):
+    if isinstance(part, PIL.Image.Image):
+        image = part.copy()
+    else:
+        image = PIL.Image.open(io.BytesIO(_part_blob(part)[1]))
+    image.thumbnail(THUMBNAIL_SIZE)
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, format="JPEG", quality=50)
+    return {"mime_type": "image/jpeg", "data": buffer.getvalue()}
+
+def _shorten(text, limit=SUMMARY_LINE_CHARS):
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+class ConversationHistory:
+    """
+    Keeps the Gemini chat history within token and byte budgets.
+    The last turns are kept verbatim, images are removed (or reduced to a
+    thumbnail) from older turns, and the oldest turns are folded into a
+    compact summary. Patient facts registered with <registrar_* valor>
+    commands are always kept in the summary.
+    """
+
+    def __init__(self, keep_turns=HISTORY_KEEP_TURNS, image_turns=HISTORY_IMAGE_TURNS,
+                 max_tokens=HISTORY_MAX_TOKENS, max_bytes=HISTORY_MAX_BYTES, image_mode=HISTORY_IMAGE_MODE):
+        self.keep_turns = keep_turns
+        self.image_turns = image_turns
+        self.max_tokens = max_tokens
+        self.max_bytes = max_bytes
+        self.image_mode = image_mode
+        self.reset()
+
+    def reset(self):
+        self.summary_lines = []
+        self.facts = {}
+        self.folded_turns = 0  # Turns folded into the summary so far
+        self.last_request_size = None
+
+    def measure(self, contents):
+        """Returns the estimated RequestSize of a list of contents."""
+        size_bytes = 0
+        tokens = 0
+        images = 0
+        turns = 0
+        for content in contents:
+            if _role(content) == "user":
+                turns += 1
+            for part in _parts(content):
+                size_bytes += _part_bytes(part)
+                if _is_image(part):
+                    images += 1
+                    tokens += IMAGE_TOKENS
+                else:
+                    tokens += len(_part_text(part)) // 4 + 1
+        return RequestSize(size_bytes, tokens, images, turns)
+
+    def _summary_contents(self):
+        if not self.summary_lines and not self.facts:
+            return []
+        lines = [SUMMARY_PREFIX]
+        if self.facts:
+            facts = "; ".join(f"{command} {value}" for command, value in self.facts.items())
+            lines.append(f"Datos registrados del paciente: {facts}")
+        lines.extend(self.summary_lines)
+        return [
+            {"role": "user", "parts": ["\n".join(lines)]},
+            {"role": "model", "parts": [SUMMARY_ACK]},
+        ]
+
+    def _fold(self, turn):
+        """Adds a turn to the summary, dropping the oldest lines beyond SUMMARY_MAX_CHARS."""
+        self.folded_turns += 1
+        for content in turn:
+            text = _content_text(content).replace(IMAGE_PLACEHOLDER, "").strip()
+            if _role(content) == "model":
+                for command, value in FACT_PATTERN.findall(text):
+                    self.facts[command] = value.strip()
+            # Commands are not repeated in the summary, the facts are kept above
+            text = COMMAND_PATTERN.sub("", text).strip()
+            if text:
+                speaker = "Paciente" if _role(content) == "user" else "Ferpy"
+                self.summary_lines.append(f"{speaker}: {_shorten(text)}")
+        while self.summary_lines and sum(len(line) + 1 for line in self.summary_lines) > SUMMARY_MAX_CHARS:
+            self.summary_lines.pop(0)
+
+    def _strip_images(self, turn):
+        """Returns the turn without images (or with thumbnails), and whether it changed."""
+        changed = False
+        stripped = []
+        for content in turn:
+            parts = []
+            for part in _parts(content):
+                if not _is_image(part):
+                    parts.append(part)
+                elif self.image_mode == "thumbnail" and _part_bytes(part) <= THUMBNAIL_MAX_BYTES:
+                    parts.append(part)  # Already reduced in an earlier turn
+                else:
+                    changed = True
+                    parts.append(_thumbnail(part) if self.image_mode == "thumbnail" else IMAGE_PLACEHOLDER)
+            stripped.append({"role": _role(content), "parts": parts})
+        return stripped, changed
+
+    def compact(self, history, pinned=0):
+        """
+        Applies the limits to a chat history.
+        pinned: number of leading contents that are always kept (e.g. the instructions).
+        Returns the new history as a list of contents, or None if nothing changed.
+        """
+        head = list(history[:pinned])
+        body = list(history[pinned:])
+        if body and _role(body[0]) == "user" and _content_text(body[0]).startswith(SUMMARY_PREFIX):
+            body = body[2:]  # Our previous summary, rebuilt below
+
+        turns = []
+        for content in body:
+            if _role(content) == "user" or not turns:
+                turns.append([])
+            turns[-1].append(content)
+
+        changed = False
+        while len(turns) > self.keep_turns:
+            self._fold(turns.pop(0))
+            changed = True
+        # Unchanged scenes are sent without an image, so keep the last images
+        # rather than the images of the last turns.
+        image_turns = [index for index, turn in enumerate(turns)
+                       if any(_is_image(part) for content in turn for part in _parts(content))]
+        for index in image_turns[:max(0, len(image_turns) - self.image_turns)]:
+            turns[index], stripped = self._strip_images(turns[index])
+            changed = changed or stripped
+
+        def build():
+            return head + self._summary_contents() + [content for turn in turns for content in turn]
+
+        while len(turns) > 1:
+            size = self.measure(build())
+            if size.tokens <= self.max_tokens and size.bytes <= self.max_bytes:
+                break
+            self._fold(turns.pop(0))
+            changed = True
+        return build() if changed else None
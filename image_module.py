@@ -0,0 +1,92 @@
+# image_module.py
+import io
+import os
+import time
+from collections import namedtuple
+import numpy as np
+import PIL.Image
+
+UPLOAD_MAX_SIZE = (512, 512)  # Frames are scaled down to fit in this box before upload
+UPLOAD_JPEG_QUALITY = 70
+HASH_SIZE = 8  # dHash of HASH_SIZE x HASH_SIZE bits
+SCENE_CHANGE_THRESHOLD = 6  # Differing hash bits from which the scene counts as changed
+SCENE_MAX_AGE = 60.0  # Seconds after which a frame is sent even if the scene looks the same
+SCENE_UNCHANGED_NOTE = "[escena sin cambios desde la última imagen]"
+
+# part: the image part to upload ({"mime_type", "data"}) or None if the scene is unchanged,
+# bytes: size of the uploaded JPEG (0 if skipped), distance: differing hash bits
+# from the last frame sent (None for the first one), seconds: preprocessing time.
+PreparedFrame = namedtuple("PreparedFrame", ["part", "bytes", "distance", "seconds"])
+
+def to_pil_image(image):
+    """
+    Returns a PIL image for an RGB image array, a path to an image file or
+    an existing PIL image. Arrays are wrapped without a JPEG round-trip.
+    """
+    if isinstance(image, PIL.Image.Image):
+        return image
+    if isinstance(image, (str, os.PathLike)):
+        return PIL.Image.open(image)
+    return PIL.Image.fromarray(image)
+
+def difference_hash(image, hash_size=HASH_SIZE):
+    """
+    Perceptual difference hash: one bit per horizontally adjacent pair of
+    pixels of a small grayscale version of the image. Returns a bool array.
+    """
+    small = to_pil_image(image).convert("L").resize((hash_size + 1, hash_size), PIL.Image.BILINEAR)
+    pixels = np.asarray(small, dtype=np.int16)
+    return (pixels[:, 1:] > pixels[:, :-1]).ravel()
+
+def hash_distance(first, second):
+    return int(np.count_nonzero(first != second))
+
+def encode_jpeg(image, max_size=UPLOAD_MAX_SIZE, quality=UPLOAD_JPEG_QUALITY):
+    """Returns the image scaled to fit max_size as JPEG bytes."""
+    image = to_pil_image(image)
+    if image.width > max_size[0] or image.height > max_size[1]:
+        image = image.copy()
+        image.thumbnail(max_size, PIL.Image.BILINEAR)
+    buffer = io.BytesIO()
+    image.convert("RGB").save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+class FramePreprocessor:
+    """
+    Prepares camera frames for the Gemini upload: scales them down, encodes
+    them as JPEG and skips frames whose perceptual hash is close to the last
+    frame sent, so an unchanged scene is not uploaded every turn.
+    """
+
+    def __init__(self, max_size=UPLOAD_MAX_SIZE, quality=UPLOAD_JPEG_QUALITY,
+                 threshold=SCENE_CHANGE_THRESHOLD, max_age=SCENE_MAX_AGE):
+        self.max_size = max_size
+        self.quality = quality
+        self.threshold = threshold
+        self.max_age = max_age
+        self.reset()
+
+    def reset(self):
+        """Forgets the last frame sent; the next frame is always sent."""
+        self._last_hash = None
+        self._last_sent = 0.0
+
+    def prepare(self, image, force=False):
+        """
+        Returns a PreparedFrame. part is None when the scene has not changed
+        since the last frame sent, unless force is set.
+        """
+        start = time.perf_counter()
+        image = to_pil_image(image)
+        frame_hash = difference_hash(image)
+        distance = None
+        if self._last_hash is not None:
+            distance = hash_distance(frame_hash, self._last_hash)
+            fresh = time.monotonic() - self._last_sent < self.max_age
+            if not force and fresh and distance < self.threshold:
+                return PreparedFrame(None, 0, distance, time.perf_counter() - start)
+        data = encode_jpeg(image, self.max_size, self.quality)
+        self._last_hash = frame_hash
+        self._last_sent = time.monotonic()
+        part = {"mime_type": "image/jpeg", "data": data}
+        return PreparedFrame(part, len(data), distance, time.perf_counter() - start)
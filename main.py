@@ -1,54 +1,96 @@
 # filepath: /home/DoctorFerpy/Documents/WRO/Dr_Ferpy_WRO/main.py
 import os
 import json
+import copy
+import asyncio
 import face_recognition_module
 import Gemini_module
 import time
-from gtts import gTTS
-import pygame
 import threading
 from comand_handler import RobotCommandHandler
-import pyaudio
 import wave
 import speech_recognition as sr
 import camera_module
+import presence_module
+import tts_module
+import audio_module
+import pipeline_module
+import voice_module
+import microphone_module
+from contextlib import nullcontext
 
 os.environ['SDL_AUDIODRIVER'] = 'alsa'  # Use ALSA for audio on Debian
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'  # Delete pygame support prompt
 
-def speak_text(text, lang='es', tld='com'):
-    """Convert text to speech using gTTS and play it using pygame."""
-    tts = gTTS(text=text, lang=lang, slow=False, tld=tld)  # Use 'com.mx' for a male-like voice in Spanish
-    temp_audio_file = "temp_audio.mp3"
-    tts.save(temp_audio_file)
-    pygame.mixer.init()
-    pygame.mixer.music.load(temp_audio_file)
-    pygame.mixer.music.play()
-    while pygame.mixer.music.get_busy():
-        pygame.time.Clock().tick(10)
-
-def record_voice_wave(filename="prompt.wav", record_seconds=5, chunk=1024, fmt=pyaudio.paInt16, channels=1, rate=44100):
+# Write each interaction frame to interaction.jpg (debugging only; frames are passed in memory)
+SAVE_INTERACTION_IMAGE = os.getenv('FERPY_SAVE_INTERACTION_IMAGE') == '1'
+INTERACTION_IMAGE_FILE = "interaction.jpg"
+ENROLLMENT_FRAMES = 5  # Frames captured to identify or enroll a face
+# Speak and move while Gemini's reply is still being generated
+STREAMING_RESPONSES = os.getenv('FERPY_STREAMING_RESPONSES', '1') != '0'
+# Overlap listening, frame capture, Gemini, parsing, speech and saving (pipeline_module)
+PIPELINED_LOOP = os.getenv('FERPY_PIPELINED_LOOP', '1') != '0'
+
+# Keep the current user identity warm with a background recognition thread
+PRESENCE_TRACKING = os.getenv('FERPY_PRESENCE_TRACKING') == '1'
+presence_tracker = None
+
+def presence_paused():
+    """Pauses background presence tracking while the block runs (speech)."""
+    if presence_tracker is None:
+        return nullcontext()
+    return presence_tracker.paused()
+
+def current_presence(since=None):
+    """
+    Returns the fresh identity published by the presence tracker, if any.
+    since: time.time() the identity's age is measured from, e.g. when the
+    turn started; defaults to now.
+    """
+    if presence_tracker is None:
+        return None
+    return presence_tracker.current_identity(since=since)
+
+def capture_interaction_image():
+    """
+    Captures the current camera frame as an RGB array.
+    The frame is only encoded to JPEG when SAVE_INTERACTION_IMAGE is enabled.
     """
-    Record the user's voice from the USB microphone and save it as a WAV file.
-    Returns the filename.
+    image = camera_module.capture_image()
+    if SAVE_INTERACTION_IMAGE:
+        camera_module.save_image(image, INTERACTION_IMAGE_FILE)
+    return image
+
+def speak_text(text, lang='es', tld='com', latency_critical=False):
+    """
+    Convert text to speech and play it from memory (audio_module). The audio
+    comes from the phrase cache (tts_module), gTTS is only called for phrases
+    not heard before. latency_critical: True only for short fixed prompts
+    ("Sí", countdowns, error messages), which may use the local voice when
+    not cached. Phrases with names or other changing text keep the default.
+    """
+    with presence_paused():
+        # Use tld='com.mx' for a male-like voice in Spanish
+        audio = tts_module.get_cache().get(text, lang=lang, tld=tld, latency_critical=latency_critical)
+        audio_module.get_player().play(audio)
+
+def record_voice_wave(filename="prompt.wav", record_seconds=5):
     """
-    audio = pyaudio.PyAudio()
-    stream = audio.open(format=fmt, channels=channels, rate=rate, input=True, frames_per_buffer=chunk)
+    Record the user's voice from the shared microphone (16 kHz mono) and save it
+    as a WAV file. Recording stops when the user stops speaking, or after
+    record_seconds. Returns the filename.
+    """
+    microphone = microphone_module.get_microphone()
+    recorder = voice_module.UtteranceRecorder(microphone.vad(), max_ms=int(record_seconds * 1000))
     print("Recording voice prompt... Please speak now.")
-    frames = []
-    for _ in range(0, int(rate / chunk * record_seconds)):
-        data = stream.read(chunk)
-        frames.append(data)
+    with microphone.subscribe(pre_roll_ms=voice_module.PRE_ROLL_MS) as frames:
+        audio = recorder.record(frames.read, start_timeout=record_seconds) or b""
     print("Recording finished.")
-    stream.stop_stream()
-    stream.close()
-    audio.terminate()
-    wf = wave.open(filename, 'wb')
-    wf.setnchannels(channels)
-    wf.setsampwidth(audio.get_sample_size(fmt))
-    wf.setframerate(rate)
-    wf.writeframes(b''.join(frames))
-    wf.close()
+    with wave.open(filename, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(microphone.sample_rate)
+        wf.writeframes(audio)
     return filename
 
 def audio_to_text(audio_file):
@@ -64,91 +106,82 @@ def audio_to_text(audio_file):
     except sr.RequestError as e:
         return f"Error al conectar con el servicio de reconocimiento de voz: {e}"
 
-def listen_for_command():
+def listen_for_command(on_speech_end=None):
     """
-    Escucha continuamente en fragmentos de 1 segundo y muestra lo que se está escuchando.
-    Cuando detecta el trigger ("doctor ferpi" o similar) en un fragmento, comienza a grabar el comando completo.
-    La grabación continúa sin ciclos intermedios hasta que transcurre 1 segundo sin escuchar voz.
+    Escucha continuamente y detecta la frase de activación ("doctor ferpi" o similar) en el
+    propio dispositivo (voice_module): solo los segmentos con voz llegan al detector local.
+    Tras la activación graba el comando completo como una sola frase: el VAD detecta su
+    final tras un breve silencio y se transcribe con una única petición a la nube.
+    El audio llega del micrófono compartido (microphone_module), ya abierto y calibrado.
+    on_speech_end: función opcional que se llama cuando termina el comando,
+    antes de transcribirlo (p. ej. para capturar la imagen mientras tanto).
     Retorna el comando reconocido.
     """
     recognizer = sr.Recognizer()
-    recognizer.pause_threshold = 1
-    with sr.Microphone() as source:
-        recognizer.adjust_for_ambient_noise(source)
+    microphone = microphone_module.get_microphone()
+    detector = voice_module.WakeWordDetector(vad=microphone.vad())
+    recorder = voice_module.UtteranceRecorder(detector.vad)
+    with microphone.subscribe() as frames:
         print("Micrófono activo: Esperando comando de voz...")
         while True:
-            try:
-                # Escucha en fragmentos de 1 segundo
-                audio_chunk = recognizer.listen(source, phrase_time_limit=1)
+            # Detección local de la frase de activación sobre el audio del micrófono
+            detector.wait(frames.read)
+            print("Frase de activación detectada.")
+            # Immediately say "Sí" when activation phrase is detected
+            speak_text("Sí", latency_critical=True)
+            # Descarta lo grabado mientras el robot hablaba (su propio "Sí")
+            frames.drain()
+            print("Comienza a grabar el comando completo...")
+            command_audio = recorder.record(frames.read)
+            command_text = ""
+            if command_audio is None:
+                print("Silencio detectado. Fin del comando.")
+            else:
+                if on_speech_end is not None:
+                    on_speech_end()
+                start = time.perf_counter()
                 try:
-                    chunk_text = recognizer.recognize_google(audio_chunk, language="es-ES").lower()
-                    print(f"Escuchado: {chunk_text}")  # Muestra lo escuchado
+                    command_text = recognizer.recognize_google(recorder.to_audio_data(command_audio), language="es-ES")
                 except sr.UnknownValueError:
+                    pass
+                except sr.RequestError as e:
+                    print(f"Error con el servicio de reconocimiento de voz: {e}")
                     continue
-                # Verificar si se detecta la frase de activación
-                activation_phrases = ["doctor","dr", "dry","doctor f", "dr f","ferti","fermin","doctor ferpi", "dr fer", "doctor fer", "dr ferpi", "ferpi", "dr fairy", "ferpi"]
-                if any(phrase in chunk_text for phrase in activation_phrases):
-                    print("Frase de activación detectada.")
-                    # Immediately say "Sí" when activation phrase is detected
-                    speak_text("Sí")
-                    print("Comienza a grabar el comando completo...")
-                    command_text = ""
-                    last_audio_time = time.time()
-                    # Se ingresa a un bucle sin ciclos intermedios. Se va actualizando
-                    # el tiempo en que se recibió voz y se acumulan las partes.
-                    while True:
-                        try:
-                            # Escucha fragmentos cortos; usamos timeout corto para detectar el silencio.
-                            command_audio = recognizer.listen(source, timeout=0.5, phrase_time_limit=5)
-                            try:
-                                part_text = recognizer.recognize_google(command_audio, language="es-ES")
-                                print(f"Grabado: {part_text}")
-                                command_text += " " + part_text
-                                last_audio_time = time.time()
-                            except sr.UnknownValueError:
-                                # No se entendió, pero se sigue el lazo para detectar silencio.
-                                pass
-                        except sr.WaitTimeoutError:
-                            # Si no se obtiene audio en este fragmento, verificar cuánto tiempo ha pasado.
-                            if time.time() - last_audio_time >= 1:
-                                print("Silencio detectado. Fin del comando.")
-                                break
-                    command_text = command_text.strip()
-                    print(f"Comando completo: {command_text}")
-                    # Say "Entendido" after capturing the full command
-                    speak_text("Entendido")
-                    return command_text
-            except sr.RequestError as e:
-                print(f"Error con el servicio de reconocimiento de voz: {e}")
-                continue
+                print(f"Transcripción en {time.perf_counter() - start:.2f} s")
+            command_text = command_text.strip()
+            print(f"Comando completo: {command_text}")
+            # Say "Entendido" after capturing the full command
+            speak_text("Entendido", latency_critical=True)
+            return command_text
 
 def listen_for_name():
     """
     Captures the user's name without requiring a trigger phrase.
-    The user speaks, and their voice is recorded until 1 second of silence is detected.
+    The user speaks, and their voice is recorded until a short silence is detected.
     Prints what is heard. If no name is detected, it asks again.
     Returns the recognized name.
     """
     recognizer = sr.Recognizer()
-    recognizer.pause_threshold = 1
-    with sr.Microphone() as source:
-        recognizer.adjust_for_ambient_noise(source)
+    microphone = microphone_module.get_microphone()
+    recorder = voice_module.UtteranceRecorder(microphone.vad(), max_ms=5000)
+    with microphone.subscribe() as frames:
         while True:
-            name_text = ""
             print("Listening for your name...")
-            try:
-                # Listen for up to 5 seconds or until silence is detected
-                audio_chunk = recognizer.listen(source, timeout=5, phrase_time_limit=5)
-                try:
-                    name_text = recognizer.recognize_google(audio_chunk, language="es-ES").strip()
-                    print(f"Captured name: {name_text}")
-                    return name_text
-                except sr.UnknownValueError:
-                    print("Could not understand the audio. Please try again.")
-                    speak_text("No se entendió tu voz. Intenta de nuevo.")
-            except sr.WaitTimeoutError:
+            # Listen for up to 5 seconds or until silence is detected
+            name_audio = recorder.record(frames.read, start_timeout=5)
+            if name_audio is None:
                 print("No voice detected. Please try again.")
-                speak_text("No se detectó ninguna voz. Intenta de nuevo.")
+                speak_text("No se detectó ninguna voz. Intenta de nuevo.", latency_critical=True)
+                frames.drain()
+                continue
+            try:
+                name_text = recognizer.recognize_google(recorder.to_audio_data(name_audio), language="es-ES").strip()
+                print(f"Captured name: {name_text}")
+                return name_text
+            except sr.UnknownValueError:
+                print("Could not understand the audio. Please try again.")
+                speak_text("No se entendió tu voz. Intenta de nuevo.", latency_critical=True)
+                frames.drain()
 
 def load_patients_db(filename="patients_database.json"):
     if os.path.exists(filename):
@@ -164,7 +197,7 @@ def save_patients_db(db, filename="patients_database.json"):
     with open(filename, "w") as f:
         json.dump(db, f, indent=4)
 
-def capture_patient_name(database, interaction_image="interaction.jpg"):
+def capture_patient_name(database):
     """
     Performs facial recognition to identify or register a patient.
     Returns the patient's name.
@@ -174,39 +207,41 @@ def capture_patient_name(database, interaction_image="interaction.jpg"):
     identify_user_try = 0
     while not user_name and identify_user_try < 5:
         print("Please look at the camera.")
-        speak_text("Por favor, mire a la cámara.")
+        speak_text("Por favor, mire a la cámara.", latency_critical=True)
         for msg in ["Tomando una nueva imagen en 3...", "2...", "1..."]:
             print(msg)
-            speak_text(msg)
+            speak_text(msg, latency_critical=True)
             time.sleep(1)
-        camera_module.capture_and_save_image(interaction_image)
-        detected_face = face_recognition_module.detect_face(interaction_image)
+        # A short burst gives several chances to match and several samples to enroll
+        frames = camera_module.capture_burst(ENROLLMENT_FRAMES)
+        if SAVE_INTERACTION_IMAGE:
+            camera_module.save_image(frames[-1], INTERACTION_IMAGE_FILE)
+        match, detected_face = face_recognition_module.identify_in_frames(frames, database)
         if detected_face:
-            candidate = face_recognition_module.identify_user(interaction_image, database)
-            if candidate:
-                user_name = candidate
+            if match:
+                user_name = match.name
             else:
                 print("Face detected but not recognized. Asking for name to register.")
-                speak_text("Se detectó una cara, pero no está registrada, por favor di tu nombre para registrarte.")
+                speak_text("Se detectó una cara, pero no está registrada, por favor di tu nombre para registrarte.", latency_critical=True)
                 time.sleep(1)
                 for attempt in range(2):
                     time.sleep(1)
                     user_name_text = listen_for_name()
                     if user_name_text:
                         user_name = user_name_text.strip()
-                        face_recognition_module.register_user(user_name, interaction_image, database)
+                        face_recognition_module.enroll_user(user_name, frames, database)
                         print(f"User {user_name} registered successfully.")
                         break
                     else:
                         print("Could not capture the name. Asking again.")
-                        speak_text("No se pudo capturar tu nombre. Intenta de nuevo.")
+                        speak_text("No se pudo capturar tu nombre. Intenta de nuevo.", latency_critical=True)
                 if not user_name:
                     print("Failed to capture name after 2 attempts. Setting default name 'Paciente'.")
                     user_name = "Paciente"
                     break
         else:
             print("No face detected. Asking for name via voice.")
-            speak_text("No se detectó ninguna cara. Por favor, di tu nombre.")
+            speak_text("No se detectó ninguna cara. Por favor, di tu nombre.", latency_critical=True)
             for attempt in range(2):
                 user_name_text = listen_for_name()
                 if user_name_text:
@@ -214,7 +249,7 @@ def capture_patient_name(database, interaction_image="interaction.jpg"):
                     break
                 else:
                     print("Could not capture the name. Asking again.")
-                    speak_text("No se pudo capturar tu nombre. Intenta de nuevo.")
+                    speak_text("No se pudo capturar tu nombre. Intenta de nuevo.", latency_critical=True)
                     time.sleep(1)
             if not user_name:
                 print("Failed to capture name after 2 attempts. Setting default name 'Paciente'.")
@@ -227,10 +262,13 @@ def capture_patient_name(database, interaction_image="interaction.jpg"):
     time.sleep(1)
     return user_name
 
-def initialize_patient(database, patients_db, interaction_image="interaction.jpg"):
-    camera_module.capture_and_save_image(interaction_image)
-
-    user_name = capture_patient_name(database, interaction_image)
+def initialize_patient(database, patients_db):
+    presence = current_presence()
+    if presence is not None and presence.name:
+        # Already recognized in the background, skip the capture countdown
+        user_name = presence.name
+    else:
+        user_name = capture_patient_name(database)
     print(f"Welcome, {user_name}!")
     speak_text(f"Bienvenido, {user_name}!")
 
@@ -251,16 +289,29 @@ def initialize_patient(database, patients_db, interaction_image="interaction.jpg
 
     return user_name, patient_data
 
-def handle_user_identification(database, patients_db, interaction_image_path="interaction.jpg"):
+def handle_user_identification(database, patients_db, interaction_image, turn_started=None):
     """
     Handles user identification when <change_user 0> command is received.
+    interaction_image: the most recent captured RGB frame.
+    turn_started: time.time() when interaction_image was captured; the
+    presence tracker's identity must be fresh at that time, since the
+    command is only handled after the reply.
     Returns (user_name, patient_data) for the identified user.
     """
     print("Iniciando identificación de usuario...")
     
-    detected_face = face_recognition_module.detect_face(interaction_image_path)
+    presence = current_presence(since=turn_started)
+    if presence is not None and presence.name:
+        # Answer from the presence tracker instead of a fresh recognition pass
+        print(f"Identidad del seguimiento de presencia (confianza {presence.confidence:.2f})")
+        detected_face = True
+        candidate = presence.name
+    else:
+        detected_face = face_recognition_module.detect_face(interaction_image)
+        candidate = None
     if detected_face:
-        candidate = face_recognition_module.identify_user(interaction_image_path, database)
+        if candidate is None:
+            candidate = face_recognition_module.identify_user(interaction_image, database)
         if candidate:
             user_name = candidate
             patient_data = patients_db.get(user_name, {
@@ -278,38 +329,43 @@ def handle_user_identification(database, patients_db, interaction_image_path="in
         else:
             # Face detected but not recognized - ACTUALLY REGISTER THE USER
             print("Cara detectada pero no reconocida. Pidiendo nombre para registro.")
-            speak_text("Se detectó una cara, pero no está registrada. Por favor, dime tu nombre para registrarte.")
+            speak_text("Se detectó una cara, pero no está registrada. Por favor, dime tu nombre para registrarte.", latency_critical=True)
             
             for attempt in range(2):
                 user_name_text = listen_for_name()
                 if user_name_text:
                     new_user_name = user_name_text.strip()
                     # Actually register the user
-                    return handle_user_registration(new_user_name, database, patients_db, interaction_image_path)
+                    return handle_user_registration(new_user_name, database, patients_db, interaction_image)
                 else:
                     print("Could not capture the name. Asking again.")
-                    speak_text("No se pudo capturar tu nombre. Intenta de nuevo.")
+                    speak_text("No se pudo capturar tu nombre. Intenta de nuevo.", latency_critical=True)
             
             # Registration failed after 2 attempts
             print("Failed to capture name after 2 attempts.")
-            speak_text("No se pudo capturar el nombre. Continuando con usuario actual.")
+            speak_text("No se pudo capturar el nombre. Continuando con usuario actual.", latency_critical=True)
             return None, None
     else:
         # No face detected - keep current user as requested
         print("No se detectó ninguna cara. Manteniendo usuario actual.")
-        speak_text("No se detectó ninguna cara. Manteniendo usuario actual.")
+        speak_text("No se detectó ninguna cara. Manteniendo usuario actual.", latency_critical=True)
         return "NO_FACE_DETECTED", None
 
-def handle_user_registration(user_name, database, patients_db, interaction_image_path="interaction.jpg"):
+def handle_user_registration(user_name, database, patients_db, interaction_image):
     """
     Handles user registration when <register_user [name]> command is received.
+    interaction_image: the most recent captured RGB frame.
     Returns (user_name, patient_data) for the newly registered user.
     """
     print(f"Registrando usuario: {user_name}")
+    # Enroll from the turn's image plus a short burst, encoded in the worker pool
+    # while the confirmation is spoken
+    frames = [interaction_image] + camera_module.capture_burst(ENROLLMENT_FRAMES - 1)
+    face_recognition_module.analyze_frames_async(frames)
     speak_text(f"Entendido, registraré a {user_name}.")
     
-    # Register the user with the current image
-    face_recognition_module.register_user(user_name, interaction_image_path, database)
+    # Register the user (waits for the encodings started above)
+    face_recognition_module.enroll_user(user_name, frames, database)
     
     # Create patient data for the new user
     patient_data = {
@@ -331,9 +387,12 @@ def handle_user_registration(user_name, database, patients_db, interaction_image
     
     return user_name, patient_data
 
-def process_gemini_user_commands(response_text, database, patients_db, current_user_name, robot):
+def process_gemini_user_commands(response_text, database, patients_db, current_user_name, robot, interaction_image,
+                                 turn_started=None):
     """
     Processes Gemini's user management commands before executing response segments.
+    interaction_image: the RGB frame sent to Gemini with the current turn.
+    turn_started: time.time() when that frame was captured.
     Returns (updated_user_name, updated_patient_data, cleaned_response) if user changes occur.
     """
     import re
@@ -341,7 +400,8 @@ def process_gemini_user_commands(response_text, database, patients_db, current_u
     # Check for <change_user 0> command
     change_user_match = re.search(r'<change_user\s+0>', response_text)
     if change_user_match:
-        new_user_name, new_patient_data = handle_user_identification(database, patients_db)
+        new_user_name, new_patient_data = handle_user_identification(database, patients_db, interaction_image,
+                                                                     turn_started)
         if new_user_name and new_user_name != "NO_FACE_DETECTED":
             # User successfully identified or registered
             cleaned_response = re.sub(r'<change_user\s+0>', '', response_text)
@@ -359,7 +419,7 @@ def process_gemini_user_commands(response_text, database, patients_db, current_u
     register_user_match = re.search(r'<register_user\s+([^>]+)>', response_text)
     if register_user_match:
         new_user_name = register_user_match.group(1).strip()
-        new_user_name, new_patient_data = handle_user_registration(new_user_name, database, patients_db)
+        new_user_name, new_patient_data = handle_user_registration(new_user_name, database, patients_db, interaction_image)
         # Remove the command from response text
         cleaned_response = re.sub(r'<register_user\s+[^>]+>', '', response_text)
         return new_user_name, new_patient_data, cleaned_response
@@ -367,6 +427,28 @@ def process_gemini_user_commands(response_text, database, patients_db, current_u
     # No user management commands found, return original response
     return current_user_name, robot.patient_data, response_text
 
+def apply_user_commands(response_text, patients_db, user_name, robot, gemini_session, interaction_image,
+                        turn_started=None):
+    """
+    Processes the user management commands of a reply and switches the
+    current user if needed. Returns (user_name, cleaned_response).
+    """
+    new_user_name, new_patient_data, cleaned_response = process_gemini_user_commands(
+        response_text, face_recognition_module.load_database(), patients_db, user_name, robot, interaction_image,
+        turn_started
+    )
+    
+    # Update user and patient data if changed
+    if new_user_name != user_name:
+        user_name = new_user_name
+        robot.patient_data = new_patient_data
+        gemini_session.reset()
+        print(f"Usuario cambiado a: {user_name}")
+        # Ensure patients_db has the updated user
+        if user_name not in patients_db:
+            patients_db[user_name] = new_patient_data
+    return user_name, cleaned_response
+
 def conversation_loop(robot, patients_db, user_name):
     """
     Runs the conversation loop with Gemini.
@@ -374,7 +456,8 @@ def conversation_loop(robot, patients_db, user_name):
     sends the prompt to Gemini, processes the response,
     and updates the patient data.
     """
-    conversation_messages = []
+    # One Gemini session per patient; reset when the user changes
+    gemini_session = Gemini_module.GeminiSession()
     
     # Initial greeting
     print("Iniciando conversación con Doctor Ferpy...")
@@ -385,51 +468,127 @@ def conversation_loop(robot, patients_db, user_name):
         user_prompt_text = listen_for_command()
         print(f"Comando reconocido: {user_prompt_text}")
 
-        interaction_image_path = "interaction.jpg"
-        camera_module.capture_and_save_image(interaction_image_path)
-        time.sleep(0.1)
+        turn_started = time.time()
+        interaction_image = capture_interaction_image()
 
+        # The presence tracker keeps sampling while Gemini is awaited (only speech pauses it)
         print("Enviando tu prompt a Gemini...")
-        response_text, conversation_messages = Gemini_module.gemini_interaction(
-            conversation_messages, user_prompt_text, interaction_image_path, robot.patient_data
-        )
+        if STREAMING_RESPONSES:
+            # Sentences and commands are executed as they arrive; user management
+            # commands are handled once the whole reply is known.
+            response_text = robot.execute_response_stream(
+                gemini_session.send_stream(user_prompt_text, interaction_image, robot.patient_data)
+            )
+            print(f"Primera respuesta hablada en {robot.last_stream_timings.get('first_item', 0):.2f} s")
+        else:
+            response_text = gemini_session.send(user_prompt_text, interaction_image, robot.patient_data)
         print("Gemini responde:", response_text)
         
         # Process user management commands before executing response segments
-        new_user_name, new_patient_data, cleaned_response = process_gemini_user_commands(
-            response_text, face_recognition_module.load_database(), patients_db, user_name, robot
+        user_name, cleaned_response = apply_user_commands(
+            response_text, patients_db, user_name, robot, gemini_session, interaction_image, turn_started
         )
         
-        # Update user and patient data if changed
-        if new_user_name != user_name:
-            user_name = new_user_name
-            robot.patient_data = new_patient_data
-            print(f"Usuario cambiado a: {user_name}")
-            # Ensure patients_db has the updated user
-            if user_name not in patients_db:
-                patients_db[user_name] = new_patient_data
-        
-        print("Procesando la respuesta intercalando comandos y texto:")
-        robot.execute_response_segments(cleaned_response)
+        if not STREAMING_RESPONSES:
+            print("Procesando la respuesta intercalando comandos y texto:")
+            robot.execute_response_segments(cleaned_response)
 
         # Update patient data in the patients_db and save changes
         patients_db[user_name] = robot.patient_data
         save_patients_db(patients_db)
 
+def conversation_pipeline(robot, patients_db, user_name):
+    """
+    Same conversation as conversation_loop(), but each turn runs as
+    overlapping stages (see pipeline_module): the frame is captured while
+    the command is transcribed, sentences are spoken while the rest of the
+    reply is parsed and the patients database is saved in the background.
+    """
+    gemini_session = Gemini_module.GeminiSession()
+    state = {"user_name": user_name, "turn_started": None}
+
+    def reply_stream(prompt, interaction_image):
+        # Turns run one after the other, handle_reply() reads this before the next turn
+        state["turn_started"] = time.time()
+        if SAVE_INTERACTION_IMAGE:
+            camera_module.save_image(interaction_image, INTERACTION_IMAGE_FILE)
+        print("Enviando tu prompt a Gemini...")
+        if STREAMING_RESPONSES:
+            yield from gemini_session.send_stream(prompt, interaction_image, robot.patient_data)
+        else:
+            yield gemini_session.send(prompt, interaction_image, robot.patient_data)
+
+    def handle_reply(response_text, interaction_image):
+        state["user_name"], _ = apply_user_commands(
+            response_text, patients_db, state["user_name"], robot, gemini_session, interaction_image,
+            state["turn_started"]
+        )
+        patients_db[state["user_name"]] = robot.patient_data
+
+    pipeline = pipeline_module.ConversationPipeline(
+        listen=listen_for_command,
+        capture_frame=camera_module.capture_image,
+        reply_stream=reply_stream,
+        run_item=robot.queue_response_item,
+        handle_reply=handle_reply,
+        snapshot=lambda: copy.deepcopy(patients_db),
+        persist=save_patients_db,
+        finish_items=robot.wait_response,
+    )
+
+    # Initial greeting
+    print("Iniciando conversación con Doctor Ferpy...")
+    speak_text("Hola, soy Doctor Ferpy. ¿Cómo puedo ayudarte?")
+    print("Esperando 'Doctor Ferpy' para iniciar el comando...")
+    asyncio.run(pipeline.run())
+
 def main():
-    # Load the face database and patients database
-    database = face_recognition_module.load_database()
-    patients_db = load_patients_db()
+    global presence_tracker
 
-    # Set up patient data
-    user_name, patient_data = initialize_patient(database, patients_db)
-    
-    # Initialize robot command handler and assign patient data
-    robot = RobotCommandHandler()
-    robot.patient_data = patient_data
+    # Open the camera once; frames are kept warm by a background thread
+    camera_module.start_camera()
+    # Initialise the audio output once
+    audio_module.get_player().start()
+    # Open the microphone once; the ambient noise is tracked in the background from now on
+    microphone_module.get_microphone().start()
+    # Synthesize the fixed phrases in the background so they play without network
+    tts_module.get_cache().prewarm_in_background(tts_module.load_prewarm_phrases())
 
-    # Start the Gemini conversation loop
-    conversation_loop(robot, patients_db, user_name)
+    try:
+        # Load the face database and patients database
+        database = face_recognition_module.load_database()
+        patients_db = load_patients_db()
+
+        if PRESENCE_TRACKING:
+            presence_tracker = presence_module.PresenceTracker(database)
+            presence_tracker.start()
+
+        # Set up patient data
+        user_name, patient_data = initialize_patient(database, patients_db)
+
+        # Initialize robot command handler and assign patient data
+        robot = RobotCommandHandler()
+        robot.patient_data = patient_data
+        robot.speech = tts_module.SpeechPipeline(paused=presence_paused)
+
+        # Start the Gemini conversation loop
+        if PIPELINED_LOOP:
+            conversation_pipeline(robot, patients_db, user_name)
+        else:
+            conversation_loop(robot, patients_db, user_name)
+    finally:
+        if presence_tracker is not None:
+            presence_tracker.stop()
+        face_recognition_module.shutdown_workers()
+        camera_module.release_camera()
+        audio_module.shutdown()
+        microphone_module.shutdown()
+        stats = tts_module.get_cache().stats()
+        print(f"Caché de voz: {stats.hits} aciertos, {stats.misses} fallos ({stats.hit_rate:.0%}), "
+              f"~{stats.saved_seconds:.1f} s ahorrados")
+        for name, backend_stats in tts_module.get_cache().selector.stats().items():
+            print(f"Voz {name}: {backend_stats.count} síntesis, {backend_stats.failures} fallos, "
+                  f"latencia media {1000 * (backend_stats.latency or 0):.1f} ms por carácter")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,165 @@
+# microphone_module.py
+"""
+One microphone input for the whole process. The device is opened once at
+16 kHz mono (what speech recognition needs) and read by a background
+thread in voice_module.FRAME_MS frames, which are fanned out to every
+subscriber. The same thread keeps the ambient-noise estimate up to date,
+so listening starts right away instead of calibrating for a second first.
+"""
+import queue
+import threading
+import time
+from collections import deque
+import pyaudio
+import voice_module
+
+SUBSCRIBER_QUEUE_MS = 30000  # Audio a subscriber may fall behind; older frames are dropped
+RECENT_MS = 1000  # Audio kept for subscribers that want what came just before they subscribed
+REOPEN_DELAY = 1.0  # Seconds before reopening the device after a read error
+
+class Subscription:
+    """
+    A consumer's view of the microphone: read() returns the next frame
+    (16-bit mono PCM). Use as a context manager, or call close().
+    """
+
+    def __init__(self, service, max_frames):
+        self._service = service
+        self._queue = queue.Queue(max_frames)
+
+    def _push(self, frame):
+        while True:
+            try:
+                self._queue.put_nowait(frame)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()  # Drop the oldest frame
+                except queue.Empty:
+                    pass
+
+    def read(self, timeout=None):
+        """The next frame; raises queue.Empty after timeout seconds without audio."""
+        return self._queue.get(timeout=timeout)
+
+    def drain(self):
+        """Discards the frames received so far (e.g. the robot's own voice)."""
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def close(self):
+        self._service.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class MicrophoneService:
+    """Reads the microphone in a background thread and fans the frames out to subscriptions."""
+
+    def __init__(self, sample_rate=voice_module.SAMPLE_RATE, frame_samples=voice_module.FRAME_SAMPLES,
+                 device_index=None):
+        self.sample_rate = sample_rate
+        self.frame_samples = frame_samples
+        self.frame_ms = 1000 * frame_samples // sample_rate
+        self.device_index = device_index
+        self.noise_floor = voice_module.NoiseFloor()
+        self._recent = deque(maxlen=RECENT_MS // self.frame_ms)
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+        self._audio = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._running = True
+            self._audio = pyaudio.PyAudio()
+            self._thread = threading.Thread(target=self._run, name="microphone", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            thread = self._thread
+            self._running = False
+            self._thread = None
+        if thread is not None:
+            thread.join(timeout=2)
+        if self._audio is not None:
+            self._audio.terminate()
+            self._audio = None
+
+    def subscribe(self, pre_roll_ms=0):
+        """
+        Returns a Subscription receiving every frame from now on, preceded by
+        up to pre_roll_ms (at most RECENT_MS) of the audio just before.
+        """
+        self.start()
+        subscription = Subscription(self, SUBSCRIBER_QUEUE_MS // self.frame_ms)
+        with self._lock:
+            if pre_roll_ms:
+                for frame in list(self._recent)[-(pre_roll_ms // self.frame_ms):]:
+                    subscription._push(frame)
+            self._subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+
+    def vad(self):
+        """A VoiceActivityDetector that uses the service's background noise estimate."""
+        return voice_module.VoiceActivityDetector(self.sample_rate, noise_floor=self.noise_floor)
+
+    def _open(self):
+        return self._audio.open(format=pyaudio.paInt16, channels=1, rate=self.sample_rate, input=True,
+                                frames_per_buffer=self.frame_samples, input_device_index=self.device_index)
+
+    def _run(self):
+        stream = None
+        while self._running:
+            try:
+                if stream is None:
+                    stream = self._open()
+                frame = stream.read(self.frame_samples, exception_on_overflow=False)
+            except Exception as e:
+                print(f"Error reading the microphone: {e}")
+                if stream is not None:
+                    stream.close()
+                    stream = None
+                time.sleep(REOPEN_DELAY)
+                continue
+            self.noise_floor.observe(voice_module.frame_rms(frame))
+            with self._lock:
+                self._recent.append(frame)
+                subscribers = list(self._subscribers)
+            for subscription in subscribers:
+                subscription._push(frame)
+        if stream is not None:
+            stream.stop_stream()
+            stream.close()
+
+_microphone = None
+_microphone_lock = threading.Lock()
+
+def get_microphone():
+    """The shared MicrophoneService of the process."""
+    global _microphone
+    with _microphone_lock:
+        if _microphone is None:
+            _microphone = MicrophoneService()
+        return _microphone
+
+def shutdown():
+    with _microphone_lock:
+        microphone = _microphone
+    if microphone is not None:
+        microphone.stop()
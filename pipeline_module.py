@@ -0,0 +1,172 @@
+# pipeline_module.py
+"""
+Pipelined conversation loop. A turn runs as overlapping asyncio stages
+instead of strictly in sequence:
+
+- the camera frame is grabbed as soon as an utterance ends, while it is
+  still being transcribed,
+- Gemini's reply is read in a thread and handed to the parser chunk by chunk,
+- each sentence or command is spoken/executed as soon as it is parsed,
+  while later chunks are still arriving and being parsed,
+- the patients database is saved in the background during the next turn.
+
+The stages call the existing blocking functions (listen, capture, speak,
+...) through asyncio.to_thread, so those stay usable on their own.
+"""
+import asyncio
+import time
+from response_parser_module import ResponseStreamParser
+
+_DONE = object()  # End of a stage queue
+
+class ConversationPipeline:
+    """
+    listen(on_speech_end): blocks until a command is recognized and returns
+        its text; calls on_speech_end() from its thread whenever an utterance
+        ends, before it is transcribed.
+    capture_frame(): returns the current camera frame.
+    reply_stream(prompt, frame): iterator over the reply text chunks.
+    run_item(item): speaks a ("text", ...) item or executes a ("command", ...) item.
+    finish_items(): optional; waits until the items handed to run_item are done,
+        for a run_item that only queues them.
+    handle_reply(response_text, frame): runs once the whole reply is known
+        (user management commands).
+    snapshot(): returns a copy of the data to persist, taken between turns.
+    persist(data): saves the snapshot; runs in the background.
+    """
+
+    def __init__(self, listen, capture_frame, reply_stream, run_item, handle_reply, snapshot, persist,
+                 finish_items=None):
+        self.listen = listen
+        self.capture_frame = capture_frame
+        self.reply_stream = reply_stream
+        self.run_item = run_item
+        self.handle_reply = handle_reply
+        self.snapshot = snapshot
+        self.persist = persist
+        self.finish_items = finish_items
+        self.last_timings = {}  # Seconds per stage of the last turn, see run_turn()
+        self._persist_task = None
+
+    async def run(self, turns=None):
+        """Runs turns forever, or the given number of turns."""
+        count = 0
+        try:
+            while turns is None or count < turns:
+                await self.run_turn()
+                count += 1
+        finally:
+            if self._persist_task is not None:
+                await self._persist_task
+
+    async def run_turn(self):
+        """
+        Runs one turn and returns the reply text. last_timings holds, in seconds:
+        listen (waiting for and recognizing the command), and from the moment
+        the command was recognized: frame (frame ready), first_chunk,
+        first_speech, reply (last chunk received), speech (last item done),
+        user_commands (handle_reply done); parse is the total parsing time.
+        """
+        loop = asyncio.get_running_loop()
+        timings = {}
+        frame_task = None
+
+        def start_frame():
+            nonlocal frame_task
+            frame_task = asyncio.ensure_future(asyncio.to_thread(self.capture_frame))
+
+        def on_speech_end():
+            loop.call_soon_threadsafe(start_frame)
+
+        listen_start = time.perf_counter()
+        prompt = await asyncio.to_thread(self.listen, on_speech_end)
+        turn_start = time.perf_counter()
+        timings["listen"] = turn_start - listen_start
+        print(f"Comando reconocido: {prompt}")
+        await asyncio.sleep(0)  # Let a pending frame grab start first
+        if frame_task is None:
+            start_frame()
+        frame = await frame_task
+        timings["frame"] = time.perf_counter() - turn_start
+
+        chunks = asyncio.Queue()
+        items = asyncio.Queue()
+        response_text, _, _ = await asyncio.gather(
+            self._read_reply(prompt, frame, chunks, timings, turn_start),
+            self._parse(chunks, items, timings),
+            self._act(items, timings, turn_start),
+        )
+        print("Gemini responde:", response_text)
+
+        await asyncio.to_thread(self.handle_reply, response_text, frame)
+        timings["user_commands"] = time.perf_counter() - turn_start
+        await self._start_persist()
+        self.last_timings = timings
+        self._print_timings(timings)
+        return response_text
+
+    async def _read_reply(self, prompt, frame, chunks, timings, turn_start):
+        loop = asyncio.get_running_loop()
+
+        def read():
+            parts = []
+            try:
+                for chunk in self.reply_stream(prompt, frame):
+                    if not parts:
+                        timings["first_chunk"] = time.perf_counter() - turn_start
+                    parts.append(chunk)
+                    loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+            finally:
+                timings["reply"] = time.perf_counter() - turn_start
+                loop.call_soon_threadsafe(chunks.put_nowait, _DONE)
+            return "".join(parts)
+
+        return await asyncio.to_thread(read)
+
+    async def _parse(self, chunks, items, timings):
+        parser = ResponseStreamParser(split_sentences=True)
+        timings["parse"] = 0.0
+        while True:
+            chunk = await chunks.get()
+            start = time.perf_counter()
+            parsed = parser.finish() if chunk is _DONE else parser.feed(chunk)
+            timings["parse"] += time.perf_counter() - start
+            for item in parsed:
+                items.put_nowait(item)
+            if chunk is _DONE:
+                items.put_nowait(_DONE)
+                return
+
+    async def _act(self, items, timings, turn_start):
+        while True:
+            item = await items.get()
+            if item is _DONE:
+                if self.finish_items is not None:
+                    await asyncio.to_thread(self.finish_items)
+                timings["speech"] = time.perf_counter() - turn_start
+                return
+            if item[0] == "text":
+                timings.setdefault("first_speech", time.perf_counter() - turn_start)
+            await asyncio.to_thread(self.run_item, item)
+
+    async def _start_persist(self):
+        """Saves a snapshot in the background; waits for the previous save first."""
+        if self._persist_task is not None:
+            await self._persist_task
+        data = self.snapshot()
+
+        def persist():
+            start = time.perf_counter()
+            try:
+                self.persist(data)
+            except Exception as e:
+                print(f"Error saving in the background: {e}")
+                return
+            print(f"Datos guardados en segundo plano en {time.perf_counter() - start:.3f} s")
+
+        self._persist_task = asyncio.ensure_future(asyncio.to_thread(persist))
+
+    def _print_timings(self, timings):
+        stages = ["listen", "frame", "first_chunk", "first_speech", "reply", "speech", "user_commands", "parse"]
+        text = ", ".join(f"{stage} {timings[stage]:.2f} s" for stage in stages if stage in timings)
+        print(f"Tiempos del turno: {text}")
@@ -0,0 +1,117 @@
+# presence_module.py
+import os
+import time
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+import camera_module
+import face_recognition_module
+
+PRESENCE_INTERVAL = 2.0  # Seconds between identification passes
+PRESENCE_MAX_AGE = 5.0  # Identities older than this are considered stale
+PRESENCE_NICE = 10  # Niceness of the tracker thread (Linux only)
+PRESENCE_ANALYSIS_TIMEOUT = 10.0  # Seconds to wait for the worker pool to analyse a frame
+
+# name: recognized user or None if the face is unknown,
+# face_visible: whether any face was detected in the sampled frame,
+# confidence: 0..1, derived from the match distance and the tolerance,
+# distance/margin: see face_recognition_module.FaceMatch,
+# timestamp: time.time() of the sampled frame.
+Presence = namedtuple("Presence", ["name", "face_visible", "confidence", "distance", "margin", "timestamp"])
+
+class PresenceTracker:
+    """
+    Background worker that periodically identifies whoever is in front of the
+    camera and publishes the current identity, so user changes can be answered
+    without a blocking recognition pass.
+    Speech pauses the tracker, see paused(); it keeps sampling while a
+    Gemini reply is awaited. Face detection and encoding run in the worker pool
+    (face_recognition_module.analyze_frame_async), so sampling does not hold
+    the GIL while the microphone and wake-word threads are capturing.
+    """
+
+    def __init__(self, database, interval=PRESENCE_INTERVAL, max_age=PRESENCE_MAX_AGE):
+        self.database = database
+        self.interval = interval
+        self.max_age = max_age
+        self._presence = None
+        self._lock = threading.Lock()
+        self._pause_count = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="presence-tracker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    @contextmanager
+    def paused(self):
+        """
+        Suspends sampling for the duration of the block. Nested and concurrent
+        use is allowed; sampling resumes when the last block exits.
+        """
+        with self._lock:
+            self._pause_count += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pause_count -= 1
+
+    def _is_paused(self):
+        with self._lock:
+            return self._pause_count > 0
+
+    def _run(self):
+        if hasattr(os, "setpriority"):
+            try:
+                # On Linux a thread id is accepted, so only this thread is deprioritised.
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), PRESENCE_NICE)
+            except OSError:
+                pass
+        while not self._stop_event.wait(self.interval):
+            if self._is_paused():
+                continue
+            try:
+                self._sample()
+            except Exception as e:
+                print(f"Error in presence tracking: {e}")
+
+    def _sample(self):
+        timestamp = time.time()
+        frame = camera_module.capture_image()
+        future = face_recognition_module.analyze_frame_async(frame)
+        analysis = future.result(timeout=PRESENCE_ANALYSIS_TIMEOUT)
+        # The analysis is cached now, so matching only compares encodings
+        match = face_recognition_module.match_user(frame, self.database)
+        if match is None:
+            presence = Presence(None, analysis.has_face, 0.0, None, None, timestamp)
+        else:
+            tolerance = face_recognition_module.get_matcher(self.database).tolerance
+            confidence = max(0.0, min(1.0, 1.0 - match.distance / tolerance))
+            presence = Presence(match.name, True, confidence, match.distance, match.margin, timestamp)
+        with self._lock:
+            self._presence = presence
+
+    def current_identity(self, max_age=None, since=None):
+        """
+        Returns the latest Presence if it is fresher than max_age seconds,
+        otherwise None. since: time.time() the age is measured from (e.g. when
+        the turn started), defaults to now.
+        """
+        max_age = self.max_age if max_age is None else max_age
+        since = time.time() if since is None else since
+        with self._lock:
+            presence = self._presence
+        if presence is None or since - presence.timestamp > max_age:
+            return None
+        return presence
@@ -0,0 +1,110 @@
+# response_parser_module.py
+import re
+
+# Commands in the form <comando valor>
+COMMAND_PATTERN = re.compile(r'<(\w+)\s+([^>]+)>')
+# User management commands are processed separately by main.py
+USER_COMMAND_PATTERN = re.compile(r'<change_user\s+0>|<register_user\s+[^>]+>')
+# End of a sentence: punctuation followed by whitespace, or a line break
+SENTENCE_END_PATTERN = re.compile(r'[.!?…]+["»”)]*(?=\s)|\n+')
+# A '<' that is not closed within this many characters is plain text
+MAX_COMMAND_LENGTH = 200
+
+def parse_value(value_str):
+    """Returns the command value as int or float when numeric, otherwise as a string."""
+    value_str = value_str.strip()
+    try:
+        if '.' in value_str:
+            return float(value_str)
+        return int(value_str)
+    except ValueError:
+        return value_str
+
+class ResponseStreamParser:
+    """
+    Splits a Gemini reply into items in order of appearance:
+    ("text", segment) to speak and ("command", name, value) to execute.
+    Text can be fed chunk by chunk while the reply is streamed; an item is
+    only emitted once it is complete, i.e. a whole <comando valor> token or,
+    with split_sentences, a whole sentence. User management commands are
+    dropped.
+    """
+
+    def __init__(self, split_sentences=True):
+        self.split_sentences = split_sentences
+        self._buffer = ""
+        self._scan = 0  # Text before this index holds no command start
+
+    def feed(self, chunk):
+        """Adds text and returns the list of items completed by it."""
+        self._buffer += chunk
+        return self._drain(final=False)
+
+    def finish(self):
+        """Returns the remaining items once the reply is complete."""
+        return self._drain(final=True)
+
+    def _text_items(self, text, final):
+        """
+        Splits text into sentence items. Returns (items, unconsumed_text).
+        """
+        if not self.split_sentences:
+            if final:
+                return ([("text", text.strip())] if text.strip() else []), ""
+            return [], text
+        items = []
+        start = 0
+        for match in SENTENCE_END_PATTERN.finditer(text):
+            sentence = text[start:match.end()].strip()
+            if sentence:
+                items.append(("text", sentence))
+            start = match.end()
+        rest = text[start:]
+        if final and rest.strip():
+            items.append(("text", rest.strip()))
+            rest = ""
+        return items, rest
+
+    def _drain(self, final):
+        items = []
+        pending = len(self._buffer)  # Start of an unfinished token, if any
+        while True:
+            start = self._buffer.find('<', self._scan)
+            if start < 0:
+                break
+            end = self._buffer.find('>', start)
+            if end < 0:
+                if final or len(self._buffer) - start > MAX_COMMAND_LENGTH:
+                    # Never closed: the '<' is plain text.
+                    self._scan = start + 1
+                    continue
+                # Possibly the beginning of a command: wait for the rest.
+                pending = start
+                break
+            token = self._buffer[start:end + 1]
+            match = COMMAND_PATTERN.fullmatch(token)
+            is_user_command = USER_COMMAND_PATTERN.fullmatch(token) is not None
+            if match is None and not is_user_command:
+                # Not a command, e.g. "<3>": keep it as text.
+                self._scan = start + 1
+                continue
+            # The text before a command is complete.
+            text_items, _ = self._text_items(self._buffer[:start], final=True)
+            items.extend(text_items)
+            if not is_user_command:
+                items.append(("command", match.group(1).lower(), parse_value(match.group(2))))
+            self._buffer = self._buffer[end + 1:]
+            self._scan = 0
+        text_items, rest = self._text_items(self._buffer[:pending], final)
+        items.extend(text_items)
+        consumed = pending - len(rest)
+        self._buffer = rest + self._buffer[pending:]
+        self._scan = max(0, self._scan - consumed)
+        return items
+
+def parse_response(response, split_sentences=False):
+    """
+    Parses a complete reply into ("text", ...) and ("command", ...) items.
+    """
+    parser = ResponseStreamParser(split_sentences=split_sentences)
+    return parser.feed(response) + parser.finish()
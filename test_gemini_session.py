@@ -0,0 +1,95 @@
+# test_gemini_session.py
+"""
+Per-turn overhead of GeminiSession, measured against a local replay model
+(gemini_backend_module.ReplayModel with speed=0), so no network is used.
+
+Run with: python -m pytest test_gemini_session.py
+"""
+import os
+import tempfile
+import unittest
+import numpy as np
+import Gemini_module
+import gemini_backend_module
+
+TURNS = 6
+MAX_SETUP_SECONDS = 0.25  # Client-side work per turn: frame preprocessing and message building
+
+def _cassette(path, turns):
+    cassette = gemini_backend_module.Cassette(path)
+    for index in range(turns):
+        cassette.append({"prompt": f"pregunta {index}", "images": 1,
+                         "chunks": [[0.0, f"Respuesta {index}. "], [0.0, "<mover_adelante 1>"]]})
+    return cassette
+
+def _frame(seed):
+    return np.random.default_rng(seed).integers(0, 255, (120, 160, 3), dtype=np.uint8)
+
+class GeminiSessionTimingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        cassette = _cassette(os.path.join(self.directory.name, "cassette.jsonl"), TURNS)
+        self.model = gemini_backend_module.ReplayModel(cassette, speed=0.0)
+        self.session = Gemini_module.GeminiSession(model=self.model, hedge=False)
+        self.patient = {"nombre": "Ana", "edad": 70}
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_setup_time_is_recorded_and_small(self):
+        setups = []
+        for turn in range(TURNS):
+            reply = self.session.send(f"pregunta {turn}", _frame(turn), self.patient)
+            self.assertEqual(reply, f"Respuesta {turn}. <mover_adelante 1>")
+            self.assertIn("setup", self.session.last_timings)
+            self.assertIn("request", self.session.last_timings)
+            setups.append(self.session.last_timings["setup"])
+        self.assertLess(max(setups), MAX_SETUP_SECONDS)
+
+    def test_model_is_kept_and_only_new_messages_are_sent(self):
+        for turn in range(3):
+            self.session.send(f"pregunta {turn}", _frame(turn), self.patient)
+        self.assertIs(self.session.model, self.model)
+        history = self.session.chat.history
+        self.assertEqual(len(history), 6)
+        # The patient data goes with the first turn only, while it does not change
+        patient_message = Gemini_module.build_patient_message(self.patient)
+        user_parts = [message["parts"] for message in history if message["role"] == "user"]
+        self.assertIn(patient_message, user_parts[0])
+        self.assertNotIn(patient_message, user_parts[1])
+        self.assertNotIn(patient_message, user_parts[2])
+
+    def test_chat_is_reused_between_turns(self):
+        self.session.send("pregunta 0", _frame(0), self.patient)
+        chat = self.session.chat
+        self.session.send("pregunta 1", _frame(1), self.patient)
+        self.assertIs(self.session.chat, chat)
+
+    def test_stream_records_first_chunk(self):
+        chunks = list(self.session.send_stream("pregunta", _frame(0), self.patient))
+        self.assertEqual("".join(chunks), "Respuesta 0. <mover_adelante 1>")
+        for stage in ("setup", "first_chunk", "request"):
+            self.assertIn(stage, self.session.last_timings)
+        self.assertLess(self.session.last_timings["setup"], MAX_SETUP_SECONDS)
+
+    def test_reset_starts_a_new_chat(self):
+        self.session.send("pregunta", _frame(0), self.patient)
+        self.session.reset()
+        self.assertEqual(len(self.session.history), 0)
+        self.session.send("otra", _frame(1), self.patient)
+        patient_message = Gemini_module.build_patient_message(self.patient)
+        self.assertIn(patient_message, self.session.chat.history[0]["parts"])
+
+class ReplayCassetteTest(unittest.TestCase):
+
+    def test_attempts_of_one_request_get_the_same_turn(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cassette = _cassette(os.path.join(directory, "cassette.jsonl"), 3)
+            # Primary, hedge and retry of the first request, then the next request
+            prompts = ["pregunta 0", "pregunta 0", "pregunta 0", "pregunta 1", "pregunta 2"]
+            replies = [cassette.next_turn(prompt)["prompt"] for prompt in prompts]
+            self.assertEqual(replies, prompts)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+# test_voice_module.py
+"""
+Wake-word text matching in voice_module.
+
+Run with: python -m pytest test_voice_module.py
+"""
+import json
+import unittest
+from unittest import mock
+import voice_module
+
+class FakeRecognizer:
+    """Stands in for vosk.KaldiRecognizer, always hearing the same text."""
+    text = ""
+
+    def __init__(self, model, sample_rate, grammar):
+        self.grammar = json.loads(grammar)
+
+    def AcceptWaveform(self, segment):
+        return True
+
+    def FinalResult(self):
+        return json.dumps({"text": self.text}, ensure_ascii=False)
+
+class ActivationPhraseTest(unittest.TestCase):
+
+    def test_accents_are_ignored(self):
+        self.assertTrue(voice_module.contains_activation_phrase("fermín"))
+        self.assertTrue(voice_module.contains_activation_phrase("Oye, Fermín"))
+        self.assertFalse(voice_module.contains_activation_phrase("buenos días"))
+
+    def test_vosk_grammar_word_triggers(self):
+        fake_vosk = mock.Mock(KaldiRecognizer=FakeRecognizer)
+        with mock.patch.object(voice_module, "vosk", fake_vosk):
+            matcher = voice_module.VoskKeywordMatcher(model_path="unused")
+            for phrase in ("fermín", "doctor fermín"):
+                self.assertIn(phrase, voice_module.VOSK_GRAMMAR)
+                FakeRecognizer.text = phrase
+                self.assertEqual(matcher.match(b"\0" * 960), (True, phrase))
+            FakeRecognizer.text = "[unk]"
+            self.assertFalse(matcher.match(b"\0" * 960)[0])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,187 @@
+# tts_backend_module.py
+"""
+Text-to-speech backends and latency-aware backend selection.
+
+A backend has a name, the audio format it produces, whether it needs the
+network, and synthesize(text, lang, tld) returning the audio bytes.
+BackendSelector keeps the preferred (first) voice for normal speech and
+uses a local backend only for latency-critical prompts, or when the
+preferred one errors, misses its deadline or is predicted to miss it.
+"""
+import io
+import shutil
+import subprocess
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from gtts import gTTS
+
+NETWORK_DEADLINE = 4.0  # Seconds a network backend gets before failing over
+FAILOVER_COOLDOWN = 30.0  # Seconds a failed backend is skipped
+REPROBE_INTERVAL = 60.0  # Seconds after which a demoted backend is tried again
+EWMA_ALPHA = 0.3  # Weight of the newest latency sample
+LATENCY_CHARS = 40  # Typical phrase length, converts expected_latency to seconds per character
+ESPEAK_RATE = 160  # Words per minute
+# gTTS accent (tld) -> espeak-ng voice
+ESPEAK_VOICES = {"com.mx": "es-419", "us": "es-419"}
+
+# latency: EWMA of the synthesis time per character in seconds (None until measured), count:
+# successful syntheses, failures: errors and missed deadlines, cooldown: seconds
+# left before the backend is tried again.
+BackendStats = namedtuple("BackendStats", ["latency", "count", "failures", "cooldown"])
+
+class GTTSBackend:
+    """Google Translate TTS (network)."""
+    name = "gtts"
+    audio_format = "mp3"
+    network = True
+    expected_latency = 1.0  # Seconds for a LATENCY_CHARS phrase, assumed until measured
+
+    def available(self):
+        return True
+
+    def synthesize(self, text, lang='es', tld='com'):
+        buffer = io.BytesIO()
+        gTTS(text=text, lang=lang, slow=False, tld=tld).write_to_fp(buffer)
+        return buffer.getvalue()
+
+class EspeakBackend:
+    """espeak-ng (offline), run as a subprocess that writes a WAV to stdout."""
+    name = "espeak"
+    audio_format = "wav"
+    network = False
+    expected_latency = 0.2
+
+    def __init__(self, executable=None, rate=ESPEAK_RATE):
+        self.executable = executable or shutil.which("espeak-ng") or shutil.which("espeak")
+        self.rate = rate
+
+    def available(self):
+        return self.executable is not None
+
+    def synthesize(self, text, lang='es', tld='com'):
+        voice = ESPEAK_VOICES.get(tld, lang)
+        result = subprocess.run(
+            [self.executable, "-v", voice, "-s", str(self.rate), "--stdout", text],
+            capture_output=True, check=True, timeout=NETWORK_DEADLINE * 2,
+        )
+        return result.stdout
+
+def default_backends():
+    """The available backends, network first."""
+    return [backend for backend in (GTTSBackend(), EspeakBackend()) if backend.available()]
+
+class BackendSelector:
+    """
+    Chooses the backend for each utterance. Normal speech keeps the
+    configured order (the first backend is the voice of the robot), so the
+    voice does not change within a reply; a backend is skipped while in
+    cooldown after an error or missed deadline, or when its latency per
+    character (EWMA) predicts it would miss the deadline for this text.
+    Skipped backends are re-probed every REPROBE_INTERVAL seconds, so a
+    transient failure does not demote them for good. Latency-critical
+    prompts go to a local backend first.
+    """
+
+    def __init__(self, backends=None, deadline=NETWORK_DEADLINE, cooldown=FAILOVER_COOLDOWN,
+                 reprobe_interval=REPROBE_INTERVAL, alpha=EWMA_ALPHA):
+        self.backends = list(backends) if backends is not None else default_backends()
+        self.deadline = deadline
+        self.cooldown = cooldown
+        self.reprobe_interval = reprobe_interval
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._latency = {}  # Seconds per character
+        self._count = {backend.name: 0 for backend in self.backends}
+        self._failures = {backend.name: 0 for backend in self.backends}
+        self._cooldown_until = {}
+        self._last_attempt = {}
+        self._failing = set()  # Backends whose last attempt failed
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tts-network")
+
+    def _expected(self, backend, text):
+        per_char = self._latency.get(backend.name, backend.expected_latency / LATENCY_CHARS)
+        return per_char * max(len(text), LATENCY_CHARS)
+
+    def _predicted_miss(self, backend, text):
+        """Whether the measured latency predicts a missed deadline for text."""
+        return backend.name in self._latency and self._expected(backend, text) > self.deadline
+
+    def order(self, text, latency_critical=False):
+        """Backends to try for text, best first."""
+        now = time.monotonic()
+        with self._lock:
+            if latency_critical:
+                ranked = sorted(self.backends, key=lambda backend: (backend.network, self._expected(backend, text)))
+            else:
+                ranked = list(self.backends)
+            ready = []
+            demoted = []
+            for backend in ranked:
+                skipped = self._cooldown_until.get(backend.name, 0) > now or (
+                    not latency_critical and self._predicted_miss(backend, text))
+                due = now - self._last_attempt.get(backend.name, float("-inf")) >= self.reprobe_interval
+                if skipped and not due:
+                    demoted.append(backend)
+                else:
+                    ready.append(backend)
+        return ready + demoted
+
+    def _record(self, backend, text, seconds=None):
+        with self._lock:
+            self._last_attempt[backend.name] = time.monotonic()
+            recovered = False
+            if seconds is None:
+                self._failures[backend.name] += 1
+                self._cooldown_until[backend.name] = time.monotonic() + self.cooldown
+                self._failing.add(backend.name)
+                seconds = self.deadline  # A failure counts as a missed deadline
+            else:
+                self._count[backend.name] += 1
+                self._cooldown_until.pop(backend.name, None)
+                recovered = backend.name in self._failing
+                self._failing.discard(backend.name)
+            per_char = seconds / max(len(text), LATENCY_CHARS)
+            # After a successful re-probe the failures no longer describe the backend
+            previous = None if recovered else self._latency.get(backend.name)
+            self._latency[backend.name] = per_char if previous is None else (
+                self.alpha * per_char + (1 - self.alpha) * previous)
+
+    def synthesize(self, text, lang='es', tld='com', latency_critical=False):
+        """Returns (backend, audio) from the first backend that succeeds."""
+        last_error = None
+        for backend in self.order(text, latency_critical):
+            start = time.perf_counter()
+            try:
+                if backend.network:
+                    future = self._executor.submit(backend.synthesize, text, lang, tld)
+                    audio = future.result(timeout=self.deadline)
+                else:
+                    audio = backend.synthesize(text, lang, tld)
+            except FutureTimeoutError:
+                last_error = TimeoutError(f"{backend.name} missed its {self.deadline:.1f} s deadline")
+                print(f"TTS {backend.name}: {last_error}, switching backend")
+                self._record(backend, text)
+                continue
+            except Exception as e:
+                last_error = e
+                print(f"TTS {backend.name} failed ({e}), switching backend")
+                self._record(backend, text)
+                continue
+            self._record(backend, text, time.perf_counter() - start)
+            return backend, audio
+        raise last_error if last_error is not None else RuntimeError("No TTS backend available")
+
+    def stats(self):
+        """BackendStats per backend name."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                backend.name: BackendStats(
+                    self._latency.get(backend.name), self._count[backend.name], self._failures[backend.name],
+                    max(0.0, self._cooldown_until.get(backend.name, 0) - now),
+                )
+                for backend in self.backends
+            }
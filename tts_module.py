@@ -0,0 +1,406 @@
+# tts_module.py
+import hashlib
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import audio_module
+import tts_backend_module
+
+TTS_CACHE_DIR = "tts_cache"
+TTS_CACHE_MAX_BYTES = 16 * 1024 * 1024  # Disk budget of the phrase cache (fixed phrases only)
+TTS_MEMORY_MAX_BYTES = 8 * 1024 * 1024  # Most recent clips also kept in memory
+DEFAULT_SYNTH_SECONDS = 1.0  # Assumed gTTS round-trip until one has been measured
+SPEECH_LOOKAHEAD = 2  # Segments synthesized ahead of the one being played
+# Optional file with extra phrases to prewarm, one per line
+PREWARM_FILE = os.getenv('FERPY_TTS_PREWARM_FILE', 'tts_phrases.txt')
+
+# Fixed phrases said on every interaction
+PREWARM_PHRASES = [
+    "Sí",
+    "Entendido",
+    "Hola, soy Doctor Ferpy. ¿Cómo puedo ayudarte?",
+    "Por favor, mire a la cámara.",
+    "Tomando una nueva imagen en 3...",
+    "2...",
+    "1...",
+    "No se entendió tu voz. Intenta de nuevo.",
+    "No se detectó ninguna voz. Intenta de nuevo.",
+    "No se pudo capturar tu nombre. Intenta de nuevo.",
+    "Se detectó una cara, pero no está registrada, por favor di tu nombre para registrarte.",
+    "Se detectó una cara, pero no está registrada. Por favor, dime tu nombre para registrarte.",
+    "No se detectó ninguna cara. Por favor, di tu nombre.",
+    "No se detectó ninguna cara. Manteniendo usuario actual.",
+    "No se pudo capturar el nombre. Continuando con usuario actual.",
+]
+
+# hits/misses: lookups served from the cache or synthesized, memory_hits/disk_hits:
+# where the hits came from, hit_rate: hits / lookups, saved_seconds: estimated
+# synthesis time avoided by the hits, synth_seconds: time spent synthesizing,
+# prewarming included (prewarming does not count as lookups).
+# count: silences measured, mean/max/total: seconds. A silence is the time between
+# the end of a clip or command and the start of the next clip, when that clip had
+# already been requested.
+GapStats = namedtuple("GapStats", ["count", "mean", "max", "total"])
+
+CacheStats = namedtuple("CacheStats", ["hits", "memory_hits", "disk_hits", "misses", "hit_rate",
+                                       "saved_seconds", "synth_seconds"])
+
+def cache_key(text, lang, tld, backend="gtts"):
+    """Content address of a clip."""
+    address = f"{lang}\0{tld}\0{text}"
+    if backend != "gtts":
+        address = f"{backend}\0{address}"
+    return hashlib.sha256(address.encode("utf-8")).hexdigest()
+
+def load_prewarm_phrases(path=PREWARM_FILE):
+    """PREWARM_PHRASES plus the phrases in path, if the file exists."""
+    phrases = list(PREWARM_PHRASES)
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as file:
+            phrases.extend(line.strip() for line in file if line.strip())
+    return phrases
+
+class PhraseCache:
+    """
+    Content-addressed cache of synthesized speech keyed on (text, lang, tld)
+    and the backend that spoke it. Fixed phrases (prewarmed ones and
+    latency-critical prompts) are kept as files in a size-bounded LRU
+    directory; every clip, one-off reply sentences included, is kept in a
+    size-bounded LRU in memory, so a hit plays without a network round-trip
+    and replies cause no file writes. Misses are
+    synthesized by the backend tts_backend_module.BackendSelector picks;
+    a hit from any backend is used, in the selector's configured order.
+    """
+
+    def __init__(self, directory=TTS_CACHE_DIR, max_disk_bytes=TTS_CACHE_MAX_BYTES,
+                 max_memory_bytes=TTS_MEMORY_MAX_BYTES, selector=None):
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.selector = selector if selector is not None else tts_backend_module.BackendSelector()
+        self._lock = threading.Lock()
+        # Keys are file names: the content address plus the audio format
+        self._memory = OrderedDict()  # key -> bytes, least recently used first
+        self._memory_bytes = 0
+        self._disk = OrderedDict()  # key -> size, least recently used first
+        self._disk_bytes = 0
+        self._hits = {"memory": 0, "disk": 0}
+        self._misses = 0
+        self._saved_seconds = 0.0
+        self._synth_count = 0  # Syntheses, prewarming included
+        self._synth_seconds = 0.0
+        self._fixed = set()  # (text, lang, tld) of the phrases kept on disk
+        self._load_index()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _keys(self, text, lang, tld):
+        """Cache keys of text for every backend, in the selector's order."""
+        return [f"{cache_key(text, lang, tld, backend.name)}.{backend.audio_format}"
+                for backend in self.selector.backends]
+
+    def _load_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith((".mp3", ".wav")):
+                continue
+            stat = os.stat(os.path.join(self.directory, name))
+            entries.append((stat.st_mtime, name, stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._evict_disk()
+
+    def _evict_disk(self):
+        while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+            key, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def _remember(self, key, audio):
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = audio
+        self._memory_bytes += len(audio)
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _store(self, key, audio):
+        """Writes the clip atomically, then adds it to the disk index."""
+        path = self._path(key)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(audio)
+        os.replace(temp_path, path)
+        with self._lock:
+            if key not in self._disk:
+                self._disk[key] = len(audio)
+                self._disk_bytes += len(audio)
+            self._evict_disk()
+
+    def _mean_synth_seconds(self):
+        return self._synth_seconds / self._synth_count if self._synth_count else DEFAULT_SYNTH_SECONDS
+
+    def _lookup(self, key):
+        """Returns (audio, source) for a cached clip, or (None, None)."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key], "memory"
+            on_disk = key in self._disk
+            if on_disk:
+                self._disk.move_to_end(key)
+        if not on_disk:
+            return None, None
+        try:
+            with open(self._path(key), "rb") as file:
+                audio = file.read()
+            os.utime(self._path(key))  # Keeps the LRU order across restarts
+        except OSError:
+            with self._lock:
+                self._disk_bytes -= self._disk.pop(key, 0)
+            return None, None
+        with self._lock:
+            self._remember(key, audio)
+        return audio, "disk"
+
+    def get(self, text, lang='es', tld='com', latency_critical=False):
+        """
+        Returns the audio bytes of text, synthesizing and caching them on a miss.
+        latency_critical lets a miss go to a local backend first (fixed prompts);
+        those clips, like prewarmed phrases, are also written to disk.
+        """
+        return self._fetch(text, lang, tld, count=True, latency_critical=latency_critical)
+
+    def _fetch(self, text, lang, tld, count, latency_critical=False):
+        text = text.strip()
+        persist = latency_critical or (text, lang, tld) in self._fixed
+        start = time.perf_counter()
+        for key in self._keys(text, lang, tld):
+            audio, source = self._lookup(key)
+            if audio is not None:
+                break
+        if audio is not None:
+            if persist and source == "memory" and key not in self._disk:
+                self._store(key, audio)  # Heard before it was marked as fixed
+            if not count:
+                return audio
+            with self._lock:
+                self._hits[source] += 1
+                self._saved_seconds += max(0.0, self._mean_synth_seconds() - (time.perf_counter() - start))
+            return audio
+        backend, audio = self.selector.synthesize(text, lang, tld, latency_critical=latency_critical)
+        key = f"{cache_key(text, lang, tld, backend.name)}.{backend.audio_format}"
+        with self._lock:
+            self._misses += count
+            self._synth_count += 1
+            self._synth_seconds += time.perf_counter() - start
+            self._remember(key, audio)
+        if persist:
+            self._store(key, audio)
+        return audio
+
+    def contains(self, text, lang='es', tld='com'):
+        keys = self._keys(text.strip(), lang, tld)
+        with self._lock:
+            return any(key in self._memory or key in self._disk for key in keys)
+
+    def _on_disk(self, text, lang, tld):
+        keys = self._keys(text.strip(), lang, tld)
+        with self._lock:
+            return any(key in self._disk for key in keys)
+
+    def prewarm(self, phrases, lang='es', tld='com'):
+        """
+        Marks the phrases as fixed (kept on disk) and synthesizes the ones not
+        on disk yet. Returns how many were added.
+        """
+        with self._lock:
+            self._fixed.update((phrase.strip(), lang, tld) for phrase in phrases)
+        added = 0
+        for phrase in phrases:
+            if self._on_disk(phrase, lang, tld):
+                continue
+            try:
+                self._fetch(phrase, lang, tld, count=False)
+                added += 1
+            except Exception as e:
+                print(f"Could not prewarm '{phrase}': {e}")
+        return added
+
+    def prewarm_in_background(self, phrases, lang='es', tld='com'):
+        """Runs prewarm() in a daemon thread, so startup is not delayed."""
+        thread = threading.Thread(target=self.prewarm, args=(phrases, lang, tld), name="tts-prewarm", daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        with self._lock:
+            hits = self._hits["memory"] + self._hits["disk"]
+            lookups = hits + self._misses
+            return CacheStats(hits, self._hits["memory"], self._hits["disk"], self._misses,
+                              hits / lookups if lookups else 0.0, self._saved_seconds, self._synth_seconds)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    """The shared PhraseCache of the process."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = PhraseCache()
+        return _cache
+
+def gap_stats(gaps):
+    if not gaps:
+        return GapStats(0, 0.0, 0.0, 0.0)
+    return GapStats(len(gaps), sum(gaps) / len(gaps), max(gaps), sum(gaps))
+
+class _Step:
+    """A queued segment or command with the times used to measure silences."""
+
+    def __init__(self, kind, payload):
+        self.kind = kind
+        self.payload = payload
+        self.requested_at = time.perf_counter()
+        self.started_at = None
+        self.finished_at = None
+        self.done = threading.Event()
+
+class SpeechPipeline:
+    """
+    Speaks a reply sentence by sentence while the next sentences are being
+    synthesized on worker threads (at most `lookahead` segments ahead), and
+    runs the commands interleaved with them in order: a command starts once
+    the speech before it has been played, and the speech after it is
+    already synthesized by then. Silences between segments are measured.
+    paused: optional context manager factory held while speech is in
+    progress (e.g. to pause presence tracking).
+    """
+
+    def __init__(self, cache=None, player=None, lookahead=SPEECH_LOOKAHEAD, paused=None):
+        self.cache = cache if cache is not None else get_cache()
+        self.player = player if player is not None else audio_module.get_player()
+        self.paused = paused or nullcontext
+        self._slots = threading.Semaphore(lookahead + 1)  # + the segment being played
+        self._executor = ThreadPoolExecutor(max_workers=lookahead, thread_name_prefix="tts-synth")
+        self._steps = queue.Queue()
+        self._history = []  # Steps since the last flush()
+        self._gaps = []
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="speech-pipeline", daemon=True)
+        self._thread.start()
+
+    def say(self, text, lang='es', tld='com', latency_critical=False):
+        """
+        Queues a segment; blocks while `lookahead` segments are already waiting.
+        Reply sentences are not latency-critical, so a reply keeps one voice.
+        """
+        self._slots.acquire()
+        future = self._executor.submit(self.cache.get, text, lang, tld, latency_critical)
+        self._queue_step(_Step("text", future))
+
+    def run(self, function, *args):
+        """Queues a call that runs after the speech queued before it has been played."""
+        self._queue_step(_Step("command", (function, args)))
+
+    def _queue_step(self, step):
+        with self._lock:
+            self._history.append(step)
+        self._steps.put(step)
+
+    def flush(self, timeout=None):
+        """
+        Waits until everything queued has been played or run. Returns the
+        GapStats of the steps queued since the previous flush().
+        """
+        with self._lock:
+            steps = self._history
+            self._history = []
+        for step in steps:
+            step.done.wait(timeout)
+        gaps = []
+        for previous, step in zip(steps, steps[1:]):
+            if None in (previous.finished_at, step.started_at) or step.requested_at > previous.finished_at:
+                continue  # Nothing was waiting: not a silence we caused
+            gaps.append(max(0.0, step.started_at - previous.finished_at))
+        with self._lock:
+            self._gaps.extend(gaps)
+        stats = gap_stats(gaps)
+        if stats.count:
+            print(f"Silencios entre segmentos: {stats.count}, media {stats.mean * 1000:.0f} ms, "
+                  f"máx {stats.max * 1000:.0f} ms")
+        return stats
+
+    def stats(self):
+        """GapStats of every flushed utterance so far."""
+        with self._lock:
+            return gap_stats(self._gaps)
+
+    def close(self):
+        self._steps.put(None)
+        self._thread.join(timeout=5)
+        self._executor.shutdown(wait=False)
+
+    def _run(self):
+        playing = None  # (step, clip) being played
+        while True:
+            step = self._steps.get()
+            if step is None:
+                return
+            with self.paused():
+                if step.kind == "text":
+                    playing = self._play(step, playing)
+                else:
+                    self._finish_playing(playing)
+                    playing = None
+                    self._call(step)
+                if self._steps.empty():
+                    # Nothing else queued: hold the pause until the speech ends
+                    self._finish_playing(playing)
+                    playing = None
+
+    def _play(self, step, playing):
+        """Queues the clip of step behind the one being played, then waits for that one."""
+        try:
+            audio = step.payload.result()
+        except Exception as e:
+            print(f"Error synthesizing speech: {e}")
+            self._slots.release()
+            step.done.set()
+            return playing
+        clip = self.player.enqueue(audio)
+        self._finish_playing(playing)
+        return step, clip
+
+    def _finish_playing(self, playing):
+        if playing is None:
+            return
+        step, clip = playing
+        clip.wait()
+        step.started_at = clip.started_at
+        step.finished_at = clip.finished_at
+        self._slots.release()
+        step.done.set()
+
+    def _call(self, step):
+        function, args = step.payload
+        step.started_at = time.perf_counter()
+        try:
+            function(*args)
+        except Exception as e:
+            print(f"Error running command: {e}")
+        step.finished_at = time.perf_counter()
+        step.done.set()
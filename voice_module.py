@@ -0,0 +1,384 @@
+# voice_module.py
+"""
+On-device wake-word spotting. Microphone frames go through a VAD (energy
+gate over an adaptive noise floor, refined by webrtcvad when installed);
+only voiced segments reach the keyword matcher, which runs locally:
+
+- VoskKeywordMatcher: a grammar-restricted vosk recognizer (needs vosk
+  and a Spanish model in VOSK_MODEL_PATH),
+- TemplateKeywordMatcher: MFCC + DTW against recorded examples of the
+  wake word (WAV files in WAKE_WORD_TEMPLATE_DIR).
+
+If neither is available, CloudKeywordMatcher sends the voiced segments
+(not every second of audio) to Google as before.
+
+UtteranceRecorder captures the command that follows as one utterance,
+ended by the VAD, so it is transcribed with a single request.
+"""
+import glob
+import json
+import os
+import threading
+import unicodedata
+import wave
+from collections import deque
+import numpy as np
+import speech_recognition as sr
+
+try:
+    import webrtcvad
+except ImportError:
+    webrtcvad = None
+
+try:
+    import vosk
+except ImportError:
+    vosk = None
+
+SAMPLE_RATE = 16000
+FRAME_MS = 30  # webrtcvad accepts 10, 20 or 30 ms frames
+FRAME_SAMPLES = SAMPLE_RATE * FRAME_MS // 1000
+VAD_THRESHOLD_DB = 9.0  # Frames this much louder than the noise floor may be speech
+VAD_AGGRESSIVENESS = 2  # webrtcvad mode, 0 (lenient) to 3 (strict)
+NOISE_ADAPTATION = 0.05  # Weight of a new non-speech frame in the noise floor
+NOISE_RISE = 1.004  # Growth of the noise floor per loud frame (about 1 dB/s)
+MIN_NOISE_RMS = 30.0  # Noise floor lower bound (int16 units), avoids digital silence
+SEGMENT_HANGOVER_MS = 300  # Silence that ends a voiced segment
+SEGMENT_MIN_SPEECH_MS = 150  # Shorter segments are ignored (clicks, bumps)
+SEGMENT_MAX_MS = 2000  # Longer segments are checked anyway
+PRE_ROLL_MS = 300  # Audio kept from before the start of an utterance
+UTTERANCE_END_SILENCE_MS = 800  # Silence that ends an utterance
+UTTERANCE_START_TIMEOUT = 3.0  # Seconds to wait for an utterance to start
+UTTERANCE_MAX_MS = 15000  # Longer utterances are cut here
+
+ACTIVATION_PHRASES = ["doctor", "dr", "dry", "doctor f", "dr f", "ferti", "fermin", "doctor ferpi", "dr fer",
+                      "doctor fer", "dr ferpi", "ferpi", "dr fairy"]
+VOSK_MODEL_PATH = os.getenv('FERPY_VOSK_MODEL', 'vosk-model-small-es')
+# Words vosk may output; anything else is reported as [unk]
+VOSK_GRAMMAR = ["doctor", "doctor fermín", "fermín", "fer", "[unk]"]
+WAKE_WORD_TEMPLATE_DIR = os.getenv('FERPY_WAKE_WORD_TEMPLATES', 'wake_word')
+TEMPLATE_THRESHOLD = 18.0  # Maximum normalized DTW distance to a template
+
+def _strip_accents(text):
+    return "".join(char for char in unicodedata.normalize("NFKD", text) if not unicodedata.combining(char))
+
+def contains_activation_phrase(text, phrases=ACTIVATION_PHRASES):
+    """Whether text contains one of the phrases, ignoring case and accents ("fermín" matches "fermin")."""
+    text = _strip_accents(text.lower())
+    return any(_strip_accents(phrase) in text for phrase in phrases)
+
+def frame_rms(frame):
+    samples = np.frombuffer(frame, dtype=np.int16).astype(np.float32)
+    return float(np.sqrt(np.mean(samples * samples))) if samples.size else 0.0
+
+class NoiseFloor:
+    """
+    Ambient noise level (RMS). Follows quiet frames, and rises slowly under
+    sustained sound, so a fan that starts running becomes part of the noise.
+    """
+
+    def __init__(self, threshold_db=VAD_THRESHOLD_DB):
+        self.threshold_db = threshold_db
+        self.rms = None
+
+    def is_loud(self, rms):
+        """Whether a frame with this RMS stands out of the noise (possible speech)."""
+        if self.rms is None:
+            return False
+        return 20 * np.log10(max(rms, 1.0) / self.rms) > self.threshold_db
+
+    def observe(self, rms):
+        """Updates the estimate with a frame's RMS; returns is_loud(rms) before the update."""
+        if self.rms is None:
+            self.rms = max(rms, MIN_NOISE_RMS)
+            return False
+        loud = self.is_loud(rms)
+        if loud:
+            self.rms *= NOISE_RISE
+        else:
+            self.rms = max(MIN_NOISE_RMS, (1 - NOISE_ADAPTATION) * self.rms + NOISE_ADAPTATION * rms)
+        return loud
+
+class VoiceActivityDetector:
+    """
+    Frame-level speech detection: an energy gate over the noise floor,
+    refined by webrtcvad when it is installed. Without noise_floor the
+    detector keeps its own, updated with every frame it sees; a shared
+    noise_floor (e.g. the microphone service's) is only read.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, threshold_db=VAD_THRESHOLD_DB, aggressiveness=VAD_AGGRESSIVENESS,
+                 noise_floor=None):
+        self.sample_rate = sample_rate
+        self.owns_noise_floor = noise_floor is None
+        self.noise_floor = NoiseFloor(threshold_db) if noise_floor is None else noise_floor
+        self._webrtc = webrtcvad.Vad(aggressiveness) if webrtcvad is not None else None
+
+    def is_speech(self, frame):
+        rms = frame_rms(frame)
+        if self.owns_noise_floor:
+            loud = self.noise_floor.observe(rms)
+        else:
+            loud = self.noise_floor.is_loud(rms)
+        if not loud:
+            return False
+        if self._webrtc is not None:
+            return self._webrtc.is_speech(frame, self.sample_rate)
+        return True
+
+def _hz_to_mel(hz):
+    return 2595.0 * np.log10(1.0 + hz / 700.0)
+
+def _mel_to_hz(mel):
+    return 700.0 * (10 ** (mel / 2595.0) - 1.0)
+
+def mfcc(samples, sample_rate=SAMPLE_RATE, n_mfcc=13, n_mels=26, n_fft=512):
+    """MFCCs (25 ms windows, 10 ms step) with cepstral mean normalization."""
+    samples = np.asarray(samples, dtype=np.float32)
+    emphasized = np.append(samples[:1], samples[1:] - 0.97 * samples[:-1])
+    frame_length = int(0.025 * sample_rate)
+    step = int(0.010 * sample_rate)
+    if len(emphasized) < frame_length:
+        emphasized = np.pad(emphasized, (0, frame_length - len(emphasized)))
+    count = 1 + (len(emphasized) - frame_length) // step
+    indices = np.arange(frame_length)[None, :] + step * np.arange(count)[:, None]
+    frames = emphasized[indices] * np.hamming(frame_length)
+    power = np.abs(np.fft.rfft(frames, n_fft)) ** 2 / n_fft
+
+    mel_points = np.linspace(_hz_to_mel(0.0), _hz_to_mel(sample_rate / 2), n_mels + 2)
+    bins = np.floor((n_fft + 1) * _mel_to_hz(mel_points) / sample_rate).astype(int)
+    filters = np.zeros((n_mels, n_fft // 2 + 1), dtype=np.float32)
+    for index in range(1, n_mels + 1):
+        left, center, right = bins[index - 1], bins[index], bins[index + 1]
+        if center > left:
+            filters[index - 1, left:center] = (np.arange(left, center) - left) / (center - left)
+        if right > center:
+            filters[index - 1, center:right] = (right - np.arange(center, right)) / (right - center)
+    energies = np.log(power @ filters.T + 1e-10)
+
+    basis = np.cos(np.pi * np.arange(n_mfcc)[:, None] * (2 * np.arange(n_mels) + 1) / (2 * n_mels))
+    coefficients = energies @ basis.T
+    return coefficients - coefficients.mean(axis=0)
+
+def dtw_distance(first, second):
+    """DTW distance between two feature sequences, normalized by their lengths."""
+    cost = np.sqrt(((first[:, None, :] - second[None, :, :]) ** 2).sum(axis=-1))
+    rows, columns = cost.shape
+    total = np.full((rows + 1, columns + 1), np.inf)
+    total[0, 0] = 0.0
+    for row in range(1, rows + 1):
+        for column in range(1, columns + 1):
+            total[row, column] = cost[row - 1, column - 1] + min(
+                total[row - 1, column], total[row, column - 1], total[row - 1, column - 1])
+    return total[rows, columns] / (rows + columns)
+
+def read_wav(path, sample_rate=SAMPLE_RATE):
+    """Returns the WAV file as 16-bit mono PCM bytes at sample_rate."""
+    with wave.open(path, "rb") as file:
+        channels = file.getnchannels()
+        rate = file.getframerate()
+        if file.getsampwidth() != 2:
+            raise ValueError(f"{path}: only 16-bit WAV files are supported")
+        samples = np.frombuffer(file.readframes(file.getnframes()), dtype=np.int16)
+    samples = samples.reshape(-1, channels).mean(axis=1)
+    if rate != sample_rate:
+        duration = len(samples) / rate
+        target = np.arange(int(duration * sample_rate)) / sample_rate
+        samples = np.interp(target, np.arange(len(samples)) / rate, samples)
+    return samples.astype(np.int16).tobytes()
+
+def trim_silence(audio, sample_rate=SAMPLE_RATE):
+    """The audio between the first and last voiced frame (all of it if none is voiced)."""
+    vad = VoiceActivityDetector(sample_rate)
+    frame_bytes = sample_rate * FRAME_MS // 1000 * 2
+    voiced = [offset for offset in range(0, len(audio) - frame_bytes + 1, frame_bytes)
+              if vad.is_speech(audio[offset:offset + frame_bytes])]
+    if not voiced:
+        return audio
+    return audio[voiced[0]:voiced[-1] + frame_bytes]
+
+class TemplateKeywordMatcher:
+    """Matches a segment against recorded wake-word examples with MFCC + DTW."""
+    name = "template"
+
+    def __init__(self, template_paths, threshold=TEMPLATE_THRESHOLD, sample_rate=SAMPLE_RATE):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.templates = [
+            mfcc(np.frombuffer(trim_silence(read_wav(path, sample_rate), sample_rate), dtype=np.int16), sample_rate)
+            for path in template_paths
+        ]
+
+    def score(self, segment):
+        """Smallest DTW distance from the segment to a template."""
+        features = mfcc(np.frombuffer(segment, dtype=np.int16), self.sample_rate)
+        return min(dtw_distance(features, template) for template in self.templates)
+
+    def match(self, segment):
+        """Returns (matched, description)."""
+        score = self.score(segment)
+        return score <= self.threshold, f"distancia {score:.1f}"
+
+class VoskKeywordMatcher:
+    """Recognizes the segment with vosk, restricted to VOSK_GRAMMAR."""
+    name = "vosk"
+
+    def __init__(self, model_path=VOSK_MODEL_PATH, grammar=VOSK_GRAMMAR, sample_rate=SAMPLE_RATE):
+        vosk.SetLogLevel(-1)
+        self.model = vosk.Model(model_path)
+        self.grammar = json.dumps(grammar, ensure_ascii=False)
+        self.sample_rate = sample_rate
+
+    def match(self, segment):
+        recognizer = vosk.KaldiRecognizer(self.model, self.sample_rate, self.grammar)
+        recognizer.AcceptWaveform(segment)
+        text = json.loads(recognizer.FinalResult()).get("text", "")
+        return contains_activation_phrase(text), text
+
+class CloudKeywordMatcher:
+    """Fallback: sends the voiced segment to Google Speech Recognition."""
+    name = "cloud"
+
+    def __init__(self, recognizer=None, sample_rate=SAMPLE_RATE):
+        self.recognizer = recognizer or sr.Recognizer()
+        self.sample_rate = sample_rate
+
+    def match(self, segment):
+        audio = sr.AudioData(segment, self.sample_rate, 2)
+        try:
+            text = self.recognizer.recognize_google(audio, language="es-ES").lower()
+        except sr.UnknownValueError:
+            return False, ""
+        except sr.RequestError as e:
+            print(f"Error con el servicio de reconocimiento de voz: {e}")
+            return False, ""
+        return contains_activation_phrase(text), text
+
+def create_matcher(sample_rate=SAMPLE_RATE):
+    """The best keyword matcher available on this machine."""
+    if vosk is not None and os.path.isdir(VOSK_MODEL_PATH):
+        return VoskKeywordMatcher(sample_rate=sample_rate)
+    templates = sorted(glob.glob(os.path.join(WAKE_WORD_TEMPLATE_DIR, "*.wav")))
+    if templates:
+        return TemplateKeywordMatcher(templates, sample_rate=sample_rate)
+    print("No local wake-word matcher available (vosk model or wake_word/*.wav), using the cloud for voiced segments")
+    return CloudKeywordMatcher(sample_rate=sample_rate)
+
+_matcher = None
+_matcher_lock = threading.Lock()
+
+def get_matcher():
+    """The shared keyword matcher (models are loaded once)."""
+    global _matcher
+    with _matcher_lock:
+        if _matcher is None:
+            _matcher = create_matcher()
+        return _matcher
+
+class WakeWordDetector:
+    """
+    Feeds microphone frames (FRAME_MS of 16-bit mono PCM) through the VAD,
+    cuts voiced segments and asks the matcher about each one. segments and
+    triggers count the segments checked and the detections.
+    """
+
+    def __init__(self, matcher=None, vad=None, sample_rate=SAMPLE_RATE, frame_ms=FRAME_MS):
+        self.matcher = matcher if matcher is not None else get_matcher()
+        self.vad = vad if vad is not None else VoiceActivityDetector(sample_rate)
+        self.hangover_frames = SEGMENT_HANGOVER_MS // frame_ms
+        self.min_speech_frames = SEGMENT_MIN_SPEECH_MS // frame_ms
+        self.max_frames = SEGMENT_MAX_MS // frame_ms
+        self.segments = 0
+        self.triggers = 0
+        self.last_text = ""
+        self._frames = []
+        self._speech_frames = 0
+        self._silence_frames = 0
+
+    def reset(self):
+        self._frames = []
+        self._speech_frames = 0
+        self._silence_frames = 0
+
+    def process(self, frame):
+        """Adds one frame. Returns True when the segment it ends contains the wake word."""
+        if self.vad.is_speech(frame):
+            self._frames.append(frame)
+            self._speech_frames += 1
+            self._silence_frames = 0
+        elif self._frames:
+            self._frames.append(frame)
+            self._silence_frames += 1
+        if not self._frames:
+            return False
+        if self._silence_frames < self.hangover_frames and len(self._frames) < self.max_frames:
+            return False
+        segment = b"".join(self._frames)
+        enough_speech = self._speech_frames >= self.min_speech_frames
+        self.reset()
+        if not enough_speech:
+            return False
+        self.segments += 1
+        matched, self.last_text = self.matcher.match(segment)
+        if self.last_text:
+            print(f"Escuchado: {self.last_text}")
+        if matched:
+            self.triggers += 1
+        return matched
+
+    def wait(self, read_frame):
+        """Reads frames with read_frame() until the wake word is detected."""
+        self.reset()
+        while not self.process(read_frame()):
+            pass
+
+class UtteranceRecorder:
+    """
+    Captures one utterance from a stream of frames. A ring buffer keeps the
+    last PRE_ROLL_MS of audio, so the utterance includes the onset the VAD
+    missed; it ends after UTTERANCE_END_SILENCE_MS of silence (trailing
+    silence trimmed) or at UTTERANCE_MAX_MS.
+    """
+
+    def __init__(self, vad=None, sample_rate=SAMPLE_RATE, frame_ms=FRAME_MS, pre_roll_ms=PRE_ROLL_MS,
+                 end_silence_ms=UTTERANCE_END_SILENCE_MS, max_ms=UTTERANCE_MAX_MS):
+        self.vad = vad if vad is not None else VoiceActivityDetector(sample_rate)
+        self.sample_rate = sample_rate
+        self.frame_ms = frame_ms
+        self.end_silence_frames = end_silence_ms // frame_ms
+        self.max_frames = max_ms // frame_ms
+        self.ring = deque(maxlen=pre_roll_ms // frame_ms)
+
+    def record(self, read_frame, start_timeout=UTTERANCE_START_TIMEOUT):
+        """
+        Reads frames with read_frame() until an utterance has been captured and
+        returns its PCM bytes, or None if no speech started within start_timeout
+        seconds of audio.
+        """
+        self.ring.clear()
+        waited_frames = 0
+        start_frames = int(start_timeout * 1000 / self.frame_ms) if start_timeout is not None else None
+        while True:
+            frame = read_frame()
+            if self.vad.is_speech(frame):
+                break
+            self.ring.append(frame)
+            waited_frames += 1
+            if start_frames is not None and waited_frames >= start_frames:
+                return None
+        frames = list(self.ring) + [frame]
+        voiced_end = len(frames)
+        silence = 0
+        while silence < self.end_silence_frames and len(frames) < self.max_frames:
+            frame = read_frame()
+            frames.append(frame)
+            if self.vad.is_speech(frame):
+                voiced_end = len(frames)
+                silence = 0
+            else:
+                silence += 1
+        return b"".join(frames[:voiced_end + 1])
+
+    def to_audio_data(self, audio):
+        """The captured bytes as speech_recognition AudioData."""
+        return sr.AudioData(audio, self.sample_rate, 2)